@@ -1,40 +1,298 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, send_from_directory
 import sqlite3
 import os
-from datetime import datetime
-from werkzeug.utils import secure_filename
-import requests
-from bs4 import BeautifulSoup
+from datetime import datetime, timedelta
 import re
 import json
 from urllib.parse import urlencode
-import qrcode
-from io import BytesIO
+from io import BytesIO, StringIO
 import base64
+import csv
+import bisect
+import heapq
+import threading
+import math
+import gzip
+import hashlib
+import mimetypes
+import time
+import socket
+import functools
+import secrets
+import contextlib
+import contextvars
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import click
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import ClosingIterator
+from jinja2 import FileSystemBytecodeCache
+
+try:
+    import brotli
+except ImportError:  # optional: API responses fall back to gzip
+    brotli = None
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
 # QR code configuration
 app.config['QR_FOLDER'] = 'static/qr_codes'
-os.makedirs(app.config['QR_FOLDER'], exist_ok=True)
+
+# Compiled templates, reused across restarts (see create_app)
+app.config['TEMPLATE_CACHE_FOLDER'] = '.template_cache'
+
+# Raw thermal label printer (ZPL or ESC/POS over TCP, usually port 9100)
+app.config['LABEL_PRINTER_HOST'] = os.environ.get('LABEL_PRINTER_HOST')
+app.config['LABEL_PRINTER_PORT'] = int(os.environ.get('LABEL_PRINTER_PORT', 9100))
+
+# Workspaces: one database and upload folder per site. The default
+# workspace keeps tools.db and static/uploads; the others live in
+# WORKSPACES_FOLDER/<name>/. Requests pick one with a /w/<name>/ prefix or,
+# when WORKSPACE_DOMAIN is set, a <name>.<domain> host.
+app.config['DATABASE'] = 'tools.db'
+app.config['WORKSPACES_FOLDER'] = 'workspaces'
+app.config['WORKSPACE_DOMAIN'] = os.environ.get('WORKSPACE_DOMAIN')
+# Idle connections kept per workspace, and seconds before an unused
+# workspace's pool is closed
+app.config['WORKSPACE_POOL_SIZE'] = 4
+app.config['WORKSPACE_IDLE_SECONDS'] = 5 * 60
+
+DEFAULT_WORKSPACE = 'default'
+WORKSPACE_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9-]{0,39}$')
+WORKSPACE_PREFIX_RE = re.compile(r'^/w/([^/]+)(?=/|$)')
+
+# CLI commands and background jobs use TOOLSHED_WORKSPACE (or the default);
+# WorkspaceMiddleware sets it per request
+_current_workspace = contextvars.ContextVar(
+    'workspace', default=os.environ.get('TOOLSHED_WORKSPACE', DEFAULT_WORKSPACE))
+
+def current_workspace():
+    """Name of the workspace the current request or job is working in"""
+    return _current_workspace.get()
+
+@contextlib.contextmanager
+def use_workspace(name):
+    """Run the enclosed block against another workspace's database and uploads"""
+    token = _current_workspace.set(name)
+    try:
+        yield
+    finally:
+        _current_workspace.reset(token)
+
+def workspace_root(name=None):
+    """Folder holding a workspace's uploads/ folder"""
+    name = name or current_workspace()
+    if name == DEFAULT_WORKSPACE:
+        return os.path.dirname(app.config['UPLOAD_FOLDER'])
+    return os.path.join(app.config['WORKSPACES_FOLDER'], name)
+
+def workspace_db_path(name):
+    """Database file of a workspace"""
+    if name == DEFAULT_WORKSPACE:
+        return app.config['DATABASE']
+    return os.path.join(workspace_root(name), 'tools.db')
+
+def upload_folder(name=None):
+    """Upload folder of a workspace (the current one by default)"""
+    return os.path.join(workspace_root(name), 'uploads')
+
+def workspace_exists(name):
+    """Whether `name` is a valid workspace that has been created"""
+    if name == DEFAULT_WORKSPACE:
+        return True
+    return bool(WORKSPACE_NAME_RE.match(name)) and os.path.isfile(workspace_db_path(name))
+
+def list_workspaces():
+    """All workspace names, default first"""
+    folder = app.config['WORKSPACES_FOLDER']
+    names = os.listdir(folder) if os.path.isdir(folder) else []
+    return [DEFAULT_WORKSPACE] + sorted(name for name in names
+                                        if name != DEFAULT_WORKSPACE and workspace_exists(name))
+
+# Writes, including those behind a WITH clause. The sqlite3 module only
+# opens a transaction for a leading INSERT/UPDATE/DELETE/REPLACE, so filling
+# audit_state first also puts a WITH ... INSERT inside one.
+WRITE_STATEMENT_RE = re.compile(r'\s*(?:WITH\b.*\)\s*)?(INSERT|UPDATE|DELETE|REPLACE)\b',
+                                re.IGNORECASE | re.DOTALL)
+
+class PooledCursor(sqlite3.Cursor):
+    """Cursor that tags each write transaction with the current audit batch"""
+
+    def execute(self, sql, parameters=()):
+        self.connection.begin_audit_batch(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.begin_audit_batch(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection whose close() hands it back to its workspace's pool. The
+    first write of each transaction fills audit_state with the request's
+    audit batch for the audit triggers to read, and commit() empties it
+    again, so other connections never see a batch that isn't theirs.
+
+    That is two extra statements per write transaction (not per row),
+    about 50 µs on a one-row update. SQL functions would avoid them, but
+    triggers calling those fail on any connection that hasn't registered
+    them, such as the sqlite3 shell.
+    """
+    pool = None
+    audit_pending = False
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def begin_audit_batch(self, sql):
+        # Also covers transactions opened with an explicit BEGIN
+        if self.audit_pending and not self.in_transaction:
+            self.audit_pending = False
+        if not self.audit_pending and WRITE_STATEMENT_RE.match(sql):
+            sqlite3.Connection.execute(
+                self, 'INSERT OR REPLACE INTO audit_state (id, batch_id, context) VALUES (1, ?, ?)',
+                (audit_batch_id(), audit_context())
+            )
+            self.audit_pending = True
+
+    def commit(self):
+        if self.audit_pending and self.in_transaction:
+            sqlite3.Connection.execute(self, 'DELETE FROM audit_state')
+        self.audit_pending = False
+        super().commit()
+
+    def rollback(self):
+        self.audit_pending = False
+        super().rollback()
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+class ConnectionPool:
+    """Idle connections to one workspace database, opened on demand"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        self.last_used = time.monotonic()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        # Connections move between request threads, but only one uses each at a time
+        conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
+        # Only takes effect on a new database file; existing ones are
+        # switched over by the vacuum maintenance task
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # Readers don't block the writer; the maintenance job checkpoints the WAL
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        # Uncommitted work is discarded, as closing a plain connection would
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self.closed and len(self._idle) < self.size and conn not in self._idle:
+                self._idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+_pools = {}
+# Reentrant: opening a pool runs init_db, which calls back into get_db
+_pools_lock = threading.RLock()
+_pools_swept_at = time.monotonic()
+
+def workspace_pool(name):
+    """
+    The connection pool for a workspace, opening it (and bringing its schema
+    up to date) on first use. Pools idle for WORKSPACE_IDLE_SECONDS are
+    closed as other workspaces are used.
+    """
+    global _pools_swept_at
+    with _pools_lock:
+        now = time.monotonic()
+        if now - _pools_swept_at > 60:
+            _pools_swept_at = now
+            for idle_name, pool in list(_pools.items()):
+                if idle_name != name and now - pool.last_used > app.config['WORKSPACE_IDLE_SECONDS']:
+                    del _pools[idle_name]
+                    pool.close()
+
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ConnectionPool(workspace_db_path(name), app.config['WORKSPACE_POOL_SIZE'])
+            with use_workspace(name):
+                init_db()
+        return pool
 
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('tools.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get database connection for the current workspace"""
+    return workspace_pool(current_workspace()).acquire()
+
+class WorkspaceLocal:
+    """One instance of an in-memory index per workspace, created on first use"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        name = current_workspace()
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.setdefault(name, self._factory())
+        return getattr(instance, attr)
 
 def init_db():
     """Initialize the database with tables"""
     conn = get_db()
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+        # Already current; the DDL below only matters for older databases
+        conn.close()
+        return
     c = conn.cursor()
-    
+
+    # Audit batch of the transaction in progress (see PooledConnection);
+    # created first, as every write goes through it
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS audit_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            batch_id INTEGER,
+            context TEXT
+        )
+    ''')
+
     # Tools table
     c.execute('''
         CREATE TABLE IF NOT EXISTS tools (
@@ -150,21 +408,945 @@ def init_db():
         )
     ''')
 
+    # Tool <-> consumable compatibility links (indexed both ways)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tool_consumable (
+            tool_id INTEGER NOT NULL REFERENCES tools(id) ON DELETE CASCADE,
+            consumable_id INTEGER NOT NULL REFERENCES consumables(id) ON DELETE CASCADE,
+            PRIMARY KEY (tool_id, consumable_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tool_consumable_consumable ON tool_consumable(consumable_id, tool_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tools_name_nocase ON tools(name COLLATE NOCASE)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tools_model_nocase ON tools(model COLLATE NOCASE)')
+
+    # Storage location tree. `path` is the materialized path of ids
+    # (e.g. '/1/4/9/') so a whole subtree is one range scan on its index.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER REFERENCES locations(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            full_name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_locations_path ON locations(path)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_locations_parent ON locations(parent_id)')
+
+    # Per-table data versions, bumped by triggers on every write so caches
+    # can tell whether a table changed without scanning it
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in VERSIONED_TABLES:
+        c.execute('INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+    # Generic key/value state for background jobs (watermarks, last runs)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_state (
+            name TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Quantity change history, recorded by triggers on the stocked tables
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stock_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity REAL,
+            delta REAL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_stock_history_item ON stock_history(item_type, item_id, id)')
+
+    # Usage forecasts per stocked item, updated incrementally from stock_history
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stock_forecasts (
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity REAL,
+            usage_rate REAL,
+            usage_variance REAL DEFAULT 0,
+            last_change_at TEXT,
+            stockout_date TEXT,
+            reorder_point REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (item_type, item_id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_stock_forecasts_stockout ON stock_forecasts(stockout_date)')
+
+    for item_type, table in STOCKED_TABLES.items():
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stock_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO stock_history (item_type, item_id, quantity, delta)
+                VALUES ('{item_type}', NEW.id, NEW.quantity, NEW.quantity);
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stock_update
+            AFTER UPDATE OF quantity ON {table}
+            WHEN NEW.quantity IS NOT OLD.quantity
+            BEGIN
+                INSERT INTO stock_history (item_type, item_id, quantity, delta)
+                VALUES ('{item_type}', NEW.id, NEW.quantity, NEW.quantity - OLD.quantity);
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stock_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM stock_forecasts WHERE item_type = '{item_type}' AND item_id = OLD.id;
+            END
+        ''')
+
+    # Projects and their bill of materials
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            status TEXT DEFAULT 'Planned',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS project_requirements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            item_type TEXT,
+            item_id INTEGER,
+            item_name TEXT,
+            quantity REAL NOT NULL DEFAULT 1,
+            unit TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_project_requirements_project ON project_requirements(project_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_project_requirements_item ON project_requirements(item_type, item_id)')
+
+    # Tool maintenance: recurring schedules (by time and/or usage hours)
+    # and a service log. next_due is only recomputed on writes.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL REFERENCES tools(id) ON DELETE CASCADE,
+            task TEXT NOT NULL,
+            interval_days INTEGER,
+            interval_hours REAL,
+            last_done_at TEXT,
+            last_done_hours REAL,
+            next_due TEXT,
+            next_due_hours REAL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_schedules_due ON maintenance_schedules(next_due)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_schedules_tool ON maintenance_schedules(tool_id)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL REFERENCES tools(id) ON DELETE CASCADE,
+            schedule_id INTEGER REFERENCES maintenance_schedules(id) ON DELETE SET NULL,
+            task TEXT NOT NULL,
+            performed_at TEXT NOT NULL,
+            usage_hours REAL,
+            cost REAL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_log_tool ON maintenance_log(tool_id, performed_at)')
+
+    # Tool loans. Partial indexes cover only open loans, so "who has what"
+    # and the overdue sweep stay small lookups however long the history gets.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS loans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL REFERENCES tools(id) ON DELETE CASCADE,
+            borrower TEXT NOT NULL COLLATE NOCASE,
+            lent_at TEXT NOT NULL,
+            due_at TEXT,
+            returned_at TEXT,
+            return_condition TEXT,
+            overdue INTEGER NOT NULL DEFAULT 0,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_loans_open_tool ON loans(tool_id) WHERE returned_at IS NULL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_loans_open_due ON loans(due_at) WHERE returned_at IS NULL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_loans_borrower ON loans(borrower, lent_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_loans_tool ON loans(tool_id, lent_at)')
+
+    # Battery platforms, packs (charge level in percent, cycles as full-cycle
+    # equivalents) and which platforms each tool takes
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS battery_platforms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            brand TEXT,
+            voltage REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batteries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform_id INTEGER NOT NULL REFERENCES battery_platforms(id) ON DELETE CASCADE,
+            label TEXT,
+            capacity_ah REAL,
+            charge_level INTEGER NOT NULL DEFAULT 100,
+            cycle_count REAL NOT NULL DEFAULT 0,
+            last_charged_at TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_batteries_platform ON batteries(platform_id, charge_level)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tool_battery_platform (
+            tool_id INTEGER NOT NULL REFERENCES tools(id) ON DELETE CASCADE,
+            platform_id INTEGER NOT NULL REFERENCES battery_platforms(id) ON DELETE CASCADE,
+            PRIMARY KEY (tool_id, platform_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tool_battery_platform_platform ON tool_battery_platform(platform_id, tool_id)')
+
+    # Uploaded images, stored once per content hash. refcount is kept by
+    # triggers on each table's image_path; unreferenced files are swept
+    # by the upload GC once orphaned_at is older than the grace period.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            path TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            orphaned_at TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_images_hash ON images(hash)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_images_orphaned ON images(orphaned_at) WHERE refcount <= 0')
+
+    for table in IMAGE_TABLES:
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_image_insert
+            AFTER INSERT ON {table}
+            WHEN NEW.image_path IS NOT NULL
+            BEGIN
+                UPDATE images SET refcount = refcount + 1, orphaned_at = NULL WHERE path = NEW.image_path;
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_image_update
+            AFTER UPDATE OF image_path ON {table}
+            WHEN NEW.image_path IS NOT OLD.image_path
+            BEGIN
+                UPDATE images SET refcount = refcount - 1,
+                                  orphaned_at = CASE WHEN refcount <= 1 THEN CURRENT_TIMESTAMP END
+                WHERE path = OLD.image_path;
+                UPDATE images SET refcount = refcount + 1, orphaned_at = NULL WHERE path = NEW.image_path;
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_image_delete
+            AFTER DELETE ON {table}
+            WHEN OLD.image_path IS NOT NULL
+            BEGIN
+                UPDATE images SET refcount = refcount - 1,
+                                  orphaned_at = CASE WHEN refcount <= 1 THEN CURRENT_TIMESTAMP END
+                WHERE path = OLD.image_path;
+            END
+        ''')
+
+    # Local product catalogue keyed by GTIN (barcodes normalised to 14
+    # digits), filled from Bunnings search results and bulk imports. A
+    # product can be linked to the inventory item it was added as, so
+    # rescanning it restocks that item.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS product_catalogue (
+            gtin TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            brand TEXT,
+            model TEXT,
+            category TEXT,
+            unit TEXT,
+            pack_quantity REAL NOT NULL DEFAULT 1,
+            price REAL,
+            url TEXT,
+            image_url TEXT,
+            source TEXT,
+            item_type TEXT,
+            item_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    # Old and new row images of every write to AUDITED_TABLES, for undo.
+    # Writes made outside the app (e.g. the sqlite3 shell) have no batch.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY,
+            batch_id INTEGER,
+            context TEXT,
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            action TEXT NOT NULL,
+            old_row TEXT,
+            new_row TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            undone_by INTEGER
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_batch ON audit_log(batch_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_row ON audit_log(table_name, row_key, id)')
+
+    # Product prices seen by searches and the price refresher, one row per
+    # run of unchanged prices at a URL
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS price_observations (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            price REAL NOT NULL,
+            source TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_price_observations_url ON price_observations(url, last_seen)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_product_catalogue_item ON product_catalogue(item_type, item_id)')
+
+    # One row per database maintenance task run, with its timings
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER PRIMARY KEY,
+            task TEXT NOT NULL,
+            result TEXT,
+            duration_ms REAL,
+            pages_before INTEGER,
+            pages_after INTEGER,
+            free_pages_before INTEGER,
+            free_pages_after INTEGER,
+            probe_before_ms REAL,
+            probe_after_ms REAL,
+            ran_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    run_migrations(conn)
+    # After the migrations, so the triggers capture every current column
+    install_audit_triggers(conn)
+
     conn.commit()
     conn.close()
 
+def migrate_compatible_with_links(conn):
+    """Parse existing free-text compatible_with values into tool_consumable links"""
+    consumables = conn.execute('''
+        SELECT id, compatible_with FROM consumables
+        WHERE compatible_with IS NOT NULL AND compatible_with != ''
+    ''').fetchall()
+    for consumable in consumables:
+        link_consumable_to_tools(conn, consumable['id'], consumable['compatible_with'])
+
+def add_column_if_missing(conn, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    # table_xinfo, unlike table_info, lists generated columns too
+    columns = [row['name'] for row in conn.execute(f'PRAGMA table_xinfo({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def migrate_location_tree(conn):
+    """Link every inventory row to the locations tree, parsed from its location text"""
+    for table in LOCATION_TABLES:
+        add_column_if_missing(conn, table, 'location_id', 'INTEGER REFERENCES locations(id) ON DELETE SET NULL')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_location ON {table}(location_id)')
+
+        rows = conn.execute(f'''
+            SELECT id, location FROM {table}
+            WHERE location IS NOT NULL AND location != ''
+        ''').fetchall()
+        for row in rows:
+            set_item_location(conn, table, row['id'], row['location'])
+
+def migrate_tool_usage_hours(conn):
+    """Track tool usage hours for usage-based maintenance intervals"""
+    add_column_if_missing(conn, 'tools', 'usage_hours', 'REAL DEFAULT 0')
+
+def migrate_upload_images(conn):
+    """
+    Register existing uploads in the images table with their reference
+    counts, and point rows using byte-identical copies at a single file so
+    the duplicates become orphans for the GC
+    """
+    folder = upload_folder()
+    filenames = os.listdir(folder) if os.path.isdir(folder) else []
+    for filename in sorted(filenames):
+        full_path = os.path.join(folder, filename)
+        if filename.startswith('.') or not os.path.isfile(full_path):
+            continue
+        with open(full_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        conn.execute('''
+            INSERT OR IGNORE INTO images (path, hash, size, orphaned_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (f'uploads/{filename}', digest, os.path.getsize(full_path)))
+
+    references = ' UNION ALL '.join(f'SELECT image_path FROM {table}' for table in IMAGE_TABLES)
+    conn.execute(f'''
+        UPDATE images SET refcount = (
+            SELECT COUNT(*) FROM ({references}) r WHERE r.image_path = images.path
+        )
+    ''')
+    conn.execute('UPDATE images SET orphaned_at = NULL WHERE refcount > 0')
+
+    duplicates = conn.execute('''
+        SELECT path, hash FROM images
+        WHERE hash IN (SELECT hash FROM images GROUP BY hash HAVING COUNT(*) > 1)
+        ORDER BY hash, refcount DESC, path
+    ''').fetchall()
+    keeper = {}
+    for image in duplicates:
+        if image['hash'] not in keeper:
+            keeper[image['hash']] = image['path']
+            continue
+        # The image_path triggers move the references across
+        for table in IMAGE_TABLES:
+            conn.execute(f'UPDATE {table} SET image_path = ? WHERE image_path = ?',
+                         (keeper[image['hash']], image['path']))
+
+def migrate_fastener_specs(conn):
+    """Add numeric fastener spec columns and parse them from the free-text fields"""
+    add_column_if_missing(conn, 'fasteners', 'diameter_mm', 'REAL')
+    add_column_if_missing(conn, 'fasteners', 'length_mm', 'REAL')
+    add_column_if_missing(conn, 'fasteners', 'pitch_mm', 'REAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fasteners_spec ON fasteners(diameter_mm, length_mm, pitch_mm)')
+    backfill_fastener_specs(conn)
+
+def migrate_product_catalogue(conn):
+    """Nothing to move: init_db creates product_catalogue for databases below this version"""
+
+def migrate_audit_log(conn):
+    """Nothing to move: init_db creates audit_log and its triggers for databases below this version"""
+
+def migrate_image_hashes(conn):
+    """Add perceptual hash columns to images; existing uploads are hashed by the backfill"""
+    add_column_if_missing(conn, 'images', 'phash', 'INTEGER')
+    add_column_if_missing(conn, 'images', 'dhash', 'INTEGER')
+
+def migrate_price_observations(conn):
+    """Mark shopping list costs filled in from observed prices, and fill them on insert"""
+    add_column_if_missing(conn, 'shopping_list', 'auto_cost', 'INTEGER NOT NULL DEFAULT 0')
+    install_shopping_price_trigger(conn)
+
+def add_base_unit_columns(conn):
+    """
+    Add the quantities converted to base units (see UNITS) as generated
+    columns, so stock levels compare and add up across units in SQL.
+    Generated columns are left out of table_info, so the API and the audit
+    log never write them.
+    """
+    for table in ('consumables', 'materials'):
+        add_column_if_missing(conn, table, 'base_unit', f'TEXT GENERATED ALWAYS AS ({unit_base_sql("unit")}) VIRTUAL')
+        add_column_if_missing(conn, table, 'base_quantity',
+                              f'REAL GENERATED ALWAYS AS (quantity * {unit_factor_sql("unit")}) VIRTUAL')
+        # A min_unit of a different kind from the stock unit is ignored
+        add_column_if_missing(conn, table, 'base_min_quantity', f'''REAL GENERATED ALWAYS AS (
+            min_quantity * CASE WHEN NULLIF(TRIM(min_unit), '') IS NOT NULL
+                                 AND {unit_base_sql("min_unit")} = base_unit
+                                THEN {unit_factor_sql("min_unit")} ELSE {unit_factor_sql("unit")} END
+        ) VIRTUAL''')
+    # Fasteners are always counted in pieces
+    add_column_if_missing(conn, 'fasteners', 'base_unit', "TEXT GENERATED ALWAYS AS ('pcs') VIRTUAL")
+    add_column_if_missing(conn, 'fasteners', 'base_quantity', 'REAL GENERATED ALWAYS AS (quantity) VIRTUAL')
+    add_column_if_missing(conn, 'fasteners', 'base_min_quantity', 'REAL GENERATED ALWAYS AS (min_quantity) VIRTUAL')
+    add_column_if_missing(conn, 'shopping_list', 'base_unit', f'TEXT GENERATED ALWAYS AS ({unit_base_sql("unit")}) VIRTUAL')
+    add_column_if_missing(conn, 'shopping_list', 'base_quantity',
+                          f'REAL GENERATED ALWAYS AS (COALESCE(quantity, 1) * {unit_factor_sql("unit")}) VIRTUAL')
+
+def migrate_base_units(conn):
+    """Add min_unit (the unit min_quantity is in, when it differs from the stock unit) and the base-unit columns"""
+    for table in ('consumables', 'materials'):
+        add_column_if_missing(conn, table, 'min_unit', 'TEXT')
+    add_base_unit_columns(conn)
+
+def migrate_maintenance_runs(conn):
+    """Nothing to move: init_db creates maintenance_runs for databases below this version"""
+
+def migrate_audit_state(conn):
+    """
+    Allow audit_log rows without a batch, and drop the audit triggers that
+    called the audit_batch()/audit_context() SQL functions, which made every
+    audited table read-only to connections that had not registered them.
+    install_audit_triggers recreates them reading audit_state instead.
+    """
+    for table in AUDITED_TABLES:
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_audit_{event}')
+
+    batch_column = conn.execute("SELECT \"notnull\" FROM pragma_table_info('audit_log') WHERE name = 'batch_id'").fetchone()
+    if not batch_column['notnull']:
+        return
+    conn.execute('''
+        CREATE TABLE audit_log_new (
+            id INTEGER PRIMARY KEY,
+            batch_id INTEGER,
+            context TEXT,
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            action TEXT NOT NULL,
+            old_row TEXT,
+            new_row TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            undone_by INTEGER
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO audit_log_new (id, batch_id, context, table_name, row_key, action, old_row, new_row,
+                                   changed_at, undone_by)
+        SELECT id, batch_id, context, table_name, row_key, action, old_row, new_row, changed_at, undone_by
+        FROM audit_log
+    ''')
+    conn.execute('DROP TABLE audit_log')
+    conn.execute('ALTER TABLE audit_log_new RENAME TO audit_log')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_batch ON audit_log(batch_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_row ON audit_log(table_name, row_key, id)')
+
+def migrate_portable_base_units(conn):
+    """
+    Rebuild base-unit columns first defined with the unit_base()/unit_factor()
+    SQL functions, which left the tables unreadable to any connection that
+    had not registered them (the sqlite3 shell, backups, DB browsers)
+    """
+    for table in ('consumables', 'materials', 'shopping_list'):
+        schema = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if 'unit_factor(' not in schema['sql']:
+            continue
+        columns = [row['name'] for row in conn.execute(f'PRAGMA table_xinfo({table})')]
+        for column in ('base_min_quantity', 'base_quantity', 'base_unit'):
+            if column in columns:
+                conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+    add_base_unit_columns(conn)
+
+def migrate_reparse_fastener_specs(conn):
+    """Re-parse fastener specs stored before 'M3x4' was read as a length and 'M6x1.0x20' understood"""
+    backfill_fastener_specs(conn)
+
+# Data migrations, applied in order and tracked with PRAGMA user_version.
+# init_db skips its DDL once user_version is current, so a new table or
+# index there needs an entry here as well (a no-op one is enough).
+MIGRATIONS = [
+    migrate_compatible_with_links,
+    migrate_location_tree,
+    migrate_tool_usage_hours,
+    migrate_upload_images,
+    migrate_fastener_specs,
+    migrate_product_catalogue,
+    migrate_audit_log,
+    migrate_image_hashes,
+    migrate_price_observations,
+    migrate_base_units,
+    migrate_maintenance_runs,
+    migrate_portable_base_units,
+    migrate_audit_state,
+    migrate_reparse_fastener_specs,
+]
+
+def run_migrations(conn):
+    """Apply any data migrations newer than the database's user_version"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {number}')
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def parse_compatible_with(text):
+    """
+    Split a free-text compatible_with value into tool names.
+    Entries are separated by commas, semicolons, pipes or newlines.
+    """
+    if not text:
+        return []
+    names = [name.strip() for name in re.split(r'[,;|\n]', text)]
+    return [name for name in names if name]
+
+def link_consumable_to_tools(conn, consumable_id, compatible_with):
+    """
+    Rebuild the tool links for one consumable from its compatible_with text.
+    Each entry must match a tool's name or model exactly (case-insensitive),
+    so "Drill" no longer matches "Drill Press".
+    """
+    conn.execute('DELETE FROM tool_consumable WHERE consumable_id = ?', (consumable_id,))
+
+    names = parse_compatible_with(compatible_with)
+    if not names:
+        return
+
+    placeholders = ', '.join('?' * len(names))
+    conn.execute(f'''
+        INSERT OR IGNORE INTO tool_consumable (tool_id, consumable_id)
+        SELECT id, ? FROM tools
+        WHERE name COLLATE NOCASE IN ({placeholders})
+           OR model COLLATE NOCASE IN ({placeholders})
+    ''', [consumable_id] + names + names)
+
+def link_tool_to_consumables(conn, tool_id, name, model=None):
+    """Rebuild the consumable links for one tool after it is added or renamed"""
+    conn.execute('DELETE FROM tool_consumable WHERE tool_id = ?', (tool_id,))
+
+    keys = {key.strip().lower() for key in (name, model) if key and key.strip()}
+    if not keys:
+        return
+
+    # LIKE narrows the candidates; exact entry matching happens in Python
+    conditions = ' OR '.join('compatible_with LIKE ?' for _ in keys)
+    candidates = conn.execute(f'''
+        SELECT id, compatible_with FROM consumables WHERE {conditions}
+    ''', [f'%{key}%' for key in keys]).fetchall()
+
+    for consumable in candidates:
+        entries = {entry.lower() for entry in parse_compatible_with(consumable['compatible_with'])}
+        if entries & keys:
+            conn.execute(
+                'INSERT OR IGNORE INTO tool_consumable (tool_id, consumable_id) VALUES (?, ?)',
+                (tool_id, consumable['id'])
+            )
+
+# Tables whose writes are tracked in data_versions
+VERSIONED_TABLES = ['tools', 'consumables', 'materials', 'fasteners', 'shopping_list']
+
+def get_data_version(conn, *tables):
+    """Current data version of the given tables, usable as a cache key"""
+    placeholders = ', '.join('?' * len(tables))
+    rows = conn.execute(
+        f'SELECT name, version FROM data_versions WHERE name IN ({placeholders})', tables
+    ).fetchall()
+    versions = {row['name']: row['version'] for row in rows}
+    return tuple(versions.get(table) for table in tables)
+
+# Tables with an image_path column pointing into static/uploads
+IMAGE_TABLES = ['tools', 'consumables', 'materials', 'fasteners']
+
+# Tables with a quantity column, keyed by item type
+STOCKED_TABLES = {'consumable': 'consumables', 'material': 'materials', 'fastener': 'fasteners'}
+
+def stocked_item_name(item_type, item):
+    """Display name of a stocked item row; fasteners have no name column, so theirs is built from the size"""
+    if item_type == 'fastener':
+        return f"{item['category']} {item['size']} x {item['length']}" if item['length'] else f"{item['category']} {item['size']}"
+    return item['name']
+
+# Unit registry: symbol -> (base unit, size in base units, other spellings).
+# Units sharing a base convert into each other. Packaging units (sheets,
+# boxes, ...) are their own base, as their size varies by product.
+UNITS = {
+    'pcs': ('pcs', 1, ('pc', 'piece', 'pieces', 'each', 'ea')),
+    'dozen': ('pcs', 12, ('doz',)),
+    'mm': ('m', 0.001, ('millimetre', 'millimetres', 'millimeter', 'millimeters')),
+    'cm': ('m', 0.01, ('centimetre', 'centimetres', 'centimeter', 'centimeters')),
+    'm': ('m', 1, ('metre', 'metres', 'meter', 'meters', 'lm')),
+    'in': ('m', 0.0254, ('inch', 'inches')),
+    'ft': ('m', 0.3048, ('foot', 'feet')),
+    'm²': ('m²', 1, ('m2', 'sqm', 'sq m', 'square metres', 'square meters')),
+    'ft²': ('m²', 0.09290304, ('ft2', 'sqft', 'sq ft', 'square feet')),
+    'g': ('kg', 0.001, ('gram', 'grams')),
+    'kg': ('kg', 1, ('kgs', 'kilogram', 'kilograms')),
+    'lb': ('kg', 0.45359237, ('lbs', 'pound', 'pounds')),
+    'ml': ('L', 0.001, ('millilitre', 'millilitres', 'milliliter', 'milliliters')),
+    'L': ('L', 1, ('ltr', 'litre', 'litres', 'liter', 'liters')),
+    'sheets': ('sheets', 1, ('sheet',)),
+    'boards': ('boards', 1, ('board',)),
+    'rolls': ('rolls', 1, ('roll',)),
+    'sets': ('sets', 1, ('set',)),
+    'boxes': ('boxes', 1, ('box',)),
+    'packs': ('packs', 1, ('pack', 'pk')),
+}
+_unit_symbols = {
+    spelling.lower(): symbol for symbol, (_, _, spellings) in UNITS.items() for spelling in (symbol, *spellings)
+}
+
+@functools.lru_cache(maxsize=256)
+def canonical_unit(unit):
+    """Registry symbol for a unit as typed ('Metres' -> 'm'); blank means pcs, unknown units pass through"""
+    key = ' '.join(str(unit or '').lower().split())
+    return _unit_symbols.get(key, key) if key else 'pcs'
+
+def unit_base(unit):
+    """Base unit a unit converts into (itself if unknown)"""
+    symbol = canonical_unit(unit)
+    return UNITS[symbol][0] if symbol in UNITS else symbol
+
+def unit_factor(unit):
+    """Size of a unit in its base unit (1 if unknown)"""
+    symbol = canonical_unit(unit)
+    return UNITS[symbol][1] if symbol in UNITS else 1
+
+def _unit_case_sql(expression, value, default):
+    """SQL CASE mapping every spelling in UNITS of a unit expression to value(symbol)"""
+    whens = ' '.join(
+        f"WHEN '{spelling}' THEN {value(symbol)}" for spelling, symbol in _unit_symbols.items()
+    )
+    return f"CASE LOWER(TRIM(COALESCE({expression}, ''))) WHEN '' THEN {value('pcs')} {whens} ELSE {default} END"
+
+def unit_base_sql(expression):
+    """
+    unit_base() as plain SQL, for the generated columns and queries. Spelled
+    out from UNITS rather than registered as a function, so the database
+    stays readable from any SQLite client.
+    """
+    return _unit_case_sql(expression, lambda symbol: f"'{UNITS[symbol][0]}'",
+                          f"LOWER(TRIM({expression}))")
+
+def unit_factor_sql(expression):
+    """unit_factor() as plain SQL (see unit_base_sql)"""
+    return _unit_case_sql(expression, lambda symbol: repr(UNITS[symbol][1]), '1')
+
+# For the minimum stock unit pickers
+app.jinja_env.globals['unit_symbols'] = list(UNITS)
+
+def convert_quantity(quantity, from_unit, to_unit):
+    """A quantity in another unit of the same kind; ValueError if the units don't convert"""
+    if unit_base(from_unit) != unit_base(to_unit):
+        raise ValueError(f'Cannot convert {from_unit or "pcs"} to {to_unit or "pcs"}')
+    return quantity * unit_factor(from_unit) / unit_factor(to_unit)
+
+def get_job_state(conn, name, default=None):
+    """Read a background job's saved state value"""
+    row = conn.execute('SELECT value FROM job_state WHERE name = ?', (name,)).fetchone()
+    return row['value'] if row else default
+
+def set_job_state(conn, name, value):
+    """Save a background job's state value"""
+    conn.execute('''
+        INSERT INTO job_state (name, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    ''', (name, str(value)))
+
+# Inventory tables that reference the locations tree
+LOCATION_TABLES = ['tools', 'consumables', 'materials', 'fasteners']
+
+def parse_location(text):
+    """Split a location string such as "Shed > Rack 2 > Bin 14" into its levels"""
+    if not text:
+        return []
+    parts = [part.strip() for part in re.split(r'[>/]', text)]
+    return [part for part in parts if part]
+
+def ensure_location(conn, text):
+    """
+    Find or create the location for a location string, creating any
+    missing parent levels. Returns the leaf location id, or None.
+    """
+    location_id = None
+    parent_path = '/'
+    parts = parse_location(text)
+
+    for depth, name in enumerate(parts, start=1):
+        full_name = ' > '.join(parts[:depth])
+        row = conn.execute('SELECT id, path FROM locations WHERE full_name = ?', (full_name,)).fetchone()
+        if row:
+            location_id, parent_path = row['id'], row['path']
+            continue
+
+        c = conn.execute(
+            'INSERT INTO locations (parent_id, name, full_name) VALUES (?, ?, ?)',
+            (location_id, name, full_name)
+        )
+        location_id = c.lastrowid
+        parent_path = f'{parent_path}{location_id}/'
+        conn.execute('UPDATE locations SET path = ? WHERE id = ?', (parent_path, location_id))
+
+    return location_id
+
+def set_item_location(conn, table, item_id, text):
+    """Point an inventory row's location_id at the tree node for its location text"""
+    conn.execute(f'UPDATE {table} SET location_id = ? WHERE id = ?', (ensure_location(conn, text), item_id))
+
+def subtree_bounds(path):
+    """Range [low, high) covering a location path and all of its descendants"""
+    # '0' is the character right after '/', so this excludes sibling paths
+    return path, path[:-1] + '0'
+
+# Autocomplete fields indexed per table: (index field, column)
+AUTOCOMPLETE_COLUMNS = {
+    'tools': [('brand', 'brand'), ('model', 'model'), ('category', 'category'), ('location', 'location')],
+    'consumables': [('category', 'category'), ('location', 'location')],
+    'materials': [('category', 'category'), ('location', 'location')],
+    'fasteners': [('category', 'category'), ('location', 'location'), ('size', 'size')],
+}
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index for autocomplete suggestions.
+    Each field keeps a sorted list of (lowercase value, value) pairs for
+    bisect prefix lookups, a usage count per value, and the same values
+    ranked most used first, so short prefixes matching much of the field
+    are answered from the top of the ranking instead of a scan.
+    Models are also indexed per brand under the field 'model:<brand>'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._counts = {}
+        self._ranked = {}
+        self._loaded = False
+
+    @staticmethod
+    def _rank(count, value):
+        return (-count, value.lower(), value)
+
+    def _add(self, field, value, count=1):
+        counts = self._counts.setdefault(field, {})
+        ranked = self._ranked.setdefault(field, [])
+        if value not in counts:
+            counts[value] = 0
+            bisect.insort(self._keys.setdefault(field, []), (value.lower(), value))
+        else:
+            del ranked[bisect.bisect_left(ranked, self._rank(counts[value], value))]
+        counts[value] += count
+        bisect.insort(ranked, self._rank(counts[value], value))
+
+    def _remove(self, field, value):
+        counts = self._counts.get(field, {})
+        if value not in counts:
+            return
+        ranked = self._ranked[field]
+        del ranked[bisect.bisect_left(ranked, self._rank(counts[value], value))]
+        counts[value] -= 1
+        if counts[value] <= 0:
+            del counts[value]
+            keys = self._keys[field]
+            pos = bisect.bisect_left(keys, (value.lower(), value))
+            if pos < len(keys) and keys[pos] == (value.lower(), value):
+                del keys[pos]
+        else:
+            bisect.insort(ranked, self._rank(counts[value], value))
+
+    @staticmethod
+    def _text(value):
+        """Index text for a column value; the API and batch add can send numbers, e.g. a size of 6"""
+        return '' if value is None else str(value).strip()
+
+    @staticmethod
+    def _row_values(table, row):
+        """Yield (field, value) pairs indexed for one row"""
+        for field, column in AUTOCOMPLETE_COLUMNS.get(table, []):
+            value = AutocompleteIndex._text(row.get(column))
+            if value:
+                yield field, value
+        if table == 'tools':
+            brand = AutocompleteIndex._text(row.get('brand'))
+            model = AutocompleteIndex._text(row.get('model'))
+            if brand and model:
+                yield f'model:{brand.lower()}', model
+
+    def load(self, conn):
+        """Build the index from the database with one GROUP BY per column"""
+        with self._lock:
+            self._keys = {}
+            self._counts = {}
+            self._ranked = {}
+            for table, columns in AUTOCOMPLETE_COLUMNS.items():
+                for field, column in columns:
+                    rows = conn.execute(f'''
+                        SELECT {column} AS value, COUNT(*) AS count FROM {table}
+                        WHERE {column} IS NOT NULL AND {column} != ''
+                        GROUP BY {column}
+                    ''').fetchall()
+                    for row in rows:
+                        self._add(field, self._text(row['value']), row['count'])
+            rows = conn.execute('''
+                SELECT brand, model, COUNT(*) AS count FROM tools
+                WHERE brand IS NOT NULL AND brand != '' AND model IS NOT NULL AND model != ''
+                GROUP BY brand, model
+            ''').fetchall()
+            for row in rows:
+                self._add(f"model:{row['brand'].strip().lower()}", row['model'].strip(), row['count'])
+            self._loaded = True
+
+    def apply(self, table, old=None, new=None):
+        """
+        Incrementally update the index after a write.
+        `old` is the row before the write (None for inserts) and `new` the
+        stored row after it (None for deletes), read back so values the
+        write normalized are indexed as saved.
+        """
+        if not self._loaded:
+            return
+        if isinstance(old, sqlite3.Row):
+            old = dict(old)
+        if isinstance(new, sqlite3.Row):
+            new = dict(new)
+        with self._lock:
+            if old:
+                for field, value in self._row_values(table, old):
+                    self._remove(field, value)
+            if new:
+                for field, value in self._row_values(table, new):
+                    self._add(field, value)
+
+    def complete(self, field, prefix='', limit=10):
+        """
+        Return up to `limit` values starting with `prefix`, most used first.
+        A narrow prefix ranks its bisected range; a broad one walks the
+        ranking until `limit` values match, which for an empty or one-letter
+        prefix usually stops within the first few dozen values.
+        """
+        if not self._loaded:
+            conn = get_db()
+            self.load(conn)
+            conn.close()
+        prefix = prefix.strip().lower()
+        with self._lock:
+            keys = self._keys.get(field, [])
+            counts = self._counts.get(field, {})
+            lo = bisect.bisect_left(keys, (prefix,))
+            hi = bisect.bisect_left(keys, (prefix + '\uffff',))
+            if (hi - lo) ** 2 <= limit * len(keys):
+                in_range = (keys[i] for i in range(lo, hi))
+                ranked = heapq.nsmallest(limit, (self._rank(counts[value], value) for _, value in in_range))
+            else:
+                matching = (rank for rank in self._ranked.get(field, []) if rank[1].startswith(prefix))
+                ranked = list(itertools.islice(matching, limit))
+        return [value for _, _, value in ranked]
+
+autocomplete_index = WorkspaceLocal(AutocompleteIndex)
+
 def generate_qr_code(item_type, item_id):
     """
     Generate QR code for an item.
     Returns base64 encoded image data.
     """
+    import qrcode  # deferred: pulls in PIL, which most requests never need
+
     # Create URL that will be encoded in QR code
-    qr_data = f"{request.host_url}scan/{item_type}/{item_id}"
+    qr_data = f"{request.url_root}scan/{item_type}/{item_id}"
 
     # Create QR code instance
     qr = qrcode.QRCode(
@@ -188,6 +1370,13 @@ def generate_qr_code(item_type, item_id):
     img_base64 = base64.b64encode(buffer.getvalue()).decode()
     return f"data:image/png;base64,{img_base64}"
 
+# Sent with Bunnings searches and price refreshes
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-NZ,en;q=0.9',
+}
+
 def scrape_bunnings_search(query):
     """
     Search Bunnings NZ for products.
@@ -197,6 +1386,11 @@ def scrape_bunnings_search(query):
     2. Using official Bunnings API if available
     3. Manual entry with URL parser
     """
+    # Deferred: the HTTP and HTML parsing stacks are slow to import and
+    # only this scrape uses them
+    import requests
+    from bs4 import BeautifulSoup
+
     try:
         search_url = f"https://www.bunnings.co.nz/search/products?q={requests.utils.quote(query)}"
 
@@ -207,13 +1401,7 @@ def scrape_bunnings_search(query):
         # - Parse a pasted product URL
 
         # Try basic scraping as fallback but expect it might not work
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-NZ,en;q=0.9',
-        }
-
-        response = requests.get(search_url, headers=headers, timeout=10)
+        response = requests.get(search_url, headers=SCRAPE_HEADERS, timeout=10)
         response.raise_for_status()
 
         # Try to extract from script tags with product data
@@ -236,6 +1424,7 @@ def scrape_bunnings_search(query):
                                 'price': product_data.get('offers', {}).get('price'),
                                 'url': product_data.get('url', search_url),
                                 'image_url': product_data.get('image'),
+                                'gtin': next((product_data[key] for key in GTIN_ALIASES if product_data.get(key)), None),
                                 'source': 'Bunnings NZ'
                             })
             except:
@@ -283,7 +1472,7 @@ def index():
     # Get low stock consumables
     low_stock_consumables = conn.execute('''
         SELECT * FROM consumables
-        WHERE quantity <= min_quantity
+        WHERE base_quantity <= base_min_quantity
         ORDER BY quantity ASC
         LIMIT 5
     ''').fetchall()
@@ -291,7 +1480,7 @@ def index():
     # Get low stock fasteners
     low_stock_fasteners = conn.execute('''
         SELECT * FROM fasteners
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
+        WHERE base_quantity <= base_min_quantity
         ORDER BY quantity ASC
         LIMIT 5
     ''').fetchall()
@@ -306,6 +1495,29 @@ def index():
     # Get favorite count
     favorite_count = conn.execute('SELECT COUNT(*) as count FROM favorites').fetchone()['count']
 
+    # Get items forecast to run out soonest (only writes when there are new stock changes)
+    update_forecasts(conn)
+    running_out = conn.execute(f'''
+        SELECT f.*, {FORECAST_NAME_SQL} AS name,
+               CAST(julianday(f.stockout_date) - julianday('now') AS INTEGER) AS days_left
+        FROM stock_forecasts f
+        WHERE f.stockout_date IS NOT NULL AND f.stockout_date <= date('now', ?)
+        ORDER BY f.stockout_date
+        LIMIT 5
+    ''', (f'+{FORECAST_LEAD_TIME_DAYS * 2} days',)).fetchall()
+
+    # Get maintenance due this week
+    maintenance_due = due_maintenance(conn, MAINTENANCE_DUE_SOON_DAYS, limit=10)
+
+    # Get overdue loans (by due date, so the page doesn't need to run the sweep)
+    overdue_loans = conn.execute('''
+        SELECT l.*, t.name AS tool_name FROM loans l
+        JOIN tools t ON t.id = l.tool_id
+        WHERE l.returned_at IS NULL AND l.due_at < ?
+        ORDER BY l.due_at
+        LIMIT 10
+    ''', (datetime.now().strftime('%Y-%m-%d'),)).fetchall()
+
     conn.close()
 
     return render_template('index.html',
@@ -316,6 +1528,9 @@ def index():
                          favorite_count=favorite_count,
                          low_stock_consumables=low_stock_consumables,
                          low_stock_fasteners=low_stock_fasteners,
+                         running_out=running_out,
+                         maintenance_due=maintenance_due,
+                         overdue_loans=overdue_loans,
                          recent_tools=recent_tools)
 
 @app.route('/tools')
@@ -325,19 +1540,25 @@ def tools():
     category = request.args.get('category', '')
     search = request.args.get('search', '')
     
-    query = 'SELECT * FROM tools WHERE 1=1'
+    # Loan status comes from the open-loan partial index in the same query
+    query = '''
+        SELECT t.*, l.id AS loan_id, l.borrower, l.due_at, l.overdue
+        FROM tools t
+        LEFT JOIN loans l ON l.tool_id = t.id AND l.returned_at IS NULL
+        WHERE 1=1
+    '''
     params = []
     
     if category:
-        query += ' AND category = ?'
+        query += ' AND t.category = ?'
         params.append(category)
     
     if search:
-        query += ' AND (name LIKE ? OR brand LIKE ? OR model LIKE ?)'
+        query += ' AND (t.name LIKE ? OR t.brand LIKE ? OR t.model LIKE ?)'
         search_term = f'%{search}%'
         params.extend([search_term, search_term, search_term])
     
-    query += ' ORDER BY name'
+    query += ' ORDER BY t.name'
     
     tools = conn.execute(query, params).fetchall()
     categories = conn.execute('SELECT DISTINCT category FROM tools ORDER BY category').fetchall()
@@ -357,9 +1578,48 @@ def tool_detail(tool_id):
     compatible = []
     if tool:
         compatible = conn.execute('''
-            SELECT * FROM consumables
-            WHERE compatible_with LIKE ?
-        ''', (f'%{tool["name"]}%',)).fetchall()
+            SELECT c.* FROM tool_consumable tc
+            JOIN consumables c ON c.id = tc.consumable_id
+            WHERE tc.tool_id = ?
+            ORDER BY c.name
+        ''', (tool_id,)).fetchall()
+
+    # Get maintenance schedules and recent service history
+    schedules = []
+    service_log = []
+    if tool:
+        schedules = conn.execute('''
+            SELECT * FROM maintenance_schedules WHERE tool_id = ? ORDER BY next_due
+        ''', (tool_id,)).fetchall()
+        service_log = conn.execute('''
+            SELECT * FROM maintenance_log WHERE tool_id = ?
+            ORDER BY performed_at DESC, id DESC LIMIT 10
+        ''', (tool_id,)).fetchall()
+
+    # Get the battery platforms it takes and how many packs are usable
+    platforms = []
+    if tool:
+        platforms = conn.execute('''
+            SELECT p.*, COUNT(b.id) AS usable_count
+            FROM tool_battery_platform tp
+            JOIN battery_platforms p ON p.id = tp.platform_id
+            LEFT JOIN batteries b ON b.platform_id = p.id AND b.charge_level >= ?
+            WHERE tp.tool_id = ?
+            GROUP BY p.id
+            ORDER BY p.name
+        ''', (BATTERY_USABLE_LEVEL, tool_id)).fetchall()
+
+    # Get the open loan and recent lending history
+    loan = None
+    loan_history = []
+    if tool:
+        loan = conn.execute(
+            'SELECT * FROM loans WHERE tool_id = ? AND returned_at IS NULL', (tool_id,)
+        ).fetchone()
+        loan_history = conn.execute('''
+            SELECT * FROM loans WHERE tool_id = ? AND returned_at IS NOT NULL
+            ORDER BY lent_at DESC LIMIT 10
+        ''', (tool_id,)).fetchall()
 
     conn.close()
 
@@ -369,7 +1629,9 @@ def tool_detail(tool_id):
     # Generate QR code
     qr_code = generate_qr_code('tool', tool_id)
 
-    return render_template('tool_detail.html', tool=tool, compatible=compatible, qr_code=qr_code)
+    return render_template('tool_detail.html', tool=tool, compatible=compatible, qr_code=qr_code,
+                         schedules=schedules, service_log=service_log,
+                         loan=loan, loan_history=loan_history, platforms=platforms)
 
 @app.route('/tool/add', methods=['GET', 'POST'])
 def add_tool():
@@ -379,13 +1641,7 @@ def add_tool():
         c = conn.cursor()
         
         # Handle file upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image'))
         
         c.execute('''
             INSERT INTO tools (name, category, brand, model, purchase_date, 
@@ -406,13 +1662,26 @@ def add_tool():
             request.form.get('bunnings_url'),
             request.form.get('manual_url')
         ))
+        link_tool_to_consumables(conn, c.lastrowid, request.form.get('name'), request.form.get('model'))
+        set_item_location(conn, 'tools', c.lastrowid, request.form.get('location'))
+        tool_id = c.lastrowid
+        platform_ids = set_tool_platforms(conn, tool_id, request.form.getlist('platform_ids'))
+        link_catalogue_item(conn, request.form.get('gtin'), 'tool', tool_id, request.form)
         
+        saved = conn.execute('SELECT * FROM tools WHERE id = ?', (tool_id,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('tools', new=saved)
+        battery_index.set_tool_platforms(tool_id, platform_ids)
         
         return redirect(url_for('tools'))
     
-    return render_template('add_tool.html')
+    conn = get_db()
+    platforms = conn.execute('SELECT * FROM battery_platforms ORDER BY name').fetchall()
+    prefill = catalogue_prefill(conn, request.args.get('gtin'))
+    conn.close()
+    
+    return render_template('add_tool.html', platforms=platforms, tool_platform_ids=[], prefill=prefill)
 
 @app.route('/tool/<int:tool_id>/edit', methods=['GET', 'POST'])
 def edit_tool(tool_id):
@@ -427,12 +1696,7 @@ def edit_tool(tool_id):
         image_path = tool['image_path']
         
         # Handle file upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image')) or image_path
         
         c.execute('''
             UPDATE tools 
@@ -455,27 +1719,40 @@ def edit_tool(tool_id):
             request.form.get('manual_url'),
             tool_id
         ))
+        link_tool_to_consumables(conn, tool_id, request.form.get('name'), request.form.get('model'))
+        set_item_location(conn, 'tools', tool_id, request.form.get('location'))
+        platform_ids = set_tool_platforms(conn, tool_id, request.form.getlist('platform_ids'))
         
+        saved = conn.execute('SELECT * FROM tools WHERE id = ?', (tool_id,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('tools', old=tool, new=saved)
+        battery_index.set_tool_platforms(tool_id, platform_ids)
         
         return redirect(url_for('tool_detail', tool_id=tool_id))
     
     tool = conn.execute('SELECT * FROM tools WHERE id = ?', (tool_id,)).fetchone()
+    platforms = conn.execute('SELECT * FROM battery_platforms ORDER BY name').fetchall()
+    tool_platform_ids = [row['platform_id'] for row in conn.execute(
+        'SELECT platform_id FROM tool_battery_platform WHERE tool_id = ?', (tool_id,)
+    )]
     conn.close()
     
     if not tool:
         return "Tool not found", 404
     
-    return render_template('edit_tool.html', tool=tool)
+    return render_template('edit_tool.html', tool=tool, platforms=platforms, tool_platform_ids=tool_platform_ids)
 
 @app.route('/tool/<int:tool_id>/delete', methods=['POST'])
 def delete_tool(tool_id):
     """Delete a tool"""
     conn = get_db()
+    tool = conn.execute('SELECT * FROM tools WHERE id = ?', (tool_id,)).fetchone()
     conn.execute('DELETE FROM tools WHERE id = ?', (tool_id,))
     conn.commit()
     conn.close()
+    autocomplete_index.apply('tools', old=tool)
+    battery_index.set_tool_platforms(tool_id, [])
     
     return redirect(url_for('tools'))
 
@@ -496,37 +1773,41 @@ def add_consumable():
         c = conn.cursor()
         
         # Handle file upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image'))
         
         c.execute('''
-            INSERT INTO consumables (name, category, quantity, unit, min_quantity,
+            INSERT INTO consumables (name, category, quantity, unit, min_quantity, min_unit,
                                    location, compatible_with, notes, image_path, purchase_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             request.form.get('name'),
             request.form.get('category'),
             request.form.get('quantity', 0),
             request.form.get('unit'),
             request.form.get('min_quantity', 0),
+            request.form.get('min_unit') or None,
             request.form.get('location'),
             request.form.get('compatible_with'),
             request.form.get('notes'),
             image_path,
             request.form.get('purchase_url')
         ))
+        link_consumable_to_tools(conn, c.lastrowid, request.form.get('compatible_with'))
+        set_item_location(conn, 'consumables', c.lastrowid, request.form.get('location'))
+        link_catalogue_item(conn, request.form.get('gtin'), 'consumable', c.lastrowid, request.form)
         
+        saved = conn.execute('SELECT * FROM consumables WHERE id = ?', (c.lastrowid,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('consumables', new=saved)
         
         return redirect(url_for('consumables'))
     
-    return render_template('add_consumable.html')
+    conn = get_db()
+    prefill = catalogue_prefill(conn, request.args.get('gtin'))
+    conn.close()
+    
+    return render_template('add_consumable.html', prefill=prefill)
 
 @app.route('/consumable/<int:consumable_id>/edit', methods=['GET', 'POST'])
 def edit_consumable(consumable_id):
@@ -535,19 +1816,15 @@ def edit_consumable(consumable_id):
 
     if request.method == 'POST':
         c = conn.cursor()
+        consumable = conn.execute('SELECT * FROM consumables WHERE id = ?', (consumable_id,)).fetchone()
 
         # Handle file upload
         image_path = request.form.get('current_image')
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image')) or image_path
 
         c.execute('''
             UPDATE consumables
-            SET name = ?, category = ?, quantity = ?, unit = ?, min_quantity = ?,
+            SET name = ?, category = ?, quantity = ?, unit = ?, min_quantity = ?, min_unit = ?,
                 location = ?, compatible_with = ?, notes = ?, image_path = ?, purchase_url = ?
             WHERE id = ?
         ''', (
@@ -556,6 +1833,7 @@ def edit_consumable(consumable_id):
             request.form.get('quantity', 0),
             request.form.get('unit'),
             request.form.get('min_quantity', 0),
+            request.form.get('min_unit') or None,
             request.form.get('location'),
             request.form.get('compatible_with'),
             request.form.get('notes'),
@@ -563,9 +1841,13 @@ def edit_consumable(consumable_id):
             request.form.get('purchase_url'),
             consumable_id
         ))
+        link_consumable_to_tools(conn, consumable_id, request.form.get('compatible_with'))
+        set_item_location(conn, 'consumables', consumable_id, request.form.get('location'))
 
+        saved = conn.execute('SELECT * FROM consumables WHERE id = ?', (consumable_id,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('consumables', old=consumable, new=saved)
 
         return redirect(url_for('consumables'))
 
@@ -581,9 +1863,11 @@ def edit_consumable(consumable_id):
 def delete_consumable(consumable_id):
     """Delete a consumable"""
     conn = get_db()
+    consumable = conn.execute('SELECT * FROM consumables WHERE id = ?', (consumable_id,)).fetchone()
     conn.execute('DELETE FROM consumables WHERE id = ?', (consumable_id,))
     conn.commit()
     conn.close()
+    autocomplete_index.apply('consumables', old=consumable)
 
     return redirect(url_for('consumables'))
 
@@ -596,7 +1880,7 @@ def materials():
     # Get low stock materials
     low_stock = conn.execute('''
         SELECT * FROM materials
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
+        WHERE base_quantity <= base_min_quantity
         ORDER BY category, name
     ''').fetchall()
 
@@ -612,20 +1896,14 @@ def add_material():
         c = conn.cursor()
 
         # Handle file upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image'))
 
         c.execute('''
-            INSERT INTO materials (name, category, material_type, quantity, unit, min_quantity,
+            INSERT INTO materials (name, category, material_type, quantity, unit, min_quantity, min_unit,
                                  dimensions_length, dimensions_width, dimensions_thickness, dimension_unit,
                                  grade, finish, color, purchase_price, cost_per_unit, supplier,
                                  purchase_date, purchase_url, location, notes, image_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             request.form.get('name'),
             request.form.get('category'),
@@ -633,6 +1911,7 @@ def add_material():
             request.form.get('quantity', 0),
             request.form.get('unit'),
             request.form.get('min_quantity') or None,
+            request.form.get('min_unit') or None,
             request.form.get('dimensions_length') or None,
             request.form.get('dimensions_width') or None,
             request.form.get('dimensions_thickness') or None,
@@ -649,9 +1928,12 @@ def add_material():
             request.form.get('notes'),
             image_path
         ))
+        set_item_location(conn, 'materials', c.lastrowid, request.form.get('location'))
 
+        saved = conn.execute('SELECT * FROM materials WHERE id = ?', (c.lastrowid,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('materials', new=saved)
 
         return redirect(url_for('materials'))
 
@@ -664,19 +1946,15 @@ def edit_material(material_id):
 
     if request.method == 'POST':
         c = conn.cursor()
+        material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
 
         # Handle file upload
         image_path = request.form.get('current_image')
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image')) or image_path
 
         c.execute('''
             UPDATE materials
-            SET name = ?, category = ?, material_type = ?, quantity = ?, unit = ?, min_quantity = ?,
+            SET name = ?, category = ?, material_type = ?, quantity = ?, unit = ?, min_quantity = ?, min_unit = ?,
                 dimensions_length = ?, dimensions_width = ?, dimensions_thickness = ?, dimension_unit = ?,
                 grade = ?, finish = ?, color = ?, purchase_price = ?, cost_per_unit = ?, supplier = ?,
                 purchase_date = ?, purchase_url = ?, location = ?, notes = ?, image_path = ?
@@ -688,6 +1966,7 @@ def edit_material(material_id):
             request.form.get('quantity', 0),
             request.form.get('unit'),
             request.form.get('min_quantity') or None,
+            request.form.get('min_unit') or None,
             request.form.get('dimensions_length') or None,
             request.form.get('dimensions_width') or None,
             request.form.get('dimensions_thickness') or None,
@@ -705,9 +1984,12 @@ def edit_material(material_id):
             image_path,
             material_id
         ))
+        set_item_location(conn, 'materials', material_id, request.form.get('location'))
 
+        saved = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('materials', old=material, new=saved)
 
         return redirect(url_for('materials'))
 
@@ -723,9 +2005,11 @@ def edit_material(material_id):
 def delete_material(material_id):
     """Delete a material"""
     conn = get_db()
+    material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
     conn.execute('DELETE FROM materials WHERE id = ?', (material_id,))
     conn.commit()
     conn.close()
+    autocomplete_index.apply('materials', old=material)
 
     return redirect(url_for('materials'))
 
@@ -753,22 +2037,45 @@ def fasteners():
         params.append(category)
 
     if location:
-        query += ' AND location LIKE ?'
-        params.append(f'%{location}%')
-
-    query += ' ORDER BY category, size, length'
+        node = conn.execute('SELECT path FROM locations WHERE full_name = ?', (location,)).fetchone()
+        if node:
+            # Everything stored in this location or anywhere below it
+            query += ' AND location_id IN (SELECT id FROM locations WHERE path >= ? AND path < ?)'
+            params.extend(subtree_bounds(node['path']))
+        else:
+            query += ' AND location LIKE ?'
+            params.append(f'%{location}%')
+
+    # Numeric spec filters, e.g. ?size=M5&length_min=20&length_max=30
+    diameter = request.args.get('diameter', type=float)
+    if diameter is None and request.args.get('size'):
+        diameter = parse_fastener_spec(request.args.get('size'))[0]
+    length_min = request.args.get('length_min', type=float)
+    length_max = request.args.get('length_max', type=float)
+    if diameter is not None:
+        query += ' AND diameter_mm = ?'
+        params.append(diameter)
+    if length_min is not None:
+        query += ' AND length_mm >= ?'
+        params.append(length_min)
+    if length_max is not None:
+        query += ' AND length_mm <= ?'
+        params.append(length_max)
+
+    # Numeric sizes so M4 sorts before M10; unparsed specs go last
+    query += ' ORDER BY category, diameter_mm IS NULL, diameter_mm, length_mm, size, length'
 
     fasteners = conn.execute(query, params).fetchall()
 
     # Get unique categories and locations for filters
     categories = conn.execute('SELECT DISTINCT category FROM fasteners WHERE category IS NOT NULL AND category != "" ORDER BY category').fetchall()
-    locations = conn.execute('SELECT DISTINCT location FROM fasteners WHERE location IS NOT NULL AND location != "" ORDER BY location').fetchall()
+    locations = conn.execute('SELECT full_name AS location FROM locations ORDER BY full_name').fetchall()
 
-    # Get low stock items (quantity <= min_quantity)
+    # Get low stock items (same test as the shopping list's add-low-stock)
     low_stock = conn.execute('''
         SELECT * FROM fasteners
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
-        ORDER BY category, size
+        WHERE base_quantity <= base_min_quantity
+        ORDER BY category, diameter_mm, length_mm
     ''').fetchall()
 
     conn.close()
@@ -780,7 +2087,10 @@ def fasteners():
                          low_stock=low_stock,
                          search=search,
                          current_category=category,
-                         current_location=location)
+                         current_location=location,
+                         current_size=request.args.get('size', ''),
+                         length_min=length_min,
+                         length_max=length_max)
 
 @app.route('/fastener/add', methods=['GET', 'POST'])
 def add_fastener():
@@ -790,13 +2100,7 @@ def add_fastener():
         c = conn.cursor()
 
         # Handle file upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image'))
 
         c.execute('''
             INSERT INTO fasteners (category, size, length, material, head_type, thread_type,
@@ -815,9 +2119,14 @@ def add_fastener():
             request.form.get('notes'),
             image_path
         ))
+        set_item_location(conn, 'fasteners', c.lastrowid, request.form.get('location'))
+        set_fastener_specs(conn, c.lastrowid, request.form.get('size'), request.form.get('length'),
+                           request.form.get('thread_type'))
 
+        saved = conn.execute('SELECT * FROM fasteners WHERE id = ?', (c.lastrowid,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('fasteners', new=saved)
 
         return redirect(url_for('fasteners'))
 
@@ -838,7 +2147,7 @@ def batch_add_fasteners():
     data = request.get_json()
     fasteners = data.get('fasteners', [])
 
-    added_count = 0
+    added = []
     for fastener in fasteners:
         try:
             c.execute('''
@@ -858,7 +2167,10 @@ def batch_add_fasteners():
                 fastener.get('notes'),
                 None  # image_path - not supported in batch mode
             ))
-            added_count += 1
+            set_item_location(conn, 'fasteners', c.lastrowid, fastener.get('location'))
+            set_fastener_specs(conn, c.lastrowid, fastener.get('size'), fastener.get('length'),
+                               fastener.get('thread_type'))
+            added.append(conn.execute('SELECT * FROM fasteners WHERE id = ?', (c.lastrowid,)).fetchone())
         except Exception as e:
             print(f"Error adding fastener: {e}")
             continue
@@ -866,7 +2178,10 @@ def batch_add_fasteners():
     conn.commit()
     conn.close()
 
-    return jsonify({'success': True, 'count': added_count})
+    for fastener in added:
+        autocomplete_index.apply('fasteners', new=fastener)
+
+    return jsonify({'success': True, 'count': len(added)})
 
 @app.route('/fastener/<int:fastener_id>/edit', methods=['GET', 'POST'])
 def edit_fastener(fastener_id):
@@ -875,15 +2190,11 @@ def edit_fastener(fastener_id):
 
     if request.method == 'POST':
         c = conn.cursor()
+        fastener = conn.execute('SELECT * FROM fasteners WHERE id = ?', (fastener_id,)).fetchone()
 
         # Handle file upload
         image_path = request.form.get('current_image')
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"uploads/{filename}"
+        image_path = save_upload(conn, request.files.get('image')) or image_path
 
         c.execute('''
             UPDATE fasteners
@@ -904,9 +2215,14 @@ def edit_fastener(fastener_id):
             image_path,
             fastener_id
         ))
+        set_item_location(conn, 'fasteners', fastener_id, request.form.get('location'))
+        set_fastener_specs(conn, fastener_id, request.form.get('size'), request.form.get('length'),
+                           request.form.get('thread_type'))
 
+        saved = conn.execute('SELECT * FROM fasteners WHERE id = ?', (fastener_id,)).fetchone()
         conn.commit()
         conn.close()
+        autocomplete_index.apply('fasteners', old=fastener, new=saved)
 
         return redirect(url_for('fasteners'))
 
@@ -922,9 +2238,11 @@ def edit_fastener(fastener_id):
 def delete_fastener(fastener_id):
     """Delete a fastener"""
     conn = get_db()
+    fastener = conn.execute('SELECT * FROM fasteners WHERE id = ?', (fastener_id,)).fetchone()
     conn.execute('DELETE FROM fasteners WHERE id = ?', (fastener_id,))
     conn.commit()
     conn.close()
+    autocomplete_index.apply('fasteners', old=fastener)
 
     return redirect(url_for('fasteners'))
 
@@ -940,37 +2258,28 @@ def duplicate_fastener(fastener_id):
 
     return render_template('add_fastener.html', fastener=fastener, is_duplicate=True)
 
+def autocomplete_response(field):
+    """Serve top-k autocomplete suggestions for `field` from the prefix index"""
+    prefix = request.args.get('prefix', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(autocomplete_index.complete(field, prefix, limit))
+
 @app.route('/api/autocomplete/brands')
 def autocomplete_brands():
-    """Get list of unique brands from database for autocomplete"""
-    conn = get_db()
-    brands = conn.execute('''
-        SELECT DISTINCT brand FROM tools
-        WHERE brand IS NOT NULL AND brand != ''
-        ORDER BY brand
-    ''').fetchall()
-    conn.close()
-    return jsonify([row['brand'] for row in brands])
+    """Get brands matching ?prefix= for autocomplete, most used first"""
+    return autocomplete_response('brand')
 
 @app.route('/api/autocomplete/models')
 def autocomplete_models():
-    """Get list of unique models from database for autocomplete, optionally filtered by brand"""
-    brand = request.args.get('brand', '')
-    conn = get_db()
-    if brand:
-        models = conn.execute('''
-            SELECT DISTINCT model FROM tools
-            WHERE brand = ? AND model IS NOT NULL AND model != ''
-            ORDER BY model
-        ''', (brand,)).fetchall()
-    else:
-        models = conn.execute('''
-            SELECT DISTINCT model FROM tools
-            WHERE model IS NOT NULL AND model != ''
-            ORDER BY model
-        ''').fetchall()
-    conn.close()
-    return jsonify([row['model'] for row in models])
+    """Get models matching ?prefix= for autocomplete, optionally filtered by brand"""
+    brand = request.args.get('brand', '').strip()
+    return autocomplete_response(f'model:{brand.lower()}' if brand else 'model')
+
+@app.route('/api/autocomplete/<any(locations, categories, sizes):field>')
+def autocomplete_field(field):
+    """Get locations, categories or fastener sizes matching ?prefix= across all tables"""
+    fields = {'locations': 'location', 'categories': 'category', 'sizes': 'size'}
+    return autocomplete_response(fields[field])
 
 @app.route('/search/bunnings')
 def search_bunnings():
@@ -980,6 +2289,16 @@ def search_bunnings():
         return jsonify({'success': False, 'error': 'No search query provided', 'products': []})
 
     results = scrape_bunnings_search(query)
+    products = results.get('products', [])
+    if products:
+        conn = get_db()
+        # Cache barcoded results so later scans resolve without a scrape
+        upsert_catalogue(conn, products)
+        record_price_observations(conn, [
+            (product['url'], product['price']) for product in products if product['url'] != results['search_url']
+        ], source=products[0].get('source'))
+        conn.commit()
+        conn.close()
     return jsonify(results)
 
 # QR Code Routes
@@ -995,96 +2314,102 @@ def scan_redirect(item_type, item_id):
         return redirect(url_for('material_detail', material_id=item_id))
     elif item_type == 'fastener':
         return redirect(url_for('fastener_detail', fastener_id=item_id))
+    elif item_type == 'location':
+        return redirect(url_for('location_detail', location_id=item_id))
     else:
         return redirect(url_for('index'))
 
 @app.route('/scanner')
 def scanner():
-    """QR code scanner page"""
-    return render_template('scanner.html')
+    """QR code and barcode scanner page"""
+    conn = get_db()
+    catalogue_count = conn.execute('SELECT COUNT(*) FROM product_catalogue').fetchone()[0]
+    conn.close()
+    return render_template('scanner.html', catalogue_count=catalogue_count)
+
+# Label sources by item type: the query arg holding selected ids, and the
+# query returning id, name, brand, category and location for them
+LABEL_SOURCES = {
+    'tool': ('tools[]', '''
+        SELECT id, name, brand, category, location FROM tools WHERE id IN ({ids})
+    '''),
+    'consumable': ('consumables[]', '''
+        SELECT id, name, NULL AS brand, category, location FROM consumables WHERE id IN ({ids})
+    '''),
+    'material': ('materials[]', '''
+        SELECT id, name, NULL AS brand, category, location FROM materials WHERE id IN ({ids})
+    '''),
+    'fastener': ('fasteners[]', '''
+        SELECT id, size || COALESCE(' x ' || length, '') || COALESCE(' ' || head_type, '') AS name,
+               NULL AS brand, category, location
+        FROM fasteners WHERE id IN ({ids})
+    '''),
+    'location': ('locations[]', '''
+        SELECT l.id, l.name, NULL AS brand, NULL AS category, p.full_name AS location
+        FROM locations l
+        LEFT JOIN locations p ON p.id = l.parent_id
+        WHERE l.id IN ({ids})
+    '''),
+}
+
+def label_items(conn, args):
+    """
+    Items selected for labels via tools[]=1&consumables[]=2... query args,
+    fetched with one IN query per type and kept in the requested order
+    """
+    items = []
+    for item_type, (arg, query) in LABEL_SOURCES.items():
+        item_ids = [int(i) for i in args.getlist(arg) if str(i).isdigit()]
+        if not item_ids:
+            continue
+        rows = {}
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            for row in conn.execute(query.format(ids=', '.join('?' * len(chunk))), chunk):
+                rows[row['id']] = row
+        for item_id in item_ids:
+            row = rows.get(item_id)
+            if row:
+                items.append({'type': item_type, 'id': row['id'], 'name': row['name'], 'brand': row['brand'],
+                              'category': row['category'], 'location': row['location']})
+    return items
 
 @app.route('/labels')
 def labels():
     """Printable labels page"""
     conn = get_db()
-
-    # Get selected items from query params
-    tool_ids = request.args.getlist('tools[]')
-    consumable_ids = request.args.getlist('consumables[]')
-    material_ids = request.args.getlist('materials[]')
-    fastener_ids = request.args.getlist('fasteners[]')
-
-    items = []
-
-    # Fetch tools
-    for tool_id in tool_ids:
-        tool = conn.execute('SELECT * FROM tools WHERE id = ?', (tool_id,)).fetchone()
-        if tool:
-            items.append({
-                'type': 'tool',
-                'id': tool['id'],
-                'name': tool['name'],
-                'brand': tool['brand'],
-                'category': tool['category'],
-                'location': tool['location'],
-                'qr_code': generate_qr_code('tool', tool['id'])
-            })
-
-    # Fetch consumables
-    for consumable_id in consumable_ids:
-        consumable = conn.execute('SELECT * FROM consumables WHERE id = ?', (consumable_id,)).fetchone()
-        if consumable:
-            items.append({
-                'type': 'consumable',
-                'id': consumable['id'],
-                'name': consumable['name'],
-                'category': consumable['category'],
-                'location': consumable['location'],
-                'qr_code': generate_qr_code('consumable', consumable['id'])
-            })
-
-    # Fetch materials
-    for material_id in material_ids:
-        material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
-        if material:
-            items.append({
-                'type': 'material',
-                'id': material['id'],
-                'name': material['name'],
-                'category': material['category'],
-                'location': material['location'],
-                'qr_code': generate_qr_code('material', material['id'])
-            })
-
-    # Fetch fasteners
-    for fastener_id in fastener_ids:
-        fastener = conn.execute('SELECT * FROM fasteners WHERE id = ?', (fastener_id,)).fetchone()
-        if fastener:
-            items.append({
-                'type': 'fastener',
-                'id': fastener['id'],
-                'name': f"{fastener['fastener_type']} - {fastener['head_type']}",
-                'category': fastener['fastener_type'],
-                'location': fastener['location'],
-                'qr_code': generate_qr_code('fastener', fastener['id'])
-            })
-
+    items = label_items(conn, request.args)
     conn.close()
 
-    return render_template('labels.html', items=items)
+    for item in items:
+        item['qr_code'] = generate_qr_code(item['type'], item['id'])
+
+    return render_template('labels.html', items=items, printer=app.config['LABEL_PRINTER_HOST'])
 
 @app.route('/consumable/<int:consumable_id>')
 def consumable_detail(consumable_id):
     """Consumable detail page"""
     conn = get_db()
     consumable = conn.execute('SELECT * FROM consumables WHERE id = ?', (consumable_id,)).fetchone()
+
+    # Get tools that use this consumable
+    compatible_tools = []
+    if consumable:
+        compatible_tools = conn.execute('''
+            SELECT t.* FROM tool_consumable tc
+            JOIN tools t ON t.id = tc.tool_id
+            WHERE tc.consumable_id = ?
+            ORDER BY t.name
+        ''', (consumable_id,)).fetchall()
+
     conn.close()
 
     if not consumable:
         return redirect(url_for('consumables'))
 
     qr_code = generate_qr_code('consumable', consumable_id)
-    return render_template('consumable_detail.html', consumable=consumable, qr_code=qr_code)
+    return render_template('consumable_detail.html', consumable=consumable, qr_code=qr_code,
+                         compatible_tools=compatible_tools)
 
 @app.route('/material/<int:material_id>')
 def material_detail(material_id):
@@ -1104,21 +2429,4416 @@ def fastener_detail(fastener_id):
     """Fastener detail page"""
     conn = get_db()
     fastener = conn.execute('SELECT * FROM fasteners WHERE id = ?', (fastener_id,)).fetchone()
+
+    # Closest in-stock alternatives of the same kind
+    substitutes = []
+    if fastener and fastener['diameter_mm'] is not None:
+        substitutes = [row for row in nearest_fasteners(conn, fastener['diameter_mm'], fastener['length_mm'],
+                                                        category=fastener['category'], limit=6)
+                       if row['id'] != fastener_id][:5]
     conn.close()
 
     if not fastener:
         return redirect(url_for('fasteners'))
 
     qr_code = generate_qr_code('fastener', fastener_id)
-    return render_template('fastener_detail.html', fastener=fastener, qr_code=qr_code)
+    return render_template('fastener_detail.html', fastener=fastener, qr_code=qr_code, substitutes=substitutes)
 
-# Favorites Routes
+# Location Routes
 
-@app.route('/api/favorite/toggle', methods=['POST'])
-def toggle_favorite():
-    """Toggle favorite status for an item"""
-    data = request.get_json()
-    item_type = data.get('item_type')
+@app.route('/locations')
+def locations():
+    """List the storage location tree with item counts"""
+    conn = get_db()
+    counts = ' + '.join(
+        f'(SELECT COUNT(*) FROM {table} WHERE location_id = l.id)' for table in LOCATION_TABLES
+    )
+    locations = conn.execute(f'''
+        SELECT l.*, ({counts}) AS item_count,
+               LENGTH(l.path) - LENGTH(REPLACE(l.path, '/', '')) - 2 AS depth
+        FROM locations l
+        ORDER BY l.full_name
+    ''').fetchall()
+    conn.close()
+
+    return render_template('locations.html', locations=locations)
+
+@app.route('/location/<int:location_id>')
+def location_detail(location_id):
+    """Everything stored in a location, including all locations below it"""
+    conn = get_db()
+    location = conn.execute('SELECT * FROM locations WHERE id = ?', (location_id,)).fetchone()
+
+    if not location:
+        conn.close()
+        return redirect(url_for('locations'))
+
+    ancestor_ids = [int(part) for part in location['path'].strip('/').split('/')[:-1]]
+    ancestors = []
+    if ancestor_ids:
+        ancestors = conn.execute(f'''
+            SELECT * FROM locations WHERE id IN ({', '.join('?' * len(ancestor_ids))})
+            ORDER BY LENGTH(path)
+        ''', ancestor_ids).fetchall()
+
+    children = conn.execute(
+        'SELECT * FROM locations WHERE parent_id = ? ORDER BY name', (location_id,)
+    ).fetchall()
+
+    # One indexed range scan on locations.path per item type
+    low, high = subtree_bounds(location['path'])
+    items = conn.execute('''
+        SELECT 'tool' AS item_type, t.id AS id, t.name AS name, t.category AS category,
+               NULL AS quantity, NULL AS unit,
+               l.id AS location_id, l.full_name AS location_name
+        FROM locations l JOIN tools t ON t.location_id = l.id
+        WHERE l.path >= ? AND l.path < ?
+        UNION ALL
+        SELECT 'consumable', c.id, c.name, c.category, c.quantity, c.unit, l.id, l.full_name
+        FROM locations l JOIN consumables c ON c.location_id = l.id
+        WHERE l.path >= ? AND l.path < ?
+        UNION ALL
+        SELECT 'material', m.id, m.name, m.category, m.quantity, m.unit, l.id, l.full_name
+        FROM locations l JOIN materials m ON m.location_id = l.id
+        WHERE l.path >= ? AND l.path < ?
+        UNION ALL
+        SELECT 'fastener', f.id, f.category || ' ' || f.size || COALESCE(' x ' || f.length, ''),
+               f.category, f.quantity, 'pcs', l.id, l.full_name
+        FROM locations l JOIN fasteners f ON f.location_id = l.id
+        WHERE l.path >= ? AND l.path < ?
+        ORDER BY location_name, item_type, name
+    ''', [low, high] * 4).fetchall()
+
+    conn.close()
+
+    qr_code = generate_qr_code('location', location_id)
+    return render_template('location_detail.html', location=location, ancestors=ancestors,
+                         children=children, items=items, qr_code=qr_code)
+
+# Analytics
+
+# Straight-line depreciation: useful life in years per tool category,
+# never dropping below the salvage fraction of the purchase price
+TOOL_USEFUL_LIFE_YEARS = {
+    'Power Tool': 7,
+    'Hand Tool': 20,
+    'Measuring': 10,
+    'Safety': 5,
+}
+DEFAULT_USEFUL_LIFE_YEARS = 10
+TOOL_SALVAGE_FRACTION = 0.1
+
+# Number of most-depreciated tools listed individually
+ANALYTICS_TOP_TOOLS = 50
+
+_analytics_cache = {}  # workspace -> (data version, analytics)
+_analytics_lock = threading.Lock()
+
+# Every purchase as (category, store, month, amount), from tools, materials
+# and purchased shopping-list items
+PURCHASES_CTE = '''
+    WITH purchases AS (
+        SELECT COALESCE(NULLIF(category, ''), 'Uncategorised') AS category,
+               CASE WHEN bunnings_url IS NOT NULL AND bunnings_url != '' THEN 'Bunnings' ELSE 'Other' END AS store,
+               substr(COALESCE(NULLIF(purchase_date, ''), created_at), 1, 7) AS month,
+               purchase_price AS amount
+        FROM tools WHERE purchase_price > 0
+        UNION ALL
+        SELECT COALESCE(NULLIF(category, ''), 'Uncategorised'),
+               COALESCE(NULLIF(supplier, ''), 'Other'),
+               substr(COALESCE(NULLIF(purchase_date, ''), created_at), 1, 7),
+               COALESCE(purchase_price, quantity * cost_per_unit)
+        FROM materials WHERE COALESCE(purchase_price, quantity * cost_per_unit) > 0
+        UNION ALL
+        SELECT COALESCE(NULLIF(item_type, ''), 'Shopping'),
+               COALESCE(NULLIF(store, ''), 'Other'),
+               substr(purchased_date, 1, 7),
+               estimated_cost
+        FROM shopping_list WHERE purchased = 1 AND estimated_cost > 0
+    )
+'''
+
+def compute_analytics(conn, today=None):
+    """Compute inventory value, spend breakdowns and tool depreciation (as of `today`) with SQL aggregates"""
+    today = today or datetime.now().date().isoformat()
+    life_values = ', '.join('(?, ?)' for _ in TOOL_USEFUL_LIFE_YEARS)
+    life_params = [value for item in TOOL_USEFUL_LIFE_YEARS.items() for value in item]
+
+    # Per-tool depreciation; the window total covers every tool while only
+    # the most depreciated ones are returned
+    depreciation = conn.execute(f'''
+        WITH life(category, years) AS (VALUES {life_values}),
+        aged AS (
+            SELECT t.id, t.name, t.category, t.purchase_date, t.purchase_price,
+                   COALESCE(life.years, ?) AS life_years,
+                   MAX(julianday(?) - julianday(COALESCE(NULLIF(t.purchase_date, ''), t.created_at)), 0) / 365.25 AS age_years
+            FROM tools t
+            LEFT JOIN life ON life.category = t.category
+            WHERE t.purchase_price > 0
+        ),
+        valued AS (
+            SELECT *, MAX(purchase_price * (1 - age_years / life_years), purchase_price * ?) AS value
+            FROM aged
+        )
+        SELECT id, name, category, purchase_date, purchase_price, life_years,
+               ROUND(age_years, 2) AS age_years, ROUND(value, 2) AS current_value,
+               SUM(value) OVER () AS tools_value
+        FROM valued
+        ORDER BY purchase_price - value DESC
+        LIMIT ?
+    ''', life_params + [DEFAULT_USEFUL_LIFE_YEARS, today, TOOL_SALVAGE_FRACTION, ANALYTICS_TOP_TOOLS]).fetchall()
+
+    totals = conn.execute('''
+        SELECT
+            (SELECT COALESCE(SUM(purchase_price), 0) FROM tools) AS tools_cost,
+            (SELECT COALESCE(SUM(COALESCE(quantity * cost_per_unit, purchase_price)), 0) FROM materials) AS materials_value,
+            (SELECT COALESCE(SUM(estimated_cost), 0) FROM shopping_list WHERE purchased = 0) AS shopping_list_cost
+    ''').fetchone()
+    tools_value = depreciation[0]['tools_value'] if depreciation else 0
+
+    by_category = conn.execute(PURCHASES_CTE + '''
+        SELECT category, COUNT(*) AS purchases, ROUND(SUM(amount), 2) AS total
+        FROM purchases GROUP BY category ORDER BY total DESC
+    ''').fetchall()
+
+    by_store = conn.execute(PURCHASES_CTE + '''
+        SELECT store, COUNT(*) AS purchases, ROUND(SUM(amount), 2) AS total
+        FROM purchases GROUP BY store ORDER BY total DESC
+    ''').fetchall()
+
+    # Material stock per category, added up in base units (metres, kg, ...)
+    stock_by_category = conn.execute('''
+        SELECT COALESCE(NULLIF(category, ''), 'Uncategorised') AS category, base_unit AS unit,
+               COUNT(*) AS items, ROUND(SUM(base_quantity), 3) AS quantity,
+               ROUND(SUM(quantity * cost_per_unit), 2) AS value
+        FROM materials
+        GROUP BY 1, base_unit ORDER BY 1, base_unit
+    ''').fetchall()
+
+    by_month = conn.execute(PURCHASES_CTE + '''
+        SELECT month, ROUND(SUM(amount), 2) AS total,
+               ROUND(SUM(SUM(amount)) OVER (ORDER BY month), 2) AS cumulative
+        FROM purchases WHERE month IS NOT NULL
+        GROUP BY month ORDER BY month
+    ''').fetchall()
+
+    return {
+        'totals': {
+            'tools_cost': round(totals['tools_cost'], 2),
+            'tools_value': round(tools_value, 2),
+            'materials_value': round(totals['materials_value'], 2),
+            'inventory_value': round(tools_value + totals['materials_value'], 2),
+            'shopping_list_cost': round(totals['shopping_list_cost'], 2),
+        },
+        'spend_by_category': [dict(row) for row in by_category],
+        'spend_by_store': [dict(row) for row in by_store],
+        'spend_by_month': [dict(row) for row in by_month],
+        'stock_by_category': [dict(row) for row in stock_by_category],
+        'depreciation': [
+            {key: row[key] for key in row.keys() if key != 'tools_value'} for row in depreciation
+        ],
+    }
+
+def get_analytics(conn):
+    """Analytics for the current data version, recomputed after writes and each day as tools depreciate"""
+    today = datetime.now().date().isoformat()
+    version = (today, get_data_version(conn, 'tools', 'materials', 'shopping_list'))
+    with _analytics_lock:
+        cached = _analytics_cache.get(current_workspace())
+        if cached is None or cached[0] != version:
+            cached = _analytics_cache[current_workspace()] = (version, compute_analytics(conn, today))
+        return cached[1]
+
+@app.route('/analytics')
+def analytics():
+    """Cost and valuation dashboard"""
+    conn = get_db()
+    data = get_analytics(conn)
+    conn.close()
+
+    return render_template('analytics.html', analytics=data)
+
+@app.route('/api/analytics')
+def api_analytics():
+    """Cost and valuation analytics as JSON"""
+    conn = get_db()
+    data = get_analytics(conn)
+    conn.close()
+
+    return jsonify(data)
+
+# Forecasting
+
+# Smoothing factor for the usage-rate EWMA (higher reacts faster)
+FORECAST_ALPHA = 0.3
+# Days between ordering and restocking, and the service-level z-score
+FORECAST_LEAD_TIME_DAYS = 7
+FORECAST_SAFETY_Z = 1.65
+# Shortest interval a usage observation is spread over, in days
+FORECAST_MIN_INTERVAL_DAYS = 1.0
+
+def parse_timestamp(value):
+    """Parse a SQLite CURRENT_TIMESTAMP / ISO string into a datetime"""
+    return datetime.fromisoformat(value) if value else None
+
+def update_forecasts(conn):
+    """
+    Fold new stock_history rows into the per-item usage forecasts.
+    Only rows after the saved watermark are read, and only the forecasts
+    of the items they touch (by primary key), so each run costs
+    O(new changes) rather than O(full history); with nothing new it
+    returns without writing. Page views and the background job can run
+    this at the same time, so the watermark is re-read under the write
+    lock and each row is folded in once.
+    """
+    watermark = int(get_job_state(conn, 'forecast_watermark', 0))
+    if conn.execute('SELECT 1 FROM stock_history WHERE id > ? LIMIT 1', (watermark,)).fetchone() is None:
+        return 0
+
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    watermark = int(get_job_state(conn, 'forecast_watermark', 0))
+    history = conn.execute(
+        'SELECT * FROM stock_history WHERE id > ? ORDER BY id', (watermark,)
+    ).fetchall()
+    if not history:
+        conn.rollback()
+        return 0
+
+    states = {}
+    for key in dict.fromkeys((row['item_type'], row['item_id']) for row in history):
+        state = conn.execute(
+            'SELECT * FROM stock_forecasts WHERE item_type = ? AND item_id = ?', key
+        ).fetchone()
+        if state is not None:
+            states[key] = dict(state)
+
+    for row in history:
+        key = (row['item_type'], row['item_id'])
+        state = states.setdefault(key, {
+            'item_type': key[0], 'item_id': key[1], 'usage_rate': None,
+            'usage_variance': 0.0, 'last_change_at': None,
+        })
+        changed_at = parse_timestamp(row['recorded_at'])
+        last_change_at = parse_timestamp(state['last_change_at'])
+
+        # Only decreases count as usage; restocks just move the clock
+        if row['delta'] is not None and row['delta'] < 0 and last_change_at:
+            days = max((changed_at - last_change_at).total_seconds() / 86400, FORECAST_MIN_INTERVAL_DAYS)
+            observed = -row['delta'] / days
+            rate = state['usage_rate']
+            if rate is None:
+                state['usage_rate'] = observed
+            else:
+                diff = observed - rate
+                state['usage_rate'] = rate + FORECAST_ALPHA * diff
+                state['usage_variance'] = (1 - FORECAST_ALPHA) * (state['usage_variance'] + FORECAST_ALPHA * diff * diff)
+
+        state['quantity'] = row['quantity'] or 0
+        state['last_change_at'] = row['recorded_at']
+
+    for state in states.values():
+        rate = state['usage_rate']
+        stockout_date = None
+        reorder_point = None
+        if rate and rate > 0:
+            days_left = state['quantity'] / rate
+            stockout_date = (parse_timestamp(state['last_change_at']) + timedelta(days=days_left)).strftime('%Y-%m-%d')
+            safety_stock = FORECAST_SAFETY_Z * math.sqrt(state['usage_variance'] * FORECAST_LEAD_TIME_DAYS)
+            reorder_point = round(rate * FORECAST_LEAD_TIME_DAYS + safety_stock, 2)
+
+        conn.execute('''
+            INSERT OR REPLACE INTO stock_forecasts
+                (item_type, item_id, quantity, usage_rate, usage_variance, last_change_at,
+                 stockout_date, reorder_point, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (state['item_type'], state['item_id'], state['quantity'], rate, state['usage_variance'],
+              state['last_change_at'], stockout_date, reorder_point))
+
+    set_job_state(conn, 'forecast_watermark', history[-1]['id'])
+    conn.commit()
+    return len(history)
+
+# Display name for a forecast row, looked up from its item table
+FORECAST_NAME_SQL = '''
+    CASE f.item_type
+        WHEN 'consumable' THEN (SELECT name FROM consumables WHERE id = f.item_id)
+        WHEN 'material' THEN (SELECT name FROM materials WHERE id = f.item_id)
+        WHEN 'fastener' THEN (SELECT category || ' ' || size || COALESCE(' x ' || length, '') FROM fasteners WHERE id = f.item_id)
+    END
+'''
+
+@app.route('/api/forecasts')
+def api_forecasts():
+    """Usage forecasts, soonest stockout first"""
+    conn = get_db()
+    update_forecasts(conn)
+    forecasts = conn.execute(f'''
+        SELECT f.*, {FORECAST_NAME_SQL} AS name,
+               ROUND(julianday(f.stockout_date) - julianday('now'), 1) AS days_until_stockout
+        FROM stock_forecasts f
+        WHERE f.stockout_date IS NOT NULL
+        ORDER BY f.stockout_date
+    ''').fetchall()
+    conn.close()
+
+    return jsonify([dict(row) for row in forecasts])
+
+# Cut List Planner
+
+# Usable offcuts smaller than this (mm) on either side are counted as waste
+CUTLIST_MIN_OFFCUT_MM = 50
+# Most parts (counting quantities) one plan may cut
+CUTLIST_MAX_PARTS = 2000
+
+def is_length_unit(unit):
+    """Whether a unit as typed ('mm', 'Metres', 'ft') measures length"""
+    return unit_base(unit) == 'm'
+
+def to_mm(value, unit):
+    """Convert a length in `unit` to millimetres (blank and non-length units are taken as mm)"""
+    return float(value) * (unit_factor(unit) * 1000 if is_length_unit(unit) else 1.0)
+
+def pack_lengths(parts, stock_length, stock_count, kerf):
+    """
+    1D best-fit-decreasing packing of part lengths onto stock lengths.
+    `parts` is a list of dicts with 'name' and 'length' (mm).
+    Returns (pieces, unplaced) where each piece is a dict with
+    'remaining' and 'cuts' [(part, offset)].
+    """
+    pieces = []
+    unplaced = []
+    for part in sorted(parts, key=lambda part: part['length'], reverse=True):
+        length = part['length']
+        best = None
+        for piece in pieces:
+            if piece['remaining'] >= length and (best is None or piece['remaining'] < best['remaining']):
+                best = piece
+        if best is None:
+            if len(pieces) >= stock_count or length > stock_length:
+                unplaced.append(part)
+                continue
+            best = {'remaining': stock_length, 'cuts': []}
+            pieces.append(best)
+        best['cuts'].append((part, stock_length - best['remaining']))
+        best['remaining'] = max(best['remaining'] - length - kerf, 0)
+    return pieces, unplaced
+
+def _split_free_rect(free, used_w, used_h, kerf):
+    """Guillotine-split a free rect around a part placed at its corner"""
+    x, y, w, h = free
+    right_w = w - used_w - kerf
+    bottom_h = h - used_h - kerf
+    # Cut along the shorter leftover so the larger offcut stays whole
+    if right_w < bottom_h:
+        candidates = [(x + used_w + kerf, y, right_w, used_h), (x, y + used_h + kerf, w, bottom_h)]
+    else:
+        candidates = [(x + used_w + kerf, y, right_w, h), (x, y + used_h + kerf, used_w, bottom_h)]
+    return [rect for rect in candidates if rect[2] > 0 and rect[3] > 0]
+
+def _best_free_rect(sheet, orientations, best=None):
+    """
+    The best short-side fit of a part's orientations among a sheet's free
+    rects, as (score, sheet, rect index, w, h, rotated), or `best` if that
+    scores better
+    """
+    for index, (x, y, w, h) in enumerate(sheet['free']):
+        for part_w, part_h, rotated in orientations:
+            if part_w <= w and part_h <= h:
+                score = (min(w - part_w, h - part_h), max(w - part_w, h - part_h))
+                if best is None or score < best[0]:
+                    best = (score, sheet, index, part_w, part_h, rotated)
+    return best
+
+def pack_sheets(parts, sheet_length, sheet_width, stock_count, kerf, allow_rotation=True):
+    """
+    2D guillotine packing of rectangular parts onto sheets, placing each
+    part (largest first) in the free rect with the best short-side fit.
+    Returns (sheets, unplaced) where each sheet is a dict with
+    'free' rects and 'placements' [(part, x, y, w, h, rotated)].
+    """
+    sheets = []
+    unplaced = []
+    ordered = sorted(parts, key=lambda part: (part['length'] * part['width'], max(part['length'], part['width'])), reverse=True)
+    for part in ordered:
+        orientations = [(part['length'], part['width'], False)]
+        if allow_rotation and part['length'] != part['width']:
+            orientations.append((part['width'], part['length'], True))
+
+        best = None
+        for sheet in sheets:
+            best = _best_free_rect(sheet, orientations, best)
+        if best is None and len(sheets) < stock_count:
+            # Only open a new sheet when nothing already open fits
+            best = _best_free_rect({'free': [(0, 0, sheet_length, sheet_width)], 'placements': []}, orientations)
+            if best is not None:
+                sheets.append(best[1])
+
+        if best is None:
+            unplaced.append(part)
+            continue
+
+        _, sheet, index, part_w, part_h, rotated = best
+        free = sheet['free'].pop(index)
+        sheet['free'].extend(_split_free_rect(free, part_w, part_h, kerf))
+        sheet['placements'].append((part, free[0], free[1], part_w, part_h, rotated))
+    return sheets, unplaced
+
+def plan_cut_list(conn, parts, kerf=3.0, allow_rotation=True):
+    """
+    Plan cutting `parts` from materials in stock.
+    Each part is {'name', 'material_id', 'length', 'width' (optional), 'quantity'}
+    in the material's dimension unit; materials with a width are packed as
+    sheets, others as lengths. Returns the plan with waste figures and
+    the number of stock pieces to deduct per material.
+    """
+    by_material = {}
+    for part in parts:
+        by_material.setdefault(int(part['material_id']), []).append(part)
+
+    plan = {'materials': [], 'unplaced': [], 'stock_area_mm2': 0, 'parts_area_mm2': 0}
+    for material_id, material_parts in by_material.items():
+        material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
+        if not material or not material['dimensions_length']:
+            plan['unplaced'].extend({'name': part.get('name'), 'reason': 'Material has no dimensions'} for part in material_parts)
+            continue
+
+        unit = material['dimension_unit']
+        stock_length = to_mm(material['dimensions_length'], unit)
+        stock_width = to_mm(material['dimensions_width'], unit) if material['dimensions_width'] else None
+        stock_count = int(material['quantity'] or 0)
+        if is_length_unit(material['unit']):
+            # Stock counted as a total length, e.g. 12 m of 2.4 m lengths
+            stock_count = int(to_mm(material['quantity'] or 0, material['unit']) // stock_length)
+
+        expanded = []
+        for part in material_parts:
+            for _ in range(int(part.get('quantity') or 1)):
+                expanded.append({
+                    'name': part.get('name') or 'Part',
+                    'length': to_mm(part['length'], unit),
+                    'width': to_mm(part['width'], unit) if part.get('width') else None,
+                })
+
+        result = {'material_id': material_id, 'name': material['name'], 'stock_available': stock_count}
+        if stock_width:
+            sheets, unplaced = pack_sheets(expanded, stock_length, stock_width, stock_count, kerf, allow_rotation)
+            stock_area = len(sheets) * stock_length * stock_width
+            parts_area = sum(w * h for sheet in sheets for _, _, _, w, h, _ in sheet['placements'])
+            result.update({
+                'kind': 'sheet',
+                'stock_size_mm': [stock_length, stock_width],
+                'pieces_used': len(sheets),
+                'layout': [{
+                    'placements': [{'part': part['name'], 'x': x, 'y': y, 'length': w, 'width': h, 'rotated': rotated}
+                                   for part, x, y, w, h, rotated in sheet['placements']],
+                    'offcuts': [{'x': x, 'y': y, 'length': w, 'width': h} for x, y, w, h in sheet['free']
+                                if w >= CUTLIST_MIN_OFFCUT_MM and h >= CUTLIST_MIN_OFFCUT_MM],
+                } for sheet in sheets],
+            })
+        else:
+            pieces, unplaced = pack_lengths(expanded, stock_length, stock_count, kerf)
+            stock_area = len(pieces) * stock_length
+            parts_area = sum(part['length'] for piece in pieces for part, _ in piece['cuts'])
+            result.update({
+                'kind': 'length',
+                'stock_size_mm': [stock_length],
+                'pieces_used': len(pieces),
+                'layout': [{
+                    'cuts': [{'part': part['name'], 'offset': offset, 'length': part['length']} for part, offset in piece['cuts']],
+                    'offcut': piece['remaining'] if piece['remaining'] >= CUTLIST_MIN_OFFCUT_MM else 0,
+                } for piece in pieces],
+            })
+
+        result['waste_percent'] = round(100 * (1 - parts_area / stock_area), 1) if stock_area else 0
+        plan['materials'].append(result)
+        plan['stock_area_mm2'] += stock_area
+        plan['parts_area_mm2'] += parts_area
+        plan['unplaced'].extend({'name': part['name'], 'material_id': material_id, 'reason': 'Not enough stock'} for part in unplaced)
+
+    plan['waste_percent'] = round(100 * (1 - plan['parts_area_mm2'] / plan['stock_area_mm2']), 1) if plan['stock_area_mm2'] else 0
+    return plan
+
+def deduct_cut_list_stock(conn, plan):
+    """Deduct the stock pieces a plan uses from materials (caller commits)"""
+    for result in plan['materials']:
+        material = conn.execute('SELECT unit, dimensions_length, dimension_unit FROM materials WHERE id = ?',
+                                (result['material_id'],)).fetchone()
+        used = result['pieces_used']
+        if is_length_unit(material['unit']):
+            # Convert whole lengths back into the stock's quantity unit
+            used = used * to_mm(material['dimensions_length'], material['dimension_unit']) / to_mm(1, material['unit'])
+        conn.execute('UPDATE materials SET quantity = MAX(quantity - ?, 0) WHERE id = ?', (used, result['material_id']))
+
+@app.route('/cutlist')
+def cut_list():
+    """Cut list planner page"""
+    conn = get_db()
+    materials = conn.execute('''
+        SELECT * FROM materials
+        WHERE dimensions_length IS NOT NULL AND quantity > 0
+        ORDER BY category, name
+    ''').fetchall()
+    conn.close()
+
+    return render_template('cutlist.html', materials=materials)
+
+def parse_cut_list_request(data):
+    """
+    Check a cut list request body and convert its numbers, returning
+    (parts, kerf, allow_rotation); raises ValueError naming what's wrong
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('parts'), list) or not data['parts']:
+        raise ValueError('No parts provided')
+
+    parts = []
+    for number, part in enumerate(data['parts'], start=1):
+        if not isinstance(part, dict):
+            raise ValueError(f'Part {number} must be an object')
+        try:
+            material_id = int(part['material_id'])
+            length = float(part['length'])
+            width = float(part['width']) if part.get('width') not in (None, '') else None
+            quantity = int(part.get('quantity') or 1)
+        except KeyError as e:
+            raise ValueError(f'Part {number} is missing {e.args[0]}')
+        except (TypeError, ValueError):
+            raise ValueError(f'Part {number} has a material_id, length, width or quantity that is not a number')
+        sizes = [length] if width is None else [length, width]
+        if quantity < 1 or not all(math.isfinite(size) and size > 0 for size in sizes):
+            raise ValueError(f'Part {number} needs a positive length, width and quantity')
+        parts.append({'name': part.get('name'), 'material_id': material_id,
+                      'length': length, 'width': width, 'quantity': quantity})
+
+    if sum(part['quantity'] for part in parts) > CUTLIST_MAX_PARTS:
+        raise ValueError(f'At most {CUTLIST_MAX_PARTS} parts per plan')
+    try:
+        kerf = float(data.get('kerf', 3))
+    except (TypeError, ValueError):
+        raise ValueError('kerf must be a number')
+    if not math.isfinite(kerf) or kerf < 0:
+        raise ValueError('kerf must be zero or more')
+    return parts, kerf, bool(data.get('allow_rotation', True))
+
+@app.route('/api/cutlist/plan', methods=['POST'])
+def api_cut_list_plan():
+    """Plan a cut list without changing stock"""
+    try:
+        parts, kerf, allow_rotation = parse_cut_list_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    conn = get_db()
+    plan = plan_cut_list(conn, parts, kerf, allow_rotation)
+    conn.close()
+
+    return jsonify({'success': True, 'plan': plan})
+
+@app.route('/api/cutlist/accept', methods=['POST'])
+def api_cut_list_accept():
+    """Re-plan a cut list against current stock and deduct the stock it uses"""
+    try:
+        parts, kerf, allow_rotation = parse_cut_list_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    conn = get_db()
+    plan = plan_cut_list(conn, parts, kerf, allow_rotation)
+    if plan['unplaced']:
+        conn.close()
+        return jsonify({'success': False, 'error': 'Not all parts fit in stock', 'plan': plan}), 409
+
+    deduct_cut_list_stock(conn, plan)
+    conn.commit()
+    conn.close()
+
+    return jsonify({'success': True, 'plan': plan})
+
+# Projects
+
+# Every requirement with its current stock, in one pass of primary-key
+# lookups. Requirements without an inventory item are never in stock.
+# Unit an inventory requirement's item is stocked in (NULL for tools and free-text items)
+_REQUIREMENT_STOCK_UNIT = "CASE WHEN COALESCE(c.id, m.id, f.id) IS NOT NULL THEN COALESCE(c.unit, m.unit, 'pcs') END"
+
+# Requirements with what is in stock. A requirement given in another unit of
+# the same kind as the stock (300 mm of timber stocked in metres) is
+# converted to the stock's unit, rounded so 300 mm matches 0.3 m exactly.
+REQUIREMENT_STOCK_SQL = f'''
+    SELECT r.id, r.project_id, r.item_type, r.item_id,
+           CASE WHEN NULLIF(TRIM(r.unit), '') IS NOT NULL AND {_REQUIREMENT_STOCK_UNIT} IS NOT NULL
+                     AND {unit_base_sql('r.unit')} = {unit_base_sql(_REQUIREMENT_STOCK_UNIT)}
+                THEN ROUND(r.quantity * {unit_factor_sql('r.unit')} / {unit_factor_sql(_REQUIREMENT_STOCK_UNIT)}, 9)
+                ELSE r.quantity
+           END AS required,
+           COALESCE(t.name, c.name, m.name,
+                    f.category || ' ' || f.size || COALESCE(' x ' || f.length, ''),
+                    r.item_name) AS name,
+           COALESCE(c.unit, m.unit, CASE WHEN f.id IS NOT NULL THEN 'pcs' END, r.unit) AS unit,
+           CASE r.item_type
+               WHEN 'tool' THEN CASE WHEN t.id IS NOT NULL THEN 1 ELSE 0 END
+               WHEN 'consumable' THEN COALESCE(c.quantity, 0)
+               WHEN 'material' THEN COALESCE(m.quantity, 0)
+               WHEN 'fastener' THEN COALESCE(f.quantity, 0)
+               ELSE 0
+           END AS available,
+           m.supplier
+    FROM project_requirements r
+    LEFT JOIN tools t ON r.item_type = 'tool' AND t.id = r.item_id
+    LEFT JOIN consumables c ON r.item_type = 'consumable' AND c.id = r.item_id
+    LEFT JOIN materials m ON r.item_type = 'material' AND m.id = r.item_id
+    LEFT JOIN fasteners f ON r.item_type = 'fastener' AND f.id = r.item_id
+'''
+
+def project_feasibility(conn):
+    """Buildable status and missing count for every project, in one set-based query"""
+    return conn.execute(f'''
+        WITH needs AS ({REQUIREMENT_STOCK_SQL})
+        SELECT p.*,
+               COUNT(n.id) AS requirement_count,
+               COALESCE(SUM(n.available < n.required), 0) AS missing_count,
+               COUNT(n.id) > 0 AND COALESCE(SUM(n.available < n.required), 0) = 0 AS buildable
+        FROM projects p
+        LEFT JOIN needs n ON n.project_id = p.id
+        GROUP BY p.id
+        ORDER BY buildable DESC, missing_count, p.name
+    ''').fetchall()
+
+def push_project_shortfall(conn, project_ids):
+    """
+    Add what the given projects are missing to the shopping list.
+    Demand for an item shared by several projects is summed before
+    comparing with stock; items already on the list are skipped.
+    Returns the number of items added.
+    """
+    placeholders = ', '.join('?' * len(project_ids))
+    conn.execute(f'''
+        WITH needs AS ({REQUIREMENT_STOCK_SQL} WHERE r.project_id IN ({placeholders})),
+        shortfall AS (
+            SELECT item_type, item_id, name, unit, MAX(supplier) AS supplier,
+                   SUM(required) - MAX(available) AS missing,
+                   GROUP_CONCAT(DISTINCT (SELECT name FROM projects WHERE id = project_id)) AS project_names
+            FROM needs
+            GROUP BY item_type, COALESCE(item_id, name)
+            HAVING SUM(required) > MAX(available)
+        )
+        INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit, store, notes)
+        SELECT s.name, s.item_type, s.item_id, s.missing, s.unit, COALESCE(s.supplier, 'Bunnings'),
+               'For project: ' || s.project_names
+        FROM shortfall s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM shopping_list l
+            WHERE l.purchased = 0
+              AND ((s.item_id IS NOT NULL AND l.item_type = s.item_type AND l.item_id = s.item_id)
+                   OR (s.item_id IS NULL AND l.item_name = s.name))
+        )
+    ''', project_ids)
+    # cursor.rowcount is -1 for a statement starting with WITH
+    return conn.execute('SELECT changes()').fetchone()[0]
+
+@app.route('/projects')
+def projects():
+    """List projects with what can be built now"""
+    conn = get_db()
+    projects = project_feasibility(conn)
+    conn.close()
+
+    return render_template('projects.html', projects=projects)
+
+@app.route('/project/add', methods=['POST'])
+def add_project():
+    """Add new project"""
+    name = request.form.get('name')
+    if not name:
+        return redirect(url_for('projects', toast='Project name is required', toast_type='error'))
+
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO projects (name, description, status, notes)
+        VALUES (?, ?, ?, ?)
+    ''', (name, request.form.get('description'), request.form.get('status', 'Planned'), request.form.get('notes')))
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('project_detail', project_id=c.lastrowid))
+
+@app.route('/project/<int:project_id>')
+def project_detail(project_id):
+    """Project bill of materials with stock shortfalls"""
+    conn = get_db()
+    project = conn.execute('SELECT * FROM projects WHERE id = ?', (project_id,)).fetchone()
+
+    if not project:
+        conn.close()
+        return redirect(url_for('projects'))
+
+    requirements = conn.execute(f'''
+        SELECT *, MAX(required - available, 0) AS shortfall
+        FROM ({REQUIREMENT_STOCK_SQL} WHERE r.project_id = ?)
+        ORDER BY shortfall = 0, item_type, name
+    ''', (project_id,)).fetchall()
+
+    # Inventory to pick requirements from
+    inventory = {
+        'tool': conn.execute('SELECT id, name FROM tools ORDER BY name').fetchall(),
+        'consumable': conn.execute('SELECT id, name FROM consumables ORDER BY name').fetchall(),
+        'material': conn.execute('SELECT id, name FROM materials ORDER BY name').fetchall(),
+        'fastener': conn.execute('''
+            SELECT id, category || ' ' || size || COALESCE(' x ' || length, '') AS name
+            FROM fasteners ORDER BY category, size
+        ''').fetchall(),
+    }
+
+    conn.close()
+
+    return render_template('project_detail.html', project=project, requirements=requirements, inventory=inventory)
+
+@app.route('/project/<int:project_id>/edit', methods=['POST'])
+def edit_project(project_id):
+    """Update a project's details"""
+    conn = get_db()
+    conn.execute('''
+        UPDATE projects SET name = ?, description = ?, status = ?, notes = ?
+        WHERE id = ?
+    ''', (request.form.get('name'), request.form.get('description'), request.form.get('status'),
+          request.form.get('notes'), project_id))
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('project_detail', project_id=project_id, toast='Project updated', toast_type='success'))
+
+@app.route('/project/<int:project_id>/delete', methods=['POST'])
+def delete_project(project_id):
+    """Delete a project and its requirements"""
+    conn = get_db()
+    conn.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('projects'))
+
+def parse_project_requirement(conn, project_id, form):
+    """
+    Validate a requirement form: an inventory item ('material:4') that
+    exists, or a free-text name, a positive quantity, and for stocked items
+    a unit of the same kind as the stock. Returns (item_type, item_id,
+    item_name, quantity, unit); raises ValueError with a message to show.
+    """
+    if not conn.execute('SELECT 1 FROM projects WHERE id = ?', (project_id,)).fetchone():
+        raise ValueError('That project no longer exists')
+
+    item_type, item_id, item_name = None, None, (form.get('item_name') or '').strip() or None
+    item = form.get('item', '')
+    if item:
+        item_type, _, item_id = item.partition(':')
+        if item_type not in CATALOGUE_ITEM_TABLES or not item_id.isdigit():
+            raise ValueError(f'Unknown item {item}')
+        item_id = int(item_id)
+        row = conn.execute(f'SELECT * FROM {CATALOGUE_ITEM_TABLES[item_type]} WHERE id = ?', (item_id,)).fetchone()
+        if row is None:
+            raise ValueError(f'That {item_type} no longer exists')
+    elif not item_name:
+        raise ValueError('Choose an item or enter a name')
+
+    try:
+        quantity = float(form.get('quantity') or 1)
+    except ValueError:
+        raise ValueError('Quantity must be a number')
+    if not quantity > 0:
+        raise ValueError('Quantity must be more than zero')
+
+    unit = (form.get('unit') or '').strip() or None
+    if unit and item_type in STOCKED_TABLES:
+        stock_unit = row['unit'] if item_type != 'fastener' else 'pcs'
+        if unit_base(unit) != unit_base(stock_unit):
+            raise ValueError(f"{unit} can't be compared with stock counted in {stock_unit or 'pcs'}")
+    return item_type, item_id, item_name, quantity, unit
+
+@app.route('/project/<int:project_id>/requirement/add', methods=['POST'])
+def add_project_requirement(project_id):
+    """Add an inventory item (e.g. 'material:4') or a free-text item to a project"""
+    conn = get_db()
+    try:
+        values = parse_project_requirement(conn, project_id, request.form)
+    except ValueError as e:
+        conn.close()
+        return redirect(url_for('project_detail', project_id=project_id, toast=str(e), toast_type='error'))
+
+    conn.execute('''
+        INSERT INTO project_requirements (project_id, item_type, item_id, item_name, quantity, unit)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (project_id, *values))
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('project_detail', project_id=project_id))
+
+@app.route('/project/requirement/<int:requirement_id>/delete', methods=['POST'])
+def delete_project_requirement(requirement_id):
+    """Remove a requirement from its project"""
+    conn = get_db()
+    requirement = conn.execute('SELECT project_id FROM project_requirements WHERE id = ?', (requirement_id,)).fetchone()
+    conn.execute('DELETE FROM project_requirements WHERE id = ?', (requirement_id,))
+    conn.commit()
+    conn.close()
+
+    if not requirement:
+        return redirect(url_for('projects'))
+    return redirect(url_for('project_detail', project_id=requirement['project_id']))
+
+@app.route('/project/<int:project_id>/shop', methods=['POST'])
+def shop_project_shortfall(project_id):
+    """Add a project's missing items to the shopping list"""
+    conn = get_db()
+    added_count = push_project_shortfall(conn, [project_id])
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('shopping_list', toast=f'Added {added_count} missing items to shopping list', toast_type='success'))
+
+@app.route('/projects/shop', methods=['POST'])
+def shop_all_project_shortfalls():
+    """Add everything unfinished projects are missing to the shopping list"""
+    conn = get_db()
+    project_ids = [row['id'] for row in conn.execute("SELECT id FROM projects WHERE status != 'Done'")]
+    added_count = push_project_shortfall(conn, project_ids) if project_ids else 0
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('shopping_list', toast=f'Added {added_count} missing items to shopping list', toast_type='success'))
+
+@app.route('/api/projects/buildable')
+def api_buildable_projects():
+    """Feasibility of every project as JSON"""
+    conn = get_db()
+    projects = project_feasibility(conn)
+    conn.close()
+
+    return jsonify([dict(row) for row in projects])
+
+# Maintenance
+
+# Days ahead that count as "due this week" on the dashboard
+MAINTENANCE_DUE_SOON_DAYS = 7
+
+def tool_usage_rate(conn, tool_id, usage_hours, today=None):
+    """The tool's average hours per day since its earliest logged reading, or None"""
+    today = today or datetime.now().date()
+    first = conn.execute('''
+        SELECT performed_at, usage_hours FROM maintenance_log
+        WHERE tool_id = ? AND usage_hours IS NOT NULL
+        ORDER BY performed_at, id LIMIT 1
+    ''', (tool_id,)).fetchone()
+    if not first:
+        return None
+    days = (today - parse_timestamp(first['performed_at']).date()).days
+    hours = (usage_hours or 0) - first['usage_hours']
+    return hours / days if days > 0 and hours > 0 else None
+
+def compute_next_due(schedule, usage_hours, today=None, usage_rate=None):
+    """
+    Work out (next_due date, next_due_hours) for a maintenance schedule.
+    Time intervals count from the last service (or schedule creation).
+    Usage intervals are projected to a date from the tool's hours per day
+    since the last service, or from `usage_rate` (its longer-run average)
+    when there's been no use to go by yet, such as right after a service;
+    whichever comes first wins. With no rate at all, only reaching the
+    hours makes it due.
+    """
+    today = today or datetime.now().date()
+    last_done = parse_timestamp(schedule['last_done_at'] or schedule['created_at']).date()
+    candidates = []
+
+    if schedule['interval_days']:
+        candidates.append(last_done + timedelta(days=int(schedule['interval_days'])))
+
+    next_due_hours = None
+    if schedule['interval_hours']:
+        last_hours = schedule['last_done_hours'] or 0
+        next_due_hours = last_hours + float(schedule['interval_hours'])
+        hours_left = next_due_hours - (usage_hours or 0)
+        days_elapsed = (today - last_done).days
+        hours_per_day = ((usage_hours or 0) - last_hours) / days_elapsed if days_elapsed > 0 else 0
+        if hours_per_day <= 0:
+            hours_per_day = usage_rate or 0
+        if hours_left <= 0:
+            candidates.append(today)
+        elif hours_per_day > 0:
+            candidates.append(today + timedelta(days=math.ceil(hours_left / hours_per_day)))
+
+    next_due = min(candidates).strftime('%Y-%m-%d') if candidates else None
+    return next_due, next_due_hours
+
+def refresh_tool_schedules(conn, tool_id, schedule_ids=None):
+    """Recompute next_due for a tool's schedules (all of them, or just `schedule_ids`)"""
+    tool = conn.execute('SELECT usage_hours FROM tools WHERE id = ?', (tool_id,)).fetchone()
+    usage_hours = tool['usage_hours'] if tool else 0
+    query = 'SELECT * FROM maintenance_schedules WHERE tool_id = ?'
+    params = [tool_id]
+    if schedule_ids:
+        query += f" AND id IN ({', '.join('?' * len(schedule_ids))})"
+        params.extend(schedule_ids)
+
+    usage_rate = tool_usage_rate(conn, tool_id, usage_hours)
+    for schedule in conn.execute(query, params).fetchall():
+        next_due, next_due_hours = compute_next_due(schedule, usage_hours, usage_rate=usage_rate)
+        conn.execute(
+            'UPDATE maintenance_schedules SET next_due = ?, next_due_hours = ? WHERE id = ?',
+            (next_due, next_due_hours, schedule['id'])
+        )
+
+def refresh_usage_schedules(conn):
+    """
+    Re-project usage-based schedules once a day, as the hours-per-day
+    rate they were projected from drifts while a tool sits unused
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    if get_job_state(conn, 'usage_schedules_at') == today:
+        return 0
+    tool_ids = [row['tool_id'] for row in conn.execute(
+        'SELECT DISTINCT tool_id FROM maintenance_schedules WHERE interval_hours IS NOT NULL'
+    )]
+    for tool_id in tool_ids:
+        refresh_tool_schedules(conn, tool_id)
+    set_job_state(conn, 'usage_schedules_at', today)
+    conn.commit()
+    return len(tool_ids)
+
+def due_maintenance(conn, days, limit=None, today=None):
+    """Schedules due within `days` of `today` (local, like next_due; including overdue), from the next_due index"""
+    today = today or datetime.now().date()
+    query = '''
+        SELECT s.*, t.name AS tool_name,
+               CAST(julianday(s.next_due) - julianday(?) AS INTEGER) AS days_left
+        FROM maintenance_schedules s
+        JOIN tools t ON t.id = s.tool_id
+        WHERE s.next_due <= ?
+        ORDER BY s.next_due
+    '''
+    params = [today.isoformat(), (today + timedelta(days=days)).isoformat()]
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+@app.route('/maintenance')
+def maintenance():
+    """Upcoming and overdue maintenance across all tools"""
+    conn = get_db()
+    due = due_maintenance(conn, days=request.args.get('days', 30, type=int))
+    recent = conn.execute('''
+        SELECT l.*, t.name AS tool_name FROM maintenance_log l
+        JOIN tools t ON t.id = l.tool_id
+        ORDER BY l.performed_at DESC, l.id DESC
+        LIMIT 20
+    ''').fetchall()
+    conn.close()
+
+    return render_template('maintenance.html', due=due, recent=recent)
+
+@app.route('/tool/<int:tool_id>/maintenance/schedule', methods=['POST'])
+def add_maintenance_schedule(tool_id):
+    """Add a recurring maintenance task to a tool"""
+    task = request.form.get('task')
+    interval_days = request.form.get('interval_days') or None
+    interval_hours = request.form.get('interval_hours') or None
+    if not task or not (interval_days or interval_hours):
+        return redirect(url_for('tool_detail', tool_id=tool_id, toast='Task and an interval are required', toast_type='error'))
+
+    conn = get_db()
+    c = conn.cursor()
+    tool = conn.execute('SELECT usage_hours FROM tools WHERE id = ?', (tool_id,)).fetchone()
+    c.execute('''
+        INSERT INTO maintenance_schedules (tool_id, task, interval_days, interval_hours,
+                                           last_done_at, last_done_hours, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (tool_id, task, interval_days, interval_hours,
+          request.form.get('last_done_at') or datetime.now().strftime('%Y-%m-%d'),
+          tool['usage_hours'] if tool else 0, request.form.get('notes')))
+    refresh_tool_schedules(conn, tool_id, [c.lastrowid])
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('tool_detail', tool_id=tool_id, toast='Maintenance schedule added', toast_type='success'))
+
+@app.route('/maintenance/schedule/<int:schedule_id>/delete', methods=['POST'])
+def delete_maintenance_schedule(schedule_id):
+    """Delete a maintenance schedule (its log entries are kept)"""
+    conn = get_db()
+    schedule = conn.execute('SELECT tool_id FROM maintenance_schedules WHERE id = ?', (schedule_id,)).fetchone()
+    conn.execute('DELETE FROM maintenance_schedules WHERE id = ?', (schedule_id,))
+    conn.commit()
+    conn.close()
+
+    if not schedule:
+        return redirect(url_for('maintenance'))
+    return redirect(url_for('tool_detail', tool_id=schedule['tool_id']))
+
+@app.route('/tool/<int:tool_id>/maintenance/log', methods=['POST'])
+def log_maintenance(tool_id):
+    """Log a service; completes its schedule and moves next_due forward"""
+    schedule_id = request.form.get('schedule_id', type=int)
+    performed_at = request.form.get('performed_at') or datetime.now().strftime('%Y-%m-%d')
+    usage_hours = request.form.get('usage_hours', type=float)
+
+    conn = get_db()
+    schedule = None
+    if schedule_id:
+        schedule = conn.execute(
+            'SELECT * FROM maintenance_schedules WHERE id = ? AND tool_id = ?', (schedule_id, tool_id)
+        ).fetchone()
+    task = request.form.get('task') or (schedule['task'] if schedule else None)
+    if not task:
+        conn.close()
+        return redirect(url_for('tool_detail', tool_id=tool_id, toast='Choose a task', toast_type='error'))
+
+    if usage_hours is not None:
+        conn.execute('UPDATE tools SET usage_hours = MAX(COALESCE(usage_hours, 0), ?) WHERE id = ?', (usage_hours, tool_id))
+    hours = conn.execute('SELECT usage_hours FROM tools WHERE id = ?', (tool_id,)).fetchone()['usage_hours']
+
+    conn.execute('''
+        INSERT INTO maintenance_log (tool_id, schedule_id, task, performed_at, usage_hours, cost, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (tool_id, schedule['id'] if schedule else None, task, performed_at, hours,
+          request.form.get('cost') or None, request.form.get('notes')))
+
+    if schedule:
+        conn.execute('''
+            UPDATE maintenance_schedules SET last_done_at = ?, last_done_hours = ? WHERE id = ?
+        ''', (performed_at, hours, schedule['id']))
+    # New hours can bring other usage-based schedules forward too
+    refresh_tool_schedules(conn, tool_id)
+
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('tool_detail', tool_id=tool_id, toast='Service logged', toast_type='success'))
+
+@app.route('/tool/<int:tool_id>/hours', methods=['POST'])
+def update_tool_hours(tool_id):
+    """Record the tool's current usage hours reading"""
+    usage_hours = request.form.get('usage_hours', type=float)
+    if usage_hours is None:
+        return redirect(url_for('tool_detail', tool_id=tool_id, toast='Enter the hours reading', toast_type='error'))
+
+    conn = get_db()
+    conn.execute('UPDATE tools SET usage_hours = ? WHERE id = ?', (usage_hours, tool_id))
+    refresh_tool_schedules(conn, tool_id)
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for('tool_detail', tool_id=tool_id, toast='Usage hours updated', toast_type='success'))
+
+# Loans
+
+# Minimum seconds between overdue sweeps triggered by page views
+LOAN_SWEEP_INTERVAL = 15 * 60
+
+def sweep_overdue_loans(conn, force=False):
+    """
+    Flag open loans past their due date, and clear the flag on any that were
+    extended. Both are single set-based UPDATEs over the open-loan index;
+    page views run the sweep at most once per LOAN_SWEEP_INTERVAL.
+    """
+    now = datetime.now()
+    last_run = get_job_state(conn, 'loan_sweep_at')
+    if not force and last_run and (now - parse_timestamp(last_run)).total_seconds() < LOAN_SWEEP_INTERVAL:
+        return 0
+
+    today = now.strftime('%Y-%m-%d')
+    flagged = conn.execute('''
+        UPDATE loans SET overdue = 1
+        WHERE returned_at IS NULL AND due_at < ? AND overdue = 0
+    ''', (today,)).rowcount
+    conn.execute('''
+        UPDATE loans SET overdue = 0
+        WHERE returned_at IS NULL AND due_at >= ? AND overdue = 1
+    ''', (today,))
+    set_job_state(conn, 'loan_sweep_at', now.isoformat(timespec='seconds'))
+    conn.commit()
+    return flagged
+
+@app.route('/loans')
+def loans():
+    """Tools currently lent out, overdue first"""
+    conn = get_db()
+    sweep_overdue_loans(conn)
+    open_loans = conn.execute('''
+        SELECT l.*, t.name AS tool_name FROM loans l
+        JOIN tools t ON t.id = l.tool_id
+        WHERE l.returned_at IS NULL
+        ORDER BY l.overdue DESC, l.due_at IS NULL, l.due_at
+    ''').fetchall()
+    borrowers = conn.execute('''
+        SELECT borrower, COUNT(*) AS loan_count,
+               SUM(returned_at IS NULL) AS open_count,
+               MAX(lent_at) AS last_lent_at
+        FROM loans
+        GROUP BY borrower
+        ORDER BY last_lent_at DESC
+    ''').fetchall()
+    conn.close()
+
+    return render_template('loans.html', loans=open_loans, borrowers=borrowers)
+
+@app.route('/borrower/<path:borrower>')
+def borrower_history(borrower):
+    """Everything a borrower has had, newest first"""
+    conn = get_db()
+    history = conn.execute('''
+        SELECT l.*, t.name AS tool_name FROM loans l
+        JOIN tools t ON t.id = l.tool_id
+        WHERE l.borrower = ?
+        ORDER BY l.lent_at DESC, l.id DESC
+    ''', (borrower,)).fetchall()
+    conn.close()
+
+    if not history:
+        return "Borrower not found", 404
+
+    return render_template('borrower.html', borrower=history[0]['borrower'], history=history)
+
+@app.route('/tool/<int:tool_id>/lend', methods=['POST'])
+def lend_tool(tool_id):
+    """Lend a tool out"""
+    borrower = (request.form.get('borrower') or '').strip()
+    if not borrower:
+        return redirect(url_for('tool_detail', tool_id=tool_id, toast='Borrower is required', toast_type='error'))
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    due_at = request.form.get('due_at') or None
+
+    conn = get_db()
+    try:
+        conn.execute('''
+            INSERT INTO loans (tool_id, borrower, lent_at, due_at, overdue, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (tool_id, borrower, request.form.get('lent_at') or today, due_at,
+              int(bool(due_at and due_at < today)), request.form.get('notes')))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.close()
+        return redirect(url_for('tool_detail', tool_id=tool_id, toast='Tool is already lent out', toast_type='error'))
+    conn.close()
+
+    return redirect(url_for('tool_detail', tool_id=tool_id, toast=f'Lent to {borrower}', toast_type='success'))
+
+@app.route('/loan/<int:loan_id>/return', methods=['POST'])
+def return_loan(loan_id):
+    """Mark a loan returned, recording the tool's condition"""
+    conn = get_db()
+    loan = conn.execute('SELECT * FROM loans WHERE id = ?', (loan_id,)).fetchone()
+    if not loan:
+        conn.close()
+        return "Loan not found", 404
+
+    condition = request.form.get('return_condition') or None
+    conn.execute('''
+        UPDATE loans SET returned_at = ?, return_condition = ?, overdue = 0
+        WHERE id = ? AND returned_at IS NULL
+    ''', (request.form.get('returned_at') or datetime.now().strftime('%Y-%m-%d'), condition, loan_id))
+    if condition:
+        conn.execute('UPDATE tools SET condition = ? WHERE id = ?', (condition, loan['tool_id']))
+    conn.commit()
+    conn.close()
+
+    if request.form.get('next') == 'loans':
+        return redirect(url_for('loans', toast='Tool returned', toast_type='success'))
+    return redirect(url_for('tool_detail', tool_id=loan['tool_id'], toast='Tool returned', toast_type='success'))
+
+@app.route('/api/loans/overdue')
+def api_overdue_loans():
+    """Overdue loans as JSON; ?sweep=1 forces a fresh sweep first"""
+    conn = get_db()
+    sweep_overdue_loans(conn, force=request.args.get('sweep') == '1')
+    overdue = conn.execute('''
+        SELECT l.id, l.tool_id, t.name AS tool_name, l.borrower, l.lent_at, l.due_at
+        FROM loans l
+        JOIN tools t ON t.id = l.tool_id
+        WHERE l.returned_at IS NULL AND l.overdue = 1
+        ORDER BY l.due_at
+    ''').fetchall()
+    conn.close()
+
+    return jsonify([dict(row) for row in overdue])
+
+# Batteries
+
+# Charge level (percent) at or above which a battery counts as usable
+BATTERY_USABLE_LEVEL = 25
+
+class BatteryIndex:
+    """
+    In-memory "usable now" index for battery tools.
+    Each platform keeps a bitset of the tool ids that take its batteries
+    and a count of its usable batteries, so the usable tool set is the OR
+    of the bitsets of platforms with at least one usable battery.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = {}
+        self._usable = {}
+        self._loaded = False
+
+    def load(self, conn):
+        """Build the index from the link and battery tables"""
+        with self._lock:
+            self._tools = {}
+            self._usable = {}
+            for row in conn.execute('SELECT tool_id, platform_id FROM tool_battery_platform'):
+                self._tools[row['platform_id']] = self._tools.get(row['platform_id'], 0) | (1 << row['tool_id'])
+            rows = conn.execute('''
+                SELECT platform_id, COUNT(*) AS count FROM batteries
+                WHERE charge_level >= ? GROUP BY platform_id
+            ''', (BATTERY_USABLE_LEVEL,)).fetchall()
+            for row in rows:
+                self._usable[row['platform_id']] = row['count']
+            self._loaded = True
+
+    def ensure_loaded(self, conn):
+        if not self._loaded:
+            self.load(conn)
+
+    def set_tool_platforms(self, tool_id, platform_ids):
+        """Replace a tool's platforms (an empty list removes the tool)"""
+        if not self._loaded:
+            return
+        bit = 1 << tool_id
+        with self._lock:
+            for platform_id in self._tools:
+                self._tools[platform_id] &= ~bit
+            for platform_id in platform_ids:
+                self._tools[platform_id] = self._tools.get(platform_id, 0) | bit
+
+    def apply_battery(self, old=None, new=None):
+        """Update usable counts after a battery insert, update or delete"""
+        if not self._loaded:
+            return
+        with self._lock:
+            if old and old['charge_level'] >= BATTERY_USABLE_LEVEL:
+                self._usable[old['platform_id']] = self._usable.get(old['platform_id'], 0) - 1
+            if new and new['charge_level'] >= BATTERY_USABLE_LEVEL:
+                self._usable[new['platform_id']] = self._usable.get(new['platform_id'], 0) + 1
+
+    def remove_platform(self, platform_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._tools.pop(platform_id, None)
+            self._usable.pop(platform_id, None)
+
+    def usable_tool_ids(self):
+        """Ids of battery tools with at least one usable compatible battery"""
+        with self._lock:
+            bits = 0
+            for platform_id, count in self._usable.items():
+                if count > 0:
+                    bits |= self._tools.get(platform_id, 0)
+        tool_ids = []
+        while bits:
+            low = bits & -bits
+            tool_ids.append(low.bit_length() - 1)
+            bits ^= low
+        return tool_ids
+
+battery_index = WorkspaceLocal(BatteryIndex)
+
+def set_tool_platforms(conn, tool_id, platform_ids):
+    """Replace the battery platforms a tool takes"""
+    platform_ids = sorted({int(p) for p in platform_ids if str(p).isdigit()})
+    conn.execute('DELETE FROM tool_battery_platform WHERE tool_id = ?', (tool_id,))
+    conn.executemany(
+        'INSERT OR IGNORE INTO tool_battery_platform (tool_id, platform_id) VALUES (?, ?)',
+        [(tool_id, platform_id) for platform_id in platform_ids]
+    )
+    return platform_ids
+
+def usable_tools(conn):
+    """Battery tools that can be used right now, by name"""
+    battery_index.ensure_loaded(conn)
+    tool_ids = battery_index.usable_tool_ids()
+    if not tool_ids:
+        return []
+    # Chunked to stay under SQLite's bound-parameter limit
+    tools = []
+    for start in range(0, len(tool_ids), 500):
+        chunk = tool_ids[start:start + 500]
+        tools.extend(conn.execute(
+            f"SELECT id, name, brand, model FROM tools WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return sorted(tools, key=lambda tool: (tool['name'] or '').lower())
+
+@app.route('/batteries')
+def batteries():
+    """Battery platforms, packs and the tools usable right now"""
+    conn = get_db()
+    platforms = conn.execute('''
+        SELECT p.*,
+               (SELECT COUNT(*) FROM batteries b WHERE b.platform_id = p.id) AS battery_count,
+               (SELECT COUNT(*) FROM batteries b WHERE b.platform_id = p.id AND b.charge_level >= ?) AS usable_count,
+               (SELECT COUNT(*) FROM tool_battery_platform tp WHERE tp.platform_id = p.id) AS tool_count
+        FROM battery_platforms p
+        ORDER BY p.brand, p.voltage, p.name
+    ''', (BATTERY_USABLE_LEVEL,)).fetchall()
+    packs = conn.execute('''
+        SELECT b.*, p.name AS platform_name FROM batteries b
+        JOIN battery_platforms p ON p.id = b.platform_id
+        ORDER BY p.name, b.label
+    ''').fetchall()
+    usable = usable_tools(conn)
+    conn.close()
+
+    return render_template('batteries.html', platforms=platforms, batteries=packs, usable=usable,
+                         usable_level=BATTERY_USABLE_LEVEL)
+
+@app.route('/battery-platform/add', methods=['POST'])
+def add_battery_platform():
+    """Add a battery platform such as "Ryobi ONE+ 18V\""""
+    name = (request.form.get('name') or '').strip()
+    if not name:
+        return redirect(url_for('batteries', toast='Platform name is required', toast_type='error'))
+
+    conn = get_db()
+    try:
+        conn.execute('INSERT INTO battery_platforms (name, brand, voltage) VALUES (?, ?, ?)',
+                     (name, request.form.get('brand'), request.form.get('voltage') or None))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.close()
+        return redirect(url_for('batteries', toast='Platform already exists', toast_type='error'))
+    conn.close()
+
+    return redirect(url_for('batteries', toast='Platform added', toast_type='success'))
+
+@app.route('/battery-platform/<int:platform_id>/delete', methods=['POST'])
+def delete_battery_platform(platform_id):
+    """Delete a platform with its batteries and tool links"""
+    conn = get_db()
+    conn.execute('DELETE FROM battery_platforms WHERE id = ?', (platform_id,))
+    conn.commit()
+    conn.close()
+    battery_index.remove_platform(platform_id)
+
+    return redirect(url_for('batteries'))
+
+@app.route('/battery/add', methods=['POST'])
+def add_battery():
+    """Add a battery pack to a platform"""
+    platform_id = request.form.get('platform_id', type=int)
+    if not platform_id:
+        return redirect(url_for('batteries', toast='Choose a platform', toast_type='error'))
+    charge_level = max(0, min(100, request.form.get('charge_level', 100, type=int)))
+
+    conn = get_db()
+    conn.execute('''
+        INSERT INTO batteries (platform_id, label, capacity_ah, charge_level, cycle_count, notes)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (platform_id, request.form.get('label'), request.form.get('capacity_ah') or None,
+          charge_level, request.form.get('cycle_count', 0, type=float), request.form.get('notes')))
+    conn.commit()
+    conn.close()
+    battery_index.apply_battery(new={'platform_id': platform_id, 'charge_level': charge_level})
+
+    return redirect(url_for('batteries', toast='Battery added', toast_type='success'))
+
+@app.route('/battery/<int:battery_id>/charge', methods=['POST'])
+def set_battery_charge(battery_id):
+    """
+    Record a battery's charge level (default: fully charged). Charging up
+    adds the fraction of a full cycle that was put back in.
+    """
+    charge_level = max(0, min(100, request.form.get('charge_level', 100, type=int)))
+
+    conn = get_db()
+    battery = conn.execute('SELECT * FROM batteries WHERE id = ?', (battery_id,)).fetchone()
+    if not battery:
+        conn.close()
+        return "Battery not found", 404
+
+    if charge_level > battery['charge_level']:
+        conn.execute('''
+            UPDATE batteries
+            SET charge_level = ?, cycle_count = cycle_count + ?, last_charged_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (charge_level, (charge_level - battery['charge_level']) / 100, battery_id))
+    else:
+        conn.execute('UPDATE batteries SET charge_level = ? WHERE id = ?', (charge_level, battery_id))
+    conn.commit()
+    conn.close()
+    battery_index.apply_battery(old=battery, new={'platform_id': battery['platform_id'], 'charge_level': charge_level})
+
+    return redirect(url_for('batteries'))
+
+@app.route('/battery/<int:battery_id>/delete', methods=['POST'])
+def delete_battery(battery_id):
+    """Delete a battery pack"""
+    conn = get_db()
+    battery = conn.execute('SELECT * FROM batteries WHERE id = ?', (battery_id,)).fetchone()
+    conn.execute('DELETE FROM batteries WHERE id = ?', (battery_id,))
+    conn.commit()
+    conn.close()
+    if battery:
+        battery_index.apply_battery(old=battery)
+
+    return redirect(url_for('batteries'))
+
+@app.route('/api/tools/usable-now')
+def api_usable_tools():
+    """Battery tools with a usable compatible battery, as JSON"""
+    conn = get_db()
+    tools = usable_tools(conn)
+    conn.close()
+
+    return jsonify([dict(tool) for tool in tools])
+
+# REST API v1
+
+# Resources exposed under /api/v1/<resource>: table, text columns searched
+# by ?q=, and columns the API never writes
+API_RESOURCES = {
+    'tools': {'table': 'tools', 'search': ['name', 'brand', 'model']},
+    'consumables': {'table': 'consumables', 'search': ['name', 'category', 'compatible_with']},
+    'materials': {'table': 'materials', 'search': ['name', 'category', 'material_type']},
+    'fasteners': {'table': 'fasteners', 'search': ['category', 'size', 'material', 'head_type']},
+    'favorites': {'table': 'favorites', 'search': ['item_type']},
+    'shopping-list': {'table': 'shopping_list', 'search': ['item_name', 'store']},
+}
+API_READ_ONLY_COLUMNS = {'id', 'created_at', 'location_id', 'image_path'}
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 500
+API_MAX_BULK = 1000
+
+# Responses smaller than this are sent uncompressed
+API_COMPRESS_MIN_SIZE = 512
+
+_api_columns = {}
+
+def api_schema(conn, table):
+    """
+    ({column: required}, generated column names) for a table, cached per
+    database file and schema version, so each workspace gets its own
+    columns and a migration is seen at once
+    """
+    pool = getattr(conn, 'pool', None)
+    path = pool.path if pool else conn.execute('PRAGMA database_list').fetchone()['file']
+    key = (path, conn.execute('PRAGMA schema_version').fetchone()[0], table)
+    if key not in _api_columns:
+        rows = conn.execute(f'PRAGMA table_xinfo({table})').fetchall()
+        _api_columns[key] = (
+            {row['name']: bool(row['notnull']) and row['dflt_value'] is None and not row['pk']
+             for row in rows if not row['hidden']},
+            {row['name'] for row in rows if row['hidden'] in (2, 3)},
+        )
+    return _api_columns[key]
+
+def api_columns(conn, table):
+    """{column: required} for a table's stored columns (required = NOT NULL without a default)"""
+    return api_schema(conn, table)[0]
+
+def api_readable_columns(conn, table):
+    """Columns ?fields= and filters may name: the stored ones plus generated ones such as base_quantity"""
+    columns, generated = api_schema(conn, table)
+    return set(columns) | generated
+
+def api_error(message, status=400):
+    return jsonify({'success': False, 'error': message}), status
+
+def api_select_list(conn, table):
+    """Validated SQL column list for the ?fields= projection (id always included)"""
+    columns = api_readable_columns(conn, table)
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    if not fields:
+        return '*'
+    unknown = [f for f in fields if f not in columns]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return ', '.join(fields)
+
+def api_clean_payload(conn, table, item, creating):
+    """Check an item's keys against the table and return the writable values"""
+    if not isinstance(item, dict):
+        raise ValueError('Each item must be a JSON object')
+    columns = api_columns(conn, table)
+    values = {k: v for k, v in item.items() if k != 'id'}
+    unknown = [k for k in values if k not in columns or k in API_READ_ONLY_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown or read-only field(s): {', '.join(unknown)}")
+    if creating:
+        missing = [c for c, required in columns.items() if required and values.get(c) in (None, '')]
+        if missing:
+            raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    return values
+
+def api_sync_item(conn, table, item_id, row):
+    """Keep derived link tables in step after an API write, as the HTML routes do"""
+    if table == 'tools':
+        link_tool_to_consumables(conn, item_id, row.get('name'), row.get('model'))
+        # Usage hours may have changed
+        refresh_tool_schedules(conn, item_id)
+    elif table == 'consumables':
+        link_consumable_to_tools(conn, item_id, row.get('compatible_with'))
+    if table in LOCATION_TABLES:
+        set_item_location(conn, table, item_id, row.get('location'))
+    if table == 'fasteners':
+        set_fastener_specs(conn, item_id, row.get('size'), row.get('length'), row.get('thread_type'))
+
+def api_items_from_body():
+    """The item list from a JSON body: either one object, a list, or {"items": [...]}"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('items'), list):
+        data = data['items']
+    items = data if isinstance(data, list) else [data] if isinstance(data, dict) else None
+    if not items:
+        raise ValueError('Expected a JSON object or a list of objects')
+    if len(items) > API_MAX_BULK:
+        raise ValueError(f'At most {API_MAX_BULK} items per request')
+    return items
+
+@app.route('/api/v1/<resource>', methods=['GET'])
+def api_list(resource):
+    """
+    List a resource with keyset pagination. Supports ?fields=a,b, equality
+    filters on any column (?category=Drills), ?q= text search, ?limit= and
+    ?cursor= (the next_cursor of the previous page).
+    """
+    spec = API_RESOURCES.get(resource)
+    if not spec:
+        return api_error('Unknown resource', 404)
+
+    conn = get_db()
+    table = spec['table']
+    columns = api_readable_columns(conn, table)
+    try:
+        select = api_select_list(conn, table)
+    except ValueError as e:
+        conn.close()
+        return api_error(str(e))
+
+    query = f'SELECT {select} FROM {table} WHERE 1=1'
+    params = []
+    for column, value in request.args.items():
+        if column in columns:
+            query += f' AND {column} = ?'
+            params.append(value)
+    search = request.args.get('q')
+    if search:
+        query += ' AND (' + ' OR '.join(f'{c} LIKE ?' for c in spec['search']) + ')'
+        params.extend([f'%{search}%'] * len(spec['search']))
+    cursor = request.args.get('cursor', type=int)
+    if cursor:
+        query += ' AND id > ?'
+        params.append(cursor)
+    limit = max(1, min(request.args.get('limit', API_DEFAULT_LIMIT, type=int), API_MAX_LIMIT))
+    query += ' ORDER BY id LIMIT ?'
+    params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = str(items[-1]['id']) if len(rows) > limit else None
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route('/api/v1/<resource>/<int:item_id>', methods=['GET'])
+def api_get(resource, item_id):
+    """Fetch one item; supports ?fields="""
+    spec = API_RESOURCES.get(resource)
+    if not spec:
+        return api_error('Unknown resource', 404)
+
+    conn = get_db()
+    try:
+        select = api_select_list(conn, spec['table'])
+    except ValueError as e:
+        conn.close()
+        return api_error(str(e))
+    row = conn.execute(f"SELECT {select} FROM {spec['table']} WHERE id = ?", (item_id,)).fetchone()
+    conn.close()
+
+    if not row:
+        return api_error('Not found', 404)
+    return jsonify(dict(row))
+
+@app.route('/api/v1/<resource>', methods=['POST'])
+def api_create(resource):
+    """Create one item or a list of items in a single transaction"""
+    spec = API_RESOURCES.get(resource)
+    if not spec:
+        return api_error('Unknown resource', 404)
+    table = spec['table']
+
+    conn = get_db()
+    created = []
+    try:
+        for item in api_items_from_body():
+            values = api_clean_payload(conn, table, item, creating=True)
+            columns = list(values)
+            cur = conn.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [values[c] for c in columns]
+            )
+            api_sync_item(conn, table, cur.lastrowid, values)
+            created.append((cur.lastrowid, conn.execute(f'SELECT * FROM {table} WHERE id = ?', (cur.lastrowid,)).fetchone()))
+        conn.commit()
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.rollback()
+        conn.close()
+        return api_error(f'Item {len(created)}: {e}')
+    conn.close()
+
+    if table in AUTOCOMPLETE_COLUMNS:
+        for _, row in created:
+            autocomplete_index.apply(table, new=row)
+    return jsonify({'success': True, 'ids': [item_id for item_id, _ in created]}), 201
+
+def api_update_items(resource, items):
+    """Apply partial updates ({"id": ..., field: value}) in one transaction"""
+    spec = API_RESOURCES.get(resource)
+    if not spec:
+        return api_error('Unknown resource', 404)
+    table = spec['table']
+
+    conn = get_db()
+    updated = []
+    try:
+        for item in items:
+            item_id = item.get('id') if isinstance(item, dict) else None
+            old = conn.execute(f'SELECT * FROM {table} WHERE id = ?', (item_id,)).fetchone()
+            if not old:
+                raise ValueError(f'No {resource} item with id {item_id}')
+            values = api_clean_payload(conn, table, item, creating=False)
+            if values:
+                conn.execute(
+                    f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in values)} WHERE id = ?",
+                    [*values.values(), item_id]
+                )
+                api_sync_item(conn, table, item_id, {**dict(old), **values})
+            updated.append((old, conn.execute(f'SELECT * FROM {table} WHERE id = ?', (item_id,)).fetchone()))
+        conn.commit()
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.rollback()
+        conn.close()
+        return api_error(f'Item {len(updated)}: {e}')
+    conn.close()
+
+    if table in AUTOCOMPLETE_COLUMNS:
+        for old, new in updated:
+            autocomplete_index.apply(table, old=old, new=new)
+    return jsonify({'success': True, 'updated': len(updated)})
+
+@app.route('/api/v1/<resource>', methods=['PATCH'])
+def api_bulk_update(resource):
+    """Update a list of items, each carrying its id"""
+    try:
+        items = api_items_from_body()
+    except ValueError as e:
+        return api_error(str(e))
+    return api_update_items(resource, items)
+
+@app.route('/api/v1/<resource>/<int:item_id>', methods=['PATCH', 'PUT'])
+def api_update(resource, item_id):
+    """Update one item"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error('Expected a JSON object')
+    return api_update_items(resource, [{**data, 'id': item_id}])
+
+def api_delete_ids(resource, item_ids):
+    """Delete items by id in one statement"""
+    spec = API_RESOURCES.get(resource)
+    if not spec:
+        return api_error('Unknown resource', 404)
+    table = spec['table']
+    try:
+        item_ids = [int(item_id) for item_id in item_ids]
+    except (TypeError, ValueError):
+        return api_error('ids must be integers')
+    if not item_ids or len(item_ids) > API_MAX_BULK:
+        return api_error(f'Give between 1 and {API_MAX_BULK} ids')
+
+    placeholders = ', '.join('?' * len(item_ids))
+    conn = get_db()
+    old_rows = conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', item_ids).fetchall()
+    conn.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', item_ids)
+    conn.commit()
+    conn.close()
+
+    for old in old_rows:
+        if table in AUTOCOMPLETE_COLUMNS:
+            autocomplete_index.apply(table, old=old)
+        if table == 'tools':
+            battery_index.set_tool_platforms(old['id'], [])
+    return jsonify({'success': True, 'deleted': len(old_rows)})
+
+@app.route('/api/v1/<resource>', methods=['DELETE'])
+def api_bulk_delete(resource):
+    """Delete the items listed as {"ids": [...]}"""
+    data = request.get_json(silent=True) or {}
+    return api_delete_ids(resource, data.get('ids') if isinstance(data, dict) else None)
+
+@app.route('/api/v1/<resource>/<int:item_id>', methods=['DELETE'])
+def api_delete(resource, item_id):
+    """Delete one item"""
+    response = api_delete_ids(resource, [item_id])
+    if isinstance(response, tuple) or response.get_json()['deleted']:
+        return response
+    return api_error('Not found', 404)
+
+@app.after_request
+def compress_api_response(response):
+    """Brotli (when installed) or gzip for JSON API responses the client accepts"""
+    if (not request.path.startswith('/api/') or response.direct_passthrough
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < API_COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Static Assets
+
+# Source directories under static/ that are minified and fingerprinted
+ASSET_SOURCE_DIRS = ['css', 'js']
+ASSET_DIST_DIR = 'dist'
+ASSET_MANIFEST = os.path.join(ASSET_DIST_DIR, 'manifest.json')
+# Fingerprinted files never change, so browsers may keep them for a year
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Uploads get a new name whenever their content changes
+UPLOAD_MAX_AGE = 24 * 60 * 60
+
+_asset_manifest = None
+_asset_lock = threading.Lock()
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+def build_static_assets():
+    """
+    Minify and fingerprint every file in ASSET_SOURCE_DIRS into static/dist,
+    with .gz (and .br when brotli is installed) siblings, and write the
+    manifest mapping source names to hashed names. Files whose mtime
+    matches the previous manifest aren't even read, so this is cheap to run
+    on every startup.
+    """
+    global _asset_manifest
+    static_folder = app.static_folder
+    manifest = {}
+    try:
+        with open(os.path.join(static_folder, ASSET_MANIFEST)) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    for source_dir in ASSET_SOURCE_DIRS:
+        root = os.path.join(static_folder, source_dir)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+                entry = previous.get(name)
+                if (entry and entry['mtime'] == os.path.getmtime(source)
+                        and os.path.exists(os.path.join(static_folder, entry['path']))):
+                    manifest[name] = entry
+                    continue
+                with open(source, 'rb') as f:
+                    data = f.read()
+                if filename.endswith('.css'):
+                    data = minify_css(data.decode('utf-8')).encode('utf-8')
+
+                stem, ext = os.path.splitext(name)
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                hashed = f'{ASSET_DIST_DIR}/{stem}.{digest}{ext}'
+                target = os.path.join(static_folder, hashed)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, 'wb') as f:
+                        f.write(data)
+                    with open(target + '.gz', 'wb') as f:
+                        f.write(gzip.compress(data, compresslevel=9))
+                    if brotli:
+                        with open(target + '.br', 'wb') as f:
+                            f.write(brotli.compress(data, quality=11))
+                manifest[name] = {'path': hashed, 'mtime': os.path.getmtime(source)}
+
+    if manifest != previous:
+        os.makedirs(os.path.join(static_folder, ASSET_DIST_DIR), exist_ok=True)
+        with open(os.path.join(static_folder, ASSET_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    _asset_manifest = manifest
+    return manifest
+
+def asset_path(filename):
+    """Hashed name for a static file, or the name itself if it isn't built"""
+    global _asset_manifest
+    if _asset_manifest is None:
+        with _asset_lock:
+            if _asset_manifest is None:
+                try:
+                    with open(os.path.join(app.static_folder, ASSET_MANIFEST)) as f:
+                        _asset_manifest = json.load(f)
+                except (OSError, ValueError):
+                    _asset_manifest = {}
+
+    entry = _asset_manifest.get(filename)
+    if entry and app.debug:
+        # Pick up stylesheet edits while developing
+        source = os.path.join(app.static_folder, filename)
+        if os.path.exists(source) and os.path.getmtime(source) != entry['mtime']:
+            with _asset_lock:
+                entry = build_static_assets().get(filename)
+    return entry['path'] if entry else filename
+
+def asset_url_for(endpoint, **values):
+    """url_for for templates, resolving static files to their fingerprinted names"""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = asset_path(values['filename'])
+    return url_for(endpoint, **values)
+
+app.jinja_env.globals['url_for'] = asset_url_for
+
+def serve_static(filename):
+    """
+    Static files. Fingerprinted assets are sent with an immutable
+    Cache-Control, as their precompressed .br/.gz sibling when the client
+    accepts it; everything else falls back to Flask's default handling.
+    Uploads are read from the current workspace's folder.
+    """
+    if filename.startswith('uploads/') and current_workspace() != DEFAULT_WORKSPACE:
+        return send_from_directory(os.path.abspath(workspace_root()), filename, max_age=UPLOAD_MAX_AGE)
+    if not filename.startswith(ASSET_DIST_DIR + '/') or filename.endswith(('.gz', '.br')):
+        max_age = UPLOAD_MAX_AGE if filename.startswith('uploads/') else None
+        return send_from_directory(app.static_folder, filename, max_age=max_age)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+            response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    return response
+
+app.view_functions['static'] = serve_static
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress static assets"""
+    manifest = build_static_assets()
+    for name, entry in manifest.items():
+        print(f"{name} -> {entry['path']}")
+
+# Uploads
+
+# Minutes an unreferenced upload is kept before the GC may delete it
+UPLOAD_GC_GRACE_MINUTES = 60
+# Files removed per GC pass, and seconds between background passes
+UPLOAD_GC_BATCH = 100
+UPLOAD_GC_INTERVAL = 10 * 60
+
+# Serializes writing a file with the GC removing one of the same name
+_upload_lock = threading.Lock()
+
+def upload_file_path(path):
+    """Filesystem path for an image_path such as 'uploads/ab12.jpg' in the current workspace"""
+    return os.path.join(workspace_root(), path)
+
+def save_upload(conn, file):
+    """
+    Store an uploaded image under its content hash and register it in the
+    images table; returns its image_path, or None if nothing was uploaded.
+    The same photo uploaded twice is stored once. Reference counts are
+    kept by triggers once a row points at the path.
+
+    Call it before the request's other writes: the row is committed (with
+    a fresh grace period if it was an orphan) before the file is checked,
+    so the GC either sees the row or has already removed the file, which
+    is then written again. A request that rolls back leaves an orphan the
+    GC reclaims.
+    """
+    if not file or not file.filename or not allowed_file(file.filename):
+        return None
+
+    data = file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    existing = conn.execute('SELECT path FROM images WHERE hash = ?', (digest,)).fetchone()
+    path = existing['path'] if existing else f"uploads/{digest[:32]}.{file.filename.rsplit('.', 1)[1].lower()}"
+
+    conn.execute('''
+        INSERT INTO images (path, hash, size, orphaned_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (path) DO UPDATE SET orphaned_at = CURRENT_TIMESTAMP WHERE refcount <= 0
+    ''', (path, digest, len(data)))
+    if not existing:
+        set_image_hashes(conn, path, data)
+    conn.commit()
+
+    with _upload_lock:
+        if not os.path.exists(upload_file_path(path)):
+            with open(upload_file_path(path), 'wb') as f:
+                f.write(data)
+    return path
+
+def collect_orphaned_uploads(conn, batch=UPLOAD_GC_BATCH, grace_minutes=UPLOAD_GC_GRACE_MINUTES):
+    """
+    Delete up to `batch` uploads that nothing has referenced for the grace
+    period, oldest first, and add them to the reclaimed-space totals, then
+    up to `batch` files older than the grace period with no images row
+    (left by a crash or by uploads made before files were registered
+    first). Each row is deleted, or found missing, under the upload lock
+    before its file, and only if it is still an expired orphan, so a
+    concurrent upload of the same image is never lost (see save_upload).
+    """
+    grace = f'-{grace_minutes} minutes'
+    candidates = conn.execute('''
+        SELECT path, size FROM images
+        WHERE refcount <= 0 AND orphaned_at <= datetime('now', ?)
+        ORDER BY orphaned_at
+        LIMIT ?
+    ''', (grace, batch)).fetchall()
+
+    files = 0
+    reclaimed = 0
+    for image in candidates:
+        with _upload_lock:
+            deleted = conn.execute(
+                "DELETE FROM images WHERE path = ? AND refcount <= 0 AND orphaned_at <= datetime('now', ?)",
+                (image['path'], grace)
+            ).rowcount
+            conn.commit()
+            if not deleted:
+                continue
+            try:
+                os.remove(upload_file_path(image['path']))
+            except FileNotFoundError:
+                continue
+        files += 1
+        reclaimed += image['size'] or 0
+
+    folder = upload_folder()
+    cutoff = time.time() - grace_minutes * 60
+    strays = 0
+    for entry in (os.scandir(folder) if os.path.isdir(folder) else []):
+        if strays >= batch:
+            break
+        if entry.name.startswith('.') or not entry.is_file() or entry.stat().st_mtime > cutoff:
+            continue
+        path = f'uploads/{entry.name}'
+        with _upload_lock:
+            if conn.execute('SELECT 1 FROM images WHERE path = ?', (path,)).fetchone():
+                continue
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        strays += 1
+        reclaimed += size
+    files += strays
+
+    set_job_state(conn, 'upload_gc_files', int(get_job_state(conn, 'upload_gc_files', 0)) + files)
+    set_job_state(conn, 'upload_gc_bytes', int(get_job_state(conn, 'upload_gc_bytes', 0)) + reclaimed)
+    set_job_state(conn, 'upload_gc_at', datetime.now().isoformat(timespec='seconds'))
+    conn.commit()
+    return {'files': files, 'bytes': reclaimed}
+
+def upload_report(conn):
+    """Disk used by referenced and orphaned uploads, and what the GC has reclaimed"""
+    usage = conn.execute('''
+        SELECT SUM(refcount > 0) AS referenced_files,
+               COALESCE(SUM(CASE WHEN refcount > 0 THEN size END), 0) AS referenced_bytes,
+               SUM(refcount <= 0) AS orphaned_files,
+               COALESCE(SUM(CASE WHEN refcount <= 0 THEN size END), 0) AS orphaned_bytes
+        FROM images
+    ''').fetchone()
+    return {
+        'referenced': {'files': usage['referenced_files'] or 0, 'bytes': usage['referenced_bytes']},
+        'orphaned': {'files': usage['orphaned_files'] or 0, 'bytes': usage['orphaned_bytes']},
+        'reclaimed': {
+            'files': int(get_job_state(conn, 'upload_gc_files', 0)),
+            'bytes': int(get_job_state(conn, 'upload_gc_bytes', 0)),
+        },
+        'last_run': get_job_state(conn, 'upload_gc_at'),
+    }
+
+def start_upload_gc(interval=UPLOAD_GC_INTERVAL):
+    """
+    Run the upload GC in a daemon thread, one batch per workspace every
+    `interval` seconds, along with a batch of the image hash backfill, the
+    daily audit log prune, the stock forecasts, the overdue loan sweep,
+    the daily maintenance re-projection and, when the app is idle,
+    database maintenance
+    """
+    tasks = [
+        ('upload GC', collect_orphaned_uploads),
+        ('image hash backfill', lambda conn: backfill_image_hashes(conn, max_batches=1)),
+        ('audit log prune', prune_audit_log),
+        ('stock forecasts', update_forecasts),
+        ('overdue loan sweep', sweep_overdue_loans),
+        ('maintenance projections', refresh_usage_schedules),
+        ('database maintenance', lambda conn: maintenance_idle() and run_maintenance(conn)),
+    ]
+
+    def run_tasks(name):
+        with use_workspace(name):
+            conn = get_db()
+            try:
+                # One failing task (a locked file, a bad image) mustn't stop the others or the thread
+                for task, function in tasks:
+                    # Thread-local batches would otherwise run on for the life of the thread
+                    new_audit_batch(f'background {task}')
+                    try:
+                        function(conn)
+                    except Exception:
+                        app.logger.exception('Background %s failed for %s', task, name)
+                        if conn.in_transaction:
+                            conn.rollback()
+            finally:
+                conn.close()
+
+    def run():
+        while True:
+            try:
+                for name in list_workspaces():
+                    try:
+                        run_tasks(name)
+                    except Exception:
+                        app.logger.exception('Background jobs failed for %s', name)
+            except Exception:
+                app.logger.exception('Background jobs could not list workspaces')
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='upload-gc', daemon=True)
+    thread.start()
+    return thread
+
+@app.route('/api/uploads/report')
+def api_upload_report():
+    """Upload disk usage and GC totals as JSON"""
+    conn = get_db()
+    report = upload_report(conn)
+    conn.close()
+
+    return jsonify(report)
+
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Delete every upload that has been unreferenced for the grace period"""
+    new_audit_batch('flask gc-uploads')
+    conn = get_db()
+    total = {'files': 0, 'bytes': 0}
+    while True:
+        swept = collect_orphaned_uploads(conn)
+        total['files'] += swept['files']
+        total['bytes'] += swept['bytes']
+        if swept['files'] < UPLOAD_GC_BATCH:
+            break
+    report = upload_report(conn)
+    conn.close()
+    print(f"Removed {total['files']} files ({total['bytes'] / 1024:.1f} KB)")
+    print(json.dumps(report, indent=2))
+
+# Label Printer Output
+
+# Label size in printer dots (50 x 25 mm at 203 dpi) and the quiet zone
+LABEL_WIDTH_DOTS = 400
+LABEL_HEIGHT_DOTS = 200
+LABEL_MARGIN_DOTS = 12
+LABEL_FORMATS = {'zpl': 'zpl', 'escpos': 'bin'}
+
+@functools.lru_cache(maxsize=4096)
+def qr_matrix(data):
+    """QR modules for `data` as a tuple of rows of bools (border included)"""
+    import qrcode
+    # A fixed mask skips scoring all eight, which is most of the encode time
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=2, mask_pattern=0)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+@functools.lru_cache(maxsize=4096)
+def qr_raster(data, max_dots):
+    """
+    Packed 1-bit raster of a QR code scaled to fit `max_dots`, as
+    (bytes_per_row, height, data). Each module row is built as one big
+    integer and converted with a single to_bytes call, then repeated for
+    the scale factor, rather than setting pixels one at a time.
+    """
+    matrix = qr_matrix(data)
+    scale = max(1, max_dots // len(matrix))
+    width = len(matrix) * scale
+    bytes_per_row = (width + 7) // 8
+    pad = bytes_per_row * 8 - width
+    on, off = '1' * scale, '0' * scale
+
+    rows = []
+    for modules in matrix:
+        bits = ''.join(on if module else off for module in modules) + '0' * pad
+        rows.append(int(bits, 2).to_bytes(bytes_per_row, 'big'))
+    raster = b''.join(row * scale for row in rows)
+    return bytes_per_row, len(matrix) * scale, raster
+
+def label_lines(item):
+    """Text lines printed beside the QR code"""
+    lines = [item['name'] or '']
+    detail = ' '.join(part for part in (item.get('brand'), item.get('category')) if part)
+    if detail:
+        lines.append(detail)
+    if item.get('location'):
+        lines.append(item['location'])
+    lines.append(f"{item['type'].title()} #{item['id']}")
+    return lines
+
+def zpl_text(value):
+    """ZPL field data can't contain the ^ and ~ command prefixes"""
+    return str(value).replace('^', ' ').replace('~', ' ')
+
+def zpl_graphic_data(bytes_per_row, raster):
+    """
+    ZPL compressed-ASCII hex for a raster: ':' repeats the previous row and
+    ',' zero-fills the rest of a row, which shrinks scaled QR codes a lot
+    """
+    rows = []
+    previous = None
+    for start in range(0, len(raster), bytes_per_row):
+        row = raster[start:start + bytes_per_row]
+        if row == previous:
+            rows.append(':')
+            continue
+        previous = row
+        hex_row = row.hex().upper()
+        stripped = hex_row.rstrip('0')
+        rows.append(stripped + ',' if len(stripped) < len(hex_row) else hex_row)
+    return ''.join(rows)
+
+def render_zpl_label(item, base_url):
+    """One ZPL label: the QR code as a ^GFA graphic field plus text fields"""
+    qr_size = LABEL_HEIGHT_DOTS - 2 * LABEL_MARGIN_DOTS
+    bytes_per_row, height, raster = qr_raster(f"{base_url}scan/{item['type']}/{item['id']}", qr_size)
+    text_x = LABEL_MARGIN_DOTS * 2 + qr_size
+    text_width = LABEL_WIDTH_DOTS - text_x - LABEL_MARGIN_DOTS
+
+    lines = label_lines(item)
+    fields = [f'^FO{text_x},{LABEL_MARGIN_DOTS}^A0N,30,30^FB{text_width},2,0,L^FD{zpl_text(lines[0])}^FS']
+    y = LABEL_MARGIN_DOTS + 70
+    for line in lines[1:]:
+        fields.append(f'^FO{text_x},{y}^A0N,20,20^FB{text_width},1,0,L^FD{zpl_text(line)}^FS')
+        y += 28
+
+    return (
+        f'^XA^CI28^PW{LABEL_WIDTH_DOTS}^LL{LABEL_HEIGHT_DOTS}'
+        f'^FO{LABEL_MARGIN_DOTS},{LABEL_MARGIN_DOTS}'
+        f'^GFA,{len(raster)},{len(raster)},{bytes_per_row},{zpl_graphic_data(bytes_per_row, raster)}^FS'
+        + ''.join(fields) + '^XZ\n'
+    ).encode('utf-8')
+
+def render_escpos_label(item, base_url, cut=True):
+    """One ESC/POS label: the QR code as a GS v 0 raster image, then text"""
+    qr_size = LABEL_HEIGHT_DOTS - 2 * LABEL_MARGIN_DOTS
+    bytes_per_row, height, raster = qr_raster(f"{base_url}scan/{item['type']}/{item['id']}", qr_size)
+    lines = label_lines(item)
+
+    out = bytearray()
+    out += b'\x1ba\x01'  # centre
+    out += b'\x1dv0\x00' + bytes_per_row.to_bytes(2, 'little') + height.to_bytes(2, 'little') + raster
+    out += b'\n\x1bE\x01' + lines[0].encode('cp437', 'replace') + b'\x1bE\x00\n'
+    for line in lines[1:]:
+        out += line.encode('cp437', 'replace') + b'\n'
+    out += b'\x1bd\x03'  # feed 3 lines
+    if cut:
+        out += b'\x1dV\x01'  # partial cut
+    return bytes(out)
+
+def render_labels(items, fmt, base_url):
+    """Yield a print job for `items` one label at a time"""
+    if fmt == 'escpos':
+        yield b'\x1b@'  # initialise
+        for item in items:
+            yield render_escpos_label(item, base_url)
+    else:
+        for item in items:
+            yield render_zpl_label(item, base_url)
+
+def send_to_printer(chunks, host, port=9100, timeout=10):
+    """Stream a print job to a raw TCP printer port; returns bytes sent"""
+    sent = 0
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        for chunk in chunks:
+            sock.sendall(chunk)
+            sent += len(chunk)
+    return sent
+
+@app.route('/labels/print', methods=['GET', 'POST'])
+def print_labels():
+    """
+    Labels as a ZPL or ESC/POS job (?format=zpl|escpos) for the items
+    selected like /labels. Downloads the job, or with send=1 streams it
+    to the configured LABEL_PRINTER_HOST.
+    """
+    args = request.values
+    fmt = args.get('format', 'zpl')
+    if fmt not in LABEL_FORMATS:
+        return jsonify({'success': False, 'error': 'Unknown label format'}), 400
+
+    conn = get_db()
+    items = label_items(conn, args)
+    conn.close()
+    if not items:
+        return jsonify({'success': False, 'error': 'No items selected'}), 400
+
+    base_url = request.url_root
+    if args.get('send'):
+        host = app.config['LABEL_PRINTER_HOST']
+        if not host:
+            return jsonify({'success': False, 'error': 'No label printer configured'}), 400
+        try:
+            sent = send_to_printer(render_labels(items, fmt, base_url), host, app.config['LABEL_PRINTER_PORT'])
+        except OSError as e:
+            return jsonify({'success': False, 'error': f'Printer unreachable: {e}'}), 502
+        return jsonify({'success': True, 'labels': len(items), 'bytes': sent})
+
+    response = app.response_class(render_labels(items, fmt, base_url), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename=labels.{LABEL_FORMATS[fmt]}'
+    return response
+
+@app.cli.command('print-labels')
+@click.argument('items', nargs=-1, required=True)
+@click.option('--format', 'fmt', type=click.Choice(list(LABEL_FORMATS)), default='zpl')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the job to this file')
+@click.option('--printer', help='Printer host to stream the job to (port 9100)')
+@click.option('--base-url', default='http://localhost:5000/', help='URL prefix encoded in QR codes')
+def print_labels_command(items, fmt, output, printer, base_url):
+    """Render labels for ITEMS such as tool:3 or location:12"""
+    selected = MultiDict()
+    for spec in items:
+        item_type, _, item_id = spec.partition(':')
+        if item_type not in LABEL_SOURCES or not item_id.isdigit():
+            raise click.BadParameter(f'{spec} (expected type:id)')
+        selected.add(LABEL_SOURCES[item_type][0], item_id)
+
+    conn = get_db()
+    label_data = label_items(conn, selected)
+    conn.close()
+
+    chunks = render_labels(label_data, fmt, base_url)
+    if printer:
+        host, _, port = printer.partition(':')
+        sent = send_to_printer(chunks, host, int(port or 9100))
+    else:
+        sent = 0
+        with open(output or f'labels.{LABEL_FORMATS[fmt]}', 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                sent += len(chunk)
+    print(f'{len(label_data)} labels, {sent} bytes')
+
+# Bulk Actions
+
+# Per item type: table, shopping-list name and unit SQL (over alias i)
+BULK_TABLES = {
+    'tool': {'table': 'tools', 'name': 'i.name', 'unit': "'pcs'"},
+    'consumable': {'table': 'consumables', 'name': 'i.name', 'unit': "COALESCE(i.unit, 'pcs')"},
+    'material': {'table': 'materials', 'name': 'i.name', 'unit': "COALESCE(i.unit, 'pcs')"},
+    'fastener': {'table': 'fasteners', 'name': "i.category || ' ' || i.size || COALESCE(' x ' || i.length, '')",
+                 'unit': "'pcs'"},
+}
+
+def bulk_apply(conn, item_type, action, ids, value=None):
+    """
+    Run one bulk action over `ids` as a single set-based statement.
+    Returns (rows affected, old rows for index updates). The caller commits.
+    """
+    spec = BULK_TABLES[item_type]
+    table = spec['table']
+    placeholders = ', '.join('?' * len(ids))
+    old_rows = []
+    if action in ('location', 'category', 'delete'):
+        old_rows = conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', ids).fetchall()
+
+    if action == 'location':
+        cur = conn.execute(
+            f'UPDATE {table} SET location = ?, location_id = ? WHERE id IN ({placeholders})',
+            [value or None, ensure_location(conn, value), *ids]
+        )
+    elif action == 'category':
+        if not value:
+            raise ValueError('Category is required')
+        cur = conn.execute(f'UPDATE {table} SET category = ? WHERE id IN ({placeholders})', [value, *ids])
+    elif action == 'adjust_quantity':
+        if item_type not in STOCKED_TABLES:
+            raise ValueError(f'{table.title()} have no quantity')
+        try:
+            delta = float(value)
+        except (TypeError, ValueError):
+            raise ValueError('Quantity change must be a number')
+        cur = conn.execute(
+            f'UPDATE {table} SET quantity = MAX(0, COALESCE(quantity, 0) + ?) WHERE id IN ({placeholders})',
+            [delta, *ids]
+        )
+    elif action == 'favorite':
+        cur = conn.execute(f'''
+            INSERT OR IGNORE INTO favorites (item_type, item_id)
+            SELECT ?, id FROM {table} WHERE id IN ({placeholders})
+        ''', [item_type, *ids])
+    elif action == 'shopping_list':
+        try:
+            quantity = float(value) if value not in (None, '') else None
+        except ValueError:
+            raise ValueError('Quantity must be a number')
+        # Without a quantity, top stocked items back up to their minimum
+        quantity_sql = '?' if quantity is not None else (
+            f"CASE WHEN i.base_min_quantity > i.base_quantity "
+            f"THEN (i.base_min_quantity - i.base_quantity) / {unit_factor_sql(spec['unit'])} ELSE 1 END"
+            if item_type in STOCKED_TABLES else '1'
+        )
+        cur = conn.execute(f'''
+            INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit, store, notes)
+            SELECT {spec['name']}, ?, i.id, {quantity_sql}, {spec['unit']}, 'Bunnings', 'Bulk added'
+            FROM {table} i
+            WHERE i.id IN ({placeholders})
+              AND NOT EXISTS (
+                  SELECT 1 FROM shopping_list s
+                  WHERE s.item_type = ? AND s.item_id = i.id AND s.purchased = 0
+              )
+        ''', [item_type, *([quantity] if quantity is not None else []), *ids, item_type])
+    elif action == 'delete':
+        cur = conn.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', ids)
+    else:
+        raise ValueError('Unknown action')
+
+    return cur.rowcount, old_rows
+
+@app.route('/api/bulk/<item_type>', methods=['POST'])
+def api_bulk_action(item_type):
+    """
+    Apply one action to many items in a single transaction. Body:
+    {"action": "location|category|adjust_quantity|favorite|shopping_list|delete",
+     "ids": [...], "value": ...}
+    """
+    if item_type not in BULK_TABLES:
+        return jsonify({'success': False, 'error': 'Unknown item type'}), 404
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    value = data.get('value')
+    value = str(value).strip() if value is not None else None
+    try:
+        ids = sorted({int(item_id) for item_id in data.get('ids') or []})
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'ids must be integers'}), 400
+    if not ids or len(ids) > API_MAX_BULK:
+        return jsonify({'success': False, 'error': f'Select between 1 and {API_MAX_BULK} items'}), 400
+
+    table = BULK_TABLES[item_type]['table']
+    conn = get_db()
+    try:
+        affected, old_rows = bulk_apply(conn, item_type, action, ids, value)
+        new_rows = {}
+        if action in ('location', 'category'):
+            placeholders = ', '.join('?' * len(ids))
+            new_rows = {row['id']: row for row in
+                        conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', ids)}
+        conn.commit()
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    conn.close()
+
+    for old in old_rows:
+        autocomplete_index.apply(table, old=old, new=new_rows.get(old['id']))
+        if action == 'delete' and item_type == 'tool':
+            battery_index.set_tool_platforms(old['id'], [])
+
+    return jsonify({'success': True, 'affected': affected})
+
+# Fastener Specs
+
+# ISO metric coarse thread pitch (mm) by nominal diameter
+METRIC_COARSE_PITCH = {
+    1.6: 0.35, 2: 0.4, 2.5: 0.45, 3: 0.5, 3.5: 0.6, 4: 0.7, 5: 0.8, 6: 1.0, 8: 1.25,
+    10: 1.5, 12: 1.75, 14: 2.0, 16: 2.0, 18: 2.5, 20: 2.5, 22: 2.5, 24: 3.0, 30: 3.5,
+}
+MM_PER_INCH = 25.4
+# Thread type numbers up to this are a pitch rather than a length
+MAX_METRIC_PITCH = 4.0
+FASTENER_SPEC_BATCH = 500
+
+_NUMBER = r'(\d+(?:\.\d+)?)'
+_INCHES = r'(\d+(?:[ -]\d+/\d+)?|\d+/\d+|\d*\.\d+)'
+
+def parse_inches(text):
+    """'1/4' -> 0.25, '1-1/2' or '1 1/2' -> 1.5, '.75' -> 0.75"""
+    value = 0.0
+    for part in text.strip().replace('-', ' ').split():
+        if '/' in part:
+            numerator, denominator = part.split('/')
+            value += float(numerator) / float(denominator)
+        else:
+            value += float(part)
+    return value
+
+def gauge_to_mm(gauge):
+    """Screw gauge (8g, #10) to major diameter: 0.060" + 0.013" per gauge number"""
+    return round((0.060 + 0.013 * gauge) * MM_PER_INCH, 2)
+
+def is_metric_pitch(diameter, value):
+    """
+    Whether the B in 'MAxB' is a pitch: no coarser than the standard pitch
+    for that diameter, and not a whole number from 3 up ('M3x4' is 4 mm long)
+    """
+    if value.is_integer() and value >= 3:
+        return False
+    return value <= METRIC_COARSE_PITCH.get(diameter, diameter / 4)
+
+def parse_fastener_length(text):
+    """Length text such as '20', '20mm', '1-1/2\"' or '2 in' in millimetres"""
+    text = '' if text is None else str(text).strip().lower()
+    if not text:
+        return None
+    match = re.fullmatch(_NUMBER + r'\s*mm', text)
+    if match:
+        return float(match.group(1))
+    match = re.fullmatch(_INCHES + r'\s*(?:"|in|inch|inches|”)', text)
+    if match:
+        return round(parse_inches(match.group(1)) * MM_PER_INCH, 2)
+    match = re.fullmatch(_NUMBER + r'\s*cm', text)
+    if match:
+        return float(match.group(1)) * 10
+    match = re.fullmatch(_NUMBER, text)
+    if match:
+        return float(match.group(1))
+    return None
+
+def parse_fastener_spec(size, length=None, thread_type=None):
+    """
+    Normalize free-text fastener specs into (diameter_mm, length_mm, pitch_mm).
+    Understands metric ('M6', 'M6x1.0', 'M6 x 20', 'M6x1.0x20'), gauge ('8g', '#10'),
+    imperial ('1/4"', '1/4-20', '5/16 UNC', '1 in') and plain millimetre
+    sizes ('6', '6mm'). A size is only read as inches with a fraction, an
+    inch mark or an inch thread series, so a bare number is millimetres.
+    Parts that can't be parsed come back as None.
+    """
+    size = '' if size is None else str(size).strip().lower().replace('×', 'x')
+    thread = (thread_type or '').strip().lower()
+    diameter = pitch = None
+    length_mm = parse_fastener_length(length)
+    tpi = None
+
+    metric = re.fullmatch(r'm\s*' + _NUMBER + r'(?:\s*x\s*' + _NUMBER + r')?(?:\s*x\s*' + _NUMBER + r')?(?:\s*mm)?',
+                          size)
+    gauge = re.fullmatch(r'(?:#\s*(\d+)|(\d+)\s*g(?:auge)?)(?:\s*-\s*(\d+))?', size)
+    imperial = re.fullmatch(_INCHES + r'\s*("|in|inch|”)?\s*(?:-\s*(\d+))?\s*(unc|unf|bsw|bsf)?', size)
+    if imperial and not ('/' in imperial.group(1) or imperial.group(2) or imperial.group(4)):
+        imperial = None
+    plain = re.fullmatch(_NUMBER + r'\s*(?:mm)?', size)
+
+    if metric:
+        diameter = float(metric.group(1))
+        if metric.group(3):
+            if is_metric_pitch(diameter, float(metric.group(2))):
+                pitch = float(metric.group(2))
+            if length_mm is None:
+                length_mm = float(metric.group(3))
+        elif metric.group(2):
+            second = float(metric.group(2))
+            if is_metric_pitch(diameter, second):
+                pitch = second
+            elif length_mm is None:
+                length_mm = second
+    elif gauge:
+        diameter = gauge_to_mm(int(gauge.group(1) or gauge.group(2)))
+        tpi = int(gauge.group(3)) if gauge.group(3) else None
+    elif imperial:
+        diameter = round(parse_inches(imperial.group(1)) * MM_PER_INCH, 2)
+        tpi = int(imperial.group(3)) if imperial.group(3) else None
+    elif plain:
+        diameter = float(plain.group(1))
+
+    # Thread type may carry the pitch ('1.25', '1.25mm', '20 TPI') or just 'fine'
+    if pitch is None and tpi is None and thread:
+        match = re.fullmatch(_NUMBER + r'\s*tpi', thread)
+        if match:
+            tpi = float(match.group(1))
+        else:
+            match = re.fullmatch(r'(?:m\s*' + _NUMBER + r'\s*x\s*)?' + _NUMBER + r'\s*(?:mm)?(?:\s*pitch)?', thread)
+            if match and float(match.group(2)) <= MAX_METRIC_PITCH:
+                pitch = float(match.group(2))
+    if tpi:
+        pitch = round(MM_PER_INCH / tpi, 3)
+    if pitch is None and metric and 'fine' not in thread:
+        pitch = METRIC_COARSE_PITCH.get(diameter)
+
+    return diameter, length_mm, pitch
+
+def set_fastener_specs(conn, fastener_id, size, length=None, thread_type=None):
+    """Store the parsed numeric specs for one fastener"""
+    conn.execute(
+        'UPDATE fasteners SET diameter_mm = ?, length_mm = ?, pitch_mm = ? WHERE id = ?',
+        (*parse_fastener_spec(size, length, thread_type), fastener_id)
+    )
+
+def backfill_fastener_specs(conn, batch_size=FASTENER_SPEC_BATCH):
+    """Re-parse every fastener's specs, committing one id-ordered batch at a time"""
+    last_id = 0
+    updated = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, size, length, thread_type FROM fasteners
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return updated
+        conn.executemany(
+            'UPDATE fasteners SET diameter_mm = ?, length_mm = ?, pitch_mm = ? WHERE id = ?',
+            [(*parse_fastener_spec(row['size'], row['length'], row['thread_type']), row['id']) for row in rows]
+        )
+        conn.commit()
+        updated += len(rows)
+        last_id = rows[-1]['id']
+
+def nearest_fasteners(conn, diameter, length=None, category=None, in_stock=True, limit=5):
+    """
+    Closest fasteners to a diameter (and length): the exact diameter first,
+    then the next size up and down among the fasteners passing the
+    category and in-stock filters. Each candidate diameter is an index
+    probe plus two bounded range scans either side of the length on
+    idx_fasteners_spec, so cost doesn't grow with the table.
+    """
+    filters = ''
+    params = []
+    if category:
+        filters += ' AND category = ?'
+        params.append(category)
+    if in_stock:
+        filters += ' AND quantity > 0'
+
+    diameters = [diameter]
+    above = conn.execute(f'SELECT MIN(diameter_mm) FROM fasteners WHERE diameter_mm > ? {filters}',
+                         (diameter, *params)).fetchone()[0]
+    below = conn.execute(f'SELECT MAX(diameter_mm) FROM fasteners WHERE diameter_mm < ? {filters}',
+                         (diameter, *params)).fetchone()[0]
+    diameters += [d for d in (above, below) if d is not None]
+
+    candidates = {}
+    for d in diameters:
+        if length is None:
+            rows = conn.execute(f'''
+                SELECT * FROM fasteners WHERE diameter_mm = ? {filters}
+                ORDER BY length_mm LIMIT ?
+            ''', (d, *params, limit)).fetchall()
+        else:
+            rows = conn.execute(f'''
+                SELECT * FROM fasteners WHERE diameter_mm = ? AND length_mm >= ? {filters}
+                ORDER BY length_mm LIMIT ?
+            ''', (d, length, *params, limit)).fetchall()
+            rows += conn.execute(f'''
+                SELECT * FROM fasteners WHERE diameter_mm = ? AND length_mm < ? {filters}
+                ORDER BY length_mm DESC LIMIT ?
+            ''', (d, length, *params, limit)).fetchall()
+        for row in rows:
+            candidates[row['id']] = row
+
+    def distance(row):
+        length_gap = abs((row['length_mm'] or 0) - length) if length is not None else 0
+        # A different diameter is a worse substitute than any length difference
+        return (abs(row['diameter_mm'] - diameter), length_gap)
+
+    return sorted(candidates.values(), key=distance)[:limit]
+
+@app.route('/api/fasteners/nearest')
+def api_nearest_fasteners():
+    """
+    Closest in-stock fasteners to ?size=M5 (or ?diameter=5) and optional
+    ?length=25, ?category= and ?in_stock=0
+    """
+    diameter = request.args.get('diameter', type=float)
+    length = request.args.get('length')
+    if diameter is None:
+        diameter, size_length, _ = parse_fastener_spec(request.args.get('size'))
+        length = length or size_length
+    if diameter is None:
+        return jsonify({'success': False, 'error': 'Give a size or diameter'}), 400
+    length_mm = parse_fastener_length(str(length)) if length is not None else None
+
+    conn = get_db()
+    rows = nearest_fasteners(conn, diameter, length_mm, category=request.args.get('category') or None,
+                             in_stock=request.args.get('in_stock', '1') != '0',
+                             limit=min(request.args.get('limit', 5, type=int), 50))
+    conn.close()
+
+    return jsonify([dict(row) for row in rows])
+
+@app.cli.command('backfill-fastener-specs')
+def backfill_fastener_specs_command():
+    """Re-parse numeric diameter/length/pitch for every fastener"""
+    new_audit_batch('flask backfill-fastener-specs')
+    conn = get_db()
+    updated = backfill_fastener_specs(conn)
+    conn.close()
+    print(f'Parsed specs for {updated} fasteners')
+
+# Product Catalogue Routes
+
+# Inventory tables a catalogue product can be added as
+CATALOGUE_ITEM_TABLES = {'tool': 'tools', **STOCKED_TABLES}
+
+# Column aliases accepted for the barcode in catalogue imports
+GTIN_ALIASES = ('gtin', 'gtin13', 'gtin12', 'gtin8', 'gtin14', 'ean', 'upc', 'barcode')
+
+def expand_upc_e(code):
+    """Expand an 8-digit UPC-E barcode to its 12-digit UPC-A form"""
+    system, digits, check = code[0], code[1:7], code[7]
+    last = digits[5]
+    if last in '012':
+        body = digits[:2] + last + '0000' + digits[2:5]
+    elif last == '3':
+        body = digits[:3] + '00000' + digits[3:5]
+    elif last == '4':
+        body = digits[:4] + '00000' + digits[4]
+    else:
+        body = digits[:5] + '0000' + last
+    return system + body + check
+
+def normalize_gtin(code):
+    """Validate an EAN-8, UPC-A, EAN-13 or GTIN-14 barcode and return it padded to 14 digits, or None"""
+    digits = re.sub(r'[\s-]', '', str(code or ''))
+    if not digits.isdigit() or len(digits) not in (8, 12, 13, 14):
+        return None
+    digits = digits.zfill(14)
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(digits[:13]))
+    if (10 - total % 10) % 10 != int(digits[13]):
+        return None
+    return digits
+
+def catalogue_number(value):
+    """Parse a price or pack quantity from an import or scrape, or None"""
+    try:
+        return float(str(value).replace('$', '').replace(',', '').strip())
+    except (TypeError, ValueError):
+        return None
+
+def upsert_catalogue(conn, products, source=None):
+    """
+    Insert or refresh catalogue products in one statement batch and return
+    how many were stored. Products without a valid GTIN or a name are
+    skipped; blank fields keep the stored value and the linked inventory
+    item is never changed.
+    """
+    rows = []
+    for product in products:
+        gtin = normalize_gtin(next((product.get(key) for key in GTIN_ALIASES if product.get(key)), None))
+        name = (product.get('name') or '').strip()
+        if not gtin or not name:
+            continue
+        rows.append({
+            'gtin': gtin,
+            'name': name,
+            'brand': product.get('brand') or None,
+            'model': product.get('model') or None,
+            'category': product.get('category') or None,
+            'unit': product.get('unit') or None,
+            'pack_quantity': catalogue_number(product.get('pack_quantity')),
+            'price': catalogue_number(product.get('price')),
+            'url': product.get('url') or None,
+            'image_url': product.get('image_url') or None,
+            'source': product.get('source') or source,
+        })
+    conn.executemany('''
+        INSERT INTO product_catalogue (gtin, name, brand, model, category, unit, pack_quantity,
+                                       price, url, image_url, source, updated_at)
+        VALUES (:gtin, :name, :brand, :model, :category, :unit, COALESCE(:pack_quantity, 1),
+                :price, :url, :image_url, :source, CURRENT_TIMESTAMP)
+        ON CONFLICT(gtin) DO UPDATE SET
+            name = excluded.name,
+            brand = COALESCE(:brand, brand),
+            model = COALESCE(:model, model),
+            category = COALESCE(:category, category),
+            unit = COALESCE(:unit, unit),
+            pack_quantity = COALESCE(:pack_quantity, pack_quantity),
+            price = COALESCE(:price, price),
+            url = COALESCE(:url, url),
+            image_url = COALESCE(:image_url, image_url),
+            source = COALESCE(source, :source),
+            updated_at = CURRENT_TIMESTAMP
+    ''', rows)
+    return len(rows)
+
+def catalogue_lookup(conn, gtin):
+    """The catalogue product for a GTIN and its linked inventory item, if that still exists"""
+    product = conn.execute('SELECT * FROM product_catalogue WHERE gtin = ?', (gtin,)).fetchone()
+    if product is None or product['item_type'] not in CATALOGUE_ITEM_TABLES:
+        return product, None
+    table = CATALOGUE_ITEM_TABLES[product['item_type']]
+    item = conn.execute(f'SELECT * FROM {table} WHERE id = ?', (product['item_id'],)).fetchone()
+    return product, item
+
+def catalogue_prefill(conn, gtin):
+    """Add-form values for the product with this GTIN, keyed by input id"""
+    gtin = normalize_gtin(gtin)
+    if not gtin:
+        return {}
+    prefill = {'gtin': gtin}
+    product = conn.execute('SELECT * FROM product_catalogue WHERE gtin = ?', (gtin,)).fetchone()
+    if product:
+        prefill.update({
+            'name': product['name'],
+            'brand': product['brand'],
+            'model': product['model'],
+            'category': product['category'],
+            'unit': product['unit'],
+            'quantity': product['pack_quantity'],
+            'purchase_price': product['price'],
+            'purchase_url': product['url'],
+            'bunnings_url': product['url'],
+        })
+    return {key: value for key, value in prefill.items() if value is not None}
+
+def link_catalogue_item(conn, gtin, item_type, item_id, form):
+    """Link a scanned barcode to the item just added from it, cataloguing the product if it was unknown"""
+    gtin = normalize_gtin(gtin)
+    if not gtin:
+        return
+    upsert_catalogue(conn, [{
+        'gtin': gtin,
+        'name': form.get('name'),
+        'brand': form.get('brand'),
+        'model': form.get('model'),
+        'category': form.get('category'),
+        'unit': form.get('unit'),
+    }], source='Manual')
+    conn.execute('UPDATE product_catalogue SET item_type = ?, item_id = ? WHERE gtin = ?',
+                 (item_type, item_id, gtin))
+
+def read_catalogue_file(data, filename):
+    """Parse a CSV or JSON catalogue export into product dicts; raises ValueError if it isn't one"""
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        products = json.loads(text)
+        if isinstance(products, dict):
+            products = products.get('products', [])
+        if not isinstance(products, list) or not all(isinstance(product, dict) for product in products):
+            raise ValueError('expected a list of product objects')
+        return products
+    return list(csv.DictReader(StringIO(text)))
+
+@app.route('/scan/barcode/<code>')
+def scan_barcode(code):
+    """Resolve a scanned EAN/UPC barcode through the local product catalogue"""
+    if request.args.get('format') == 'upc_e' and len(code) == 8 and code.isdigit():
+        code = expand_upc_e(code)
+    gtin = normalize_gtin(code)
+    if not gtin:
+        return redirect(url_for('scanner', toast=f'{code} is not a valid EAN/UPC barcode', toast_type='error'))
+
+    conn = get_db()
+    product, item = catalogue_lookup(conn, gtin)
+    conn.close()
+
+    if item is not None:
+        if product['item_type'] in STOCKED_TABLES:
+            return render_template('barcode_restock.html', product=product, item=item,
+                                   item_name=stocked_item_name(product['item_type'], item))
+        return redirect(url_for('tool_detail', tool_id=item['id']))
+
+    item_type = request.args.get('add_as') or (product['item_type'] if product else None)
+    endpoint = 'add_tool' if item_type == 'tool' else 'add_consumable'
+    if product:
+        return redirect(url_for(endpoint, gtin=gtin, toast=f'Found {product["name"]} in the catalogue', toast_type='success'))
+    return redirect(url_for(endpoint, gtin=gtin, toast='New barcode - enter the details once and rescans will restock it', toast_type='info'))
+
+@app.route('/scan/barcode/<gtin>/restock', methods=['POST'])
+def restock_barcode(gtin):
+    """Add a scanned product's pack quantity (or the entered amount) to its linked item"""
+    conn = get_db()
+    product, item = catalogue_lookup(conn, gtin)
+    if item is None or product['item_type'] not in STOCKED_TABLES:
+        conn.close()
+        return redirect(url_for('scanner', toast='That barcode is not linked to a stocked item', toast_type='error'))
+
+    item_type = product['item_type']
+    amount = request.form.get('quantity', type=float) or product['pack_quantity']
+    conn.execute(f'UPDATE {STOCKED_TABLES[item_type]} SET quantity = COALESCE(quantity, 0) + ? WHERE id = ?',
+                 (amount, item['id']))
+    conn.commit()
+    conn.close()
+
+    return redirect(url_for(f'{item_type}_detail', **{f'{item_type}_id': item['id']},
+                            toast=f"Added {amount:g} to {stocked_item_name(item_type, item)}", toast_type='success'))
+
+@app.route('/catalogue/import', methods=['POST'])
+def import_catalogue():
+    """Bulk import catalogue products from an uploaded CSV or JSON file"""
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return redirect(url_for('scanner', toast='Choose a CSV or JSON file', toast_type='error'))
+    try:
+        products = read_catalogue_file(file.read(), file.filename)
+    except (ValueError, csv.Error) as e:
+        return redirect(url_for('scanner', toast=f'Could not read {file.filename}: {e}', toast_type='error'))
+
+    conn = get_db()
+    stored = upsert_catalogue(conn, products, source='Import')
+    conn.commit()
+    conn.close()
+
+    skipped = len(products) - stored
+    return redirect(url_for('scanner', toast=f'Imported {stored} products ({skipped} skipped)', toast_type='success'))
+
+@app.cli.command('import-catalogue')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_catalogue_command(path):
+    """Bulk import catalogue products from a CSV or JSON file"""
+    new_audit_batch('flask import-catalogue')
+    with open(path, 'rb') as f:
+        try:
+            products = read_catalogue_file(f.read(), path)
+        except (ValueError, csv.Error) as e:
+            raise click.ClickException(f'Could not read {path}: {e}')
+    conn = get_db()
+    stored = upsert_catalogue(conn, products, source='Import')
+    conn.commit()
+    conn.close()
+    click.echo(f'Imported {stored} products ({len(products) - stored} skipped)')
+
+# Workspace Routes
+
+class WorkspaceMiddleware:
+    """
+    Pick each request's workspace from a /w/<name>/ prefix or a
+    <name>.WORKSPACE_DOMAIN host. The prefix is moved to SCRIPT_NAME, so
+    routes see normal paths and url_for() keeps links inside the workspace.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        name = DEFAULT_WORKSPACE
+        path = environ.get('PATH_INFO', '')
+        match = WORKSPACE_PREFIX_RE.match(path)
+        domain = app.config['WORKSPACE_DOMAIN']
+        if match:
+            name = match.group(1)
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + match.group(0)
+            environ['PATH_INFO'] = path[match.end():] or '/'
+        elif domain:
+            host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+            if host.endswith('.' + domain):
+                name = host[:-len(domain) - 1]
+
+        if not workspace_exists(name):
+            return NotFound(f'There is no workspace named {name!r}.')(environ, start_response)
+
+        token = _current_workspace.set(name)
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            _current_workspace.reset(token)
+            raise
+        # Streamed responses still read from this workspace
+        return ClosingIterator(response, lambda: _current_workspace.reset(token))
+
+app.wsgi_app = WorkspaceMiddleware(app.wsgi_app)
+
+@app.context_processor
+def inject_workspace():
+    """Current workspace name for the nav bar"""
+    return {'workspace': current_workspace(), 'default_workspace': DEFAULT_WORKSPACE}
+
+# Cross-workspace searches run their per-database queries in parallel
+WORKSPACE_SEARCH_THREADS = 8
+_search_executor = ThreadPoolExecutor(max_workers=WORKSPACE_SEARCH_THREADS,
+                                      thread_name_prefix='workspace-search')
+
+def create_workspace(name):
+    """Create a workspace's upload folder and database"""
+    os.makedirs(upload_folder(name), exist_ok=True)
+    with use_workspace(name):
+        init_db()
+
+def search_inventory(conn, query, limit=20):
+    """Tools, consumables, materials and fasteners matching `query`, by name"""
+    like = f'%{query}%'
+    return conn.execute('''
+        SELECT 'tool' AS type, id, name, category, location FROM tools
+        WHERE name LIKE :q OR brand LIKE :q OR model LIKE :q
+        UNION ALL
+        SELECT 'consumable', id, name, category, location FROM consumables
+        WHERE name LIKE :q OR category LIKE :q
+        UNION ALL
+        SELECT 'material', id, name, category, location FROM materials
+        WHERE name LIKE :q OR category LIKE :q
+        UNION ALL
+        SELECT 'fastener', id, size || COALESCE(' x ' || length, '') || COALESCE(' ' || head_type, ''),
+               category, location FROM fasteners
+        WHERE size LIKE :q OR category LIKE :q OR head_type LIKE :q
+        ORDER BY name COLLATE NOCASE
+        LIMIT :limit
+    ''', {'q': like, 'limit': limit}).fetchall()
+
+def search_workspaces(query, names, limit=20):
+    """
+    Search several workspaces at once: each database is queried on the
+    search thread pool and the name-ordered results are merged, tagged
+    with their workspace.
+    """
+    def search_one(name):
+        with use_workspace(name):
+            conn = get_db()
+            try:
+                return [dict(row, workspace=name) for row in search_inventory(conn, query, limit)]
+            finally:
+                conn.close()
+
+    results = _search_executor.map(search_one, names)
+    merged = heapq.merge(*results, key=lambda row: (row['name'] or '').lower())
+    return list(itertools.islice(merged, limit))
+
+def workspace_item_url(row):
+    """Link to a search result inside its own workspace"""
+    path = url_for(f"{row['type']}_detail", **{f"{row['type']}_id": row['id']})
+    return f"/w/{row['workspace']}{path[len(request.script_root):]}"
+
+def requested_workspaces():
+    """Workspaces named in ?workspaces= (comma separated), or all of them"""
+    names = [name for name in request.args.get('workspaces', '').split(',') if name]
+    known = list_workspaces()
+    return [name for name in names if name in known] if names else known
+
+@app.route('/workspaces')
+def workspaces():
+    """List workspaces and search across them"""
+    query = request.args.get('q', '').strip()
+    results = []
+    if query:
+        results = search_workspaces(query, requested_workspaces(), limit=100)
+        for row in results:
+            row['url'] = workspace_item_url(row)
+    return render_template('workspaces.html', workspaces=list_workspaces(), query=query, results=results)
+
+@app.route('/workspaces/create', methods=['POST'])
+def add_workspace():
+    """Create a new workspace"""
+    name = request.form.get('name', '').strip().lower()
+    if not WORKSPACE_NAME_RE.match(name):
+        return redirect(url_for('workspaces', toast='Use lowercase letters, digits and dashes (up to 40)', toast_type='error'))
+    if workspace_exists(name):
+        return redirect(url_for('workspaces', toast=f'Workspace {name} already exists', toast_type='error'))
+
+    create_workspace(name)
+
+    return redirect(url_for('workspaces', toast=f'Workspace {name} created', toast_type='success'))
+
+@app.route('/api/search')
+def api_search():
+    """Search items across workspaces (?q=, optional ?workspaces=a,b and ?limit=)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'No search query provided'}), 400
+    limit = min(request.args.get('limit', 20, type=int), 200)
+
+    results = search_workspaces(query, requested_workspaces(), limit)
+    for row in results:
+        row['url'] = workspace_item_url(row)
+
+    return jsonify({'success': True, 'results': results})
+
+@app.cli.command('create-workspace')
+@click.argument('name')
+def create_workspace_command(name):
+    """Create a workspace with its own database and uploads"""
+    if not WORKSPACE_NAME_RE.match(name):
+        raise click.BadParameter('use lowercase letters, digits and dashes (up to 40)')
+    create_workspace(name)
+    click.echo(f'Created workspace {name} at {workspace_root(name)}')
+
+# Audit Log Routes
+
+# User-editable tables whose writes are recorded in audit_log by triggers
+AUDITED_TABLES = [
+    'tools', 'consumables', 'materials', 'fasteners', 'locations', 'shopping_list', 'favorites',
+    'projects', 'project_requirements', 'loans', 'maintenance_schedules', 'maintenance_log',
+    'battery_platforms', 'batteries', 'tool_battery_platform', 'tool_consumable', 'product_catalogue',
+]
+
+# Audit rows are kept this many days, and at most this many in total;
+# repeated updates to a row within one request are merged after AUDIT_COMPACT_DAYS
+AUDIT_RETENTION_DAYS = 90
+AUDIT_MAX_ROWS = 200000
+AUDIT_COMPACT_DAYS = 7
+# Rows deleted per statement, and minimum seconds between background prunes
+AUDIT_PRUNE_BATCH = 5000
+AUDIT_PRUNE_INTERVAL = 24 * 60 * 60
+# Most recent changes scanned for the history page
+AUDIT_HISTORY_WINDOW = 2000
+
+# Every write made while handling one request (or one CLI command or
+# background task) shares a batch id, so cascades and bulk operations can be
+# undone together. The triggers read these from audit_state, filled in by
+# PooledConnection.
+_audit_batch = contextvars.ContextVar('audit_batch', default=None)
+_audit_context = contextvars.ContextVar('audit_context', default=None)
+
+def audit_batch_id():
+    """Batch id for the current request, allocated on its first audited write"""
+    batch = _audit_batch.get()
+    if batch is None:
+        batch = secrets.randbits(48)
+        _audit_batch.set(batch)
+    return batch
+
+def audit_context():
+    """What made the current writes, e.g. 'POST /tool/3/delete'"""
+    return _audit_context.get()
+
+def new_audit_batch(context):
+    """Start a fresh audit batch, labelled `context`, for the writes that follow"""
+    _audit_batch.set(None)
+    _audit_context.set(context)
+
+@app.before_request
+def start_audit_batch():
+    """Give each request its own audit batch"""
+    new_audit_batch(f'{request.method} {request.path}')
+
+def audit_key_columns(conn, table):
+    """Primary key columns identifying a row of an audited table"""
+    columns = conn.execute(f'PRAGMA table_info({table})').fetchall()
+    return [column['name'] for column in sorted(columns, key=lambda column: column['pk']) if column['pk']]
+
+def install_audit_triggers(conn):
+    """
+    (Re)create the audit triggers from each table's current columns. Each
+    trigger is a single INSERT of the old and/or new row as JSON, run inside
+    SQLite; the only extra statements are the audit_state pair each write
+    transaction makes (see PooledConnection). Updates that change nothing
+    are skipped.
+    """
+    for table in AUDITED_TABLES:
+        columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+        keys = audit_key_columns(conn, table)
+
+        def image(ref):
+            return 'json_object(' + ', '.join(f"'{column}', {ref}.{column}" for column in columns) + ')'
+
+        def row_key(ref):
+            return " || ',' || ".join(f'{ref}.{key}' for key in keys)
+
+        changed = ' OR '.join(f'NEW.{column} IS NOT OLD.{column}' for column in columns)
+        events = {
+            'insert': ('INSERT', '', row_key('NEW'), 'NULL', image('NEW')),
+            'update': ('UPDATE', f'WHEN {changed}', row_key('NEW'), image('OLD'), image('NEW')),
+            'delete': ('DELETE', '', row_key('OLD'), image('OLD'), 'NULL'),
+        }
+        for name, (event, when, key, old_row, new_row) in events.items():
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_audit_{name}')
+            conn.execute(f'''
+                CREATE TRIGGER trg_{table}_audit_{name}
+                AFTER {event} ON {table}
+                {when}
+                BEGIN
+                    INSERT INTO audit_log (batch_id, context, table_name, row_key, action, old_row, new_row)
+                    VALUES ((SELECT batch_id FROM audit_state), (SELECT context FROM audit_state),
+                            '{table}', {key}, '{event}', {old_row}, {new_row});
+                END
+            ''')
+
+def audit_values_match(current, image):
+    """Whether a live row still holds the values recorded in an audit image"""
+    for column, value in image.items():
+        if column not in current.keys():
+            continue
+        live = current[column]
+        if isinstance(value, float) or isinstance(live, float):
+            if live is None or value is None or not math.isclose(live, value, rel_tol=1e-12):
+                return False
+        elif live != value:
+            return False
+    return True
+
+def undo_audit_entries(conn, entries):
+    """
+    Revert audit entries newest first: re-insert deleted rows, restore old
+    values and delete inserted rows. Raises ValueError, leaving the caller
+    to roll back, if any row has changed since. Foreign keys are checked at
+    commit, so parents and cascaded children can be restored in any order.
+    """
+    conn.execute('PRAGMA defer_foreign_keys = ON')
+    pending = [entry for entry in entries if entry['undone_by'] is None]
+    for entry in sorted(pending, key=lambda entry: entry['id'], reverse=True):
+        table = entry['table_name']
+        old = json.loads(entry['old_row']) if entry['old_row'] else None
+        new = json.loads(entry['new_row']) if entry['new_row'] else None
+        keys = audit_key_columns(conn, table)
+        where = ' AND '.join(f'{key} = ?' for key in keys)
+        key_values = [(old or new)[key] for key in keys]
+        current = conn.execute(f'SELECT * FROM {table} WHERE {where}', key_values).fetchone()
+        label = f"{table} {entry['row_key']}"
+
+        if entry['action'] == 'DELETE':
+            if current is not None:
+                raise ValueError(f'{label} has been re-created since')
+            columns = [column for column in old if column in api_columns(conn, table)]
+            conn.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [old[column] for column in columns],
+            )
+        elif current is None or not audit_values_match(current, new):
+            raise ValueError(f'{label} has changed since')
+        elif entry['action'] == 'INSERT':
+            conn.execute(f'DELETE FROM {table} WHERE {where}', key_values)
+        else:
+            columns = [column for column in old if column in current.keys() and column not in keys]
+            conn.execute(
+                f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE {where}",
+                [old[column] for column in columns] + key_values,
+            )
+
+    ids = [entry['id'] for entry in pending]
+    conn.execute(
+        f"UPDATE audit_log SET undone_by = ? WHERE id IN ({', '.join('?' * len(ids))})", [audit_batch_id(), *ids]
+    )
+    return len(pending)
+
+def undo_audit(conn, entry_id=None, batch_id=None):
+    """Undo one audit entry or a whole batch atomically; returns (entries undone, undo batch id)"""
+    if entry_id is not None:
+        entries = conn.execute('SELECT * FROM audit_log WHERE id = ?', (entry_id,)).fetchall()
+    else:
+        entries = conn.execute('SELECT * FROM audit_log WHERE batch_id = ?', (batch_id,)).fetchall()
+    if not entries:
+        raise ValueError('No such change')
+    if all(entry['undone_by'] is not None for entry in entries):
+        raise ValueError('Already undone')
+
+    try:
+        undone = undo_audit_entries(conn, entries)
+        if batch_id is not None:
+            # Undoing an undo puts the changes it reverted back in effect
+            conn.execute('UPDATE audit_log SET undone_by = NULL WHERE undone_by = ?', (batch_id,))
+        conn.commit()
+    except (ValueError, sqlite3.IntegrityError):
+        conn.rollback()
+        raise
+    # Rows came back without going through the routes, so rebuild the indexes
+    autocomplete_index.load(conn)
+    battery_index.load(conn)
+    return undone, audit_batch_id()
+
+def prune_audit_log(conn, force=False):
+    """
+    Keep the audit log bounded: merge runs of updates to the same row within
+    a batch once they are AUDIT_COMPACT_DAYS old, then delete entries past
+    AUDIT_RETENTION_DAYS or beyond the newest AUDIT_MAX_ROWS, a chunk at a
+    time. Runs at most once per AUDIT_PRUNE_INTERVAL unless forced.
+    """
+    now = datetime.now()
+    last_run = get_job_state(conn, 'audit_prune_at')
+    if not force and last_run and (now - parse_timestamp(last_run)).total_seconds() < AUDIT_PRUNE_INTERVAL:
+        return None
+
+    compact_before = (now - timedelta(days=AUDIT_COMPACT_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    # Rows a batch only updated (never inserted or deleted), several times
+    runs = '''
+        WITH runs AS (
+            SELECT batch_id, table_name, row_key, MIN(id) AS first_id, MAX(id) AS last_id
+            FROM audit_log
+            WHERE changed_at < :before AND undone_by IS NULL AND batch_id IS NOT NULL
+            GROUP BY batch_id, table_name, row_key
+            HAVING COUNT(*) > 1 AND MIN(action = 'UPDATE') = 1
+        )
+    '''
+    # The newest update of each run takes the oldest one's before-image
+    conn.execute(runs + '''
+        UPDATE audit_log SET old_row = (
+            SELECT first.old_row FROM runs JOIN audit_log first ON first.id = runs.first_id
+            WHERE runs.last_id = audit_log.id
+        )
+        WHERE id IN (SELECT last_id FROM runs)
+    ''', {'before': compact_before})
+    before_delete = conn.total_changes
+    conn.execute(runs + '''
+        DELETE FROM audit_log WHERE id IN (
+            SELECT entry.id FROM runs
+            JOIN audit_log entry ON entry.batch_id = runs.batch_id AND entry.table_name = runs.table_name
+                                AND entry.row_key = runs.row_key
+            WHERE entry.id < runs.last_id
+        )
+    ''', {'before': compact_before})
+    # (rowcount isn't reported for statements starting with WITH)
+    compacted = conn.total_changes - before_delete
+    conn.commit()
+
+    retain_after = (now - timedelta(days=AUDIT_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    newest = conn.execute('SELECT MAX(id) FROM audit_log').fetchone()[0] or 0
+    expired = conn.execute(
+        'SELECT MAX(id) FROM audit_log WHERE changed_at < ?', (retain_after,)
+    ).fetchone()[0] or 0
+    cutoff = max(expired, newest - AUDIT_MAX_ROWS)
+
+    removed = 0
+    while True:
+        deleted = conn.execute('''
+            DELETE FROM audit_log WHERE id IN (
+                SELECT id FROM audit_log WHERE id <= ? ORDER BY id LIMIT ?
+            )
+        ''', (cutoff, AUDIT_PRUNE_BATCH)).rowcount
+        conn.commit()
+        removed += deleted
+        if deleted < AUDIT_PRUNE_BATCH:
+            break
+
+    set_job_state(conn, 'audit_prune_at', now.isoformat(timespec='seconds'))
+    conn.commit()
+    return {'compacted': compacted, 'removed': removed}
+
+def audit_batches(conn, limit=50):
+    """Recent audit batches, newest first, summarised for the history page (writes from outside the app one by one)"""
+    return conn.execute('''
+        SELECT batch_id, MIN(changed_at) AS changed_at, MAX(context) AS context, COUNT(*) AS changes,
+               GROUP_CONCAT(DISTINCT action || ' ' || table_name) AS summary,
+               MIN(undone_by IS NOT NULL) AS undone
+        FROM audit_log
+        WHERE id > (SELECT COALESCE(MAX(id), 0) FROM audit_log) - ?
+        GROUP BY COALESCE(batch_id, 'entry ' || id)
+        ORDER BY MAX(id) DESC
+        LIMIT ?
+    ''', (AUDIT_HISTORY_WINDOW, limit)).fetchall()
+
+@app.route('/history')
+def history():
+    """Recent changes grouped by request, with undo"""
+    conn = get_db()
+    batches = audit_batches(conn)
+    conn.close()
+
+    return render_template('history.html', batches=batches)
+
+@app.route('/history/<int:batch_id>/undo', methods=['POST'])
+def undo_history_batch(batch_id):
+    """Undo every change made by one request"""
+    conn = get_db()
+    try:
+        undone, _ = undo_audit(conn, batch_id=batch_id)
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.close()
+        return redirect(url_for('history', toast=f'Could not undo: {e}', toast_type='error'))
+    conn.close()
+
+    return redirect(url_for('history', toast=f'Undid {undone} changes', toast_type='success'))
+
+@app.route('/api/audit')
+def api_audit():
+    """Audit entries, newest first (?table=, ?row=, ?batch=, ?before=<id>, ?limit=)"""
+    filters, params = [], []
+    if request.args.get('table'):
+        filters.append('table_name = ?')
+        params.append(request.args['table'])
+        if request.args.get('row'):
+            filters.append('row_key = ?')
+            params.append(request.args['row'])
+    if request.args.get('batch'):
+        filters.append('batch_id = ?')
+        params.append(request.args.get('batch', type=int))
+    if request.args.get('before'):
+        filters.append('id < ?')
+        params.append(request.args.get('before', type=int))
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    limit = min(request.args.get('limit', 50, type=int), 500)
+
+    conn = get_db()
+    entries = conn.execute(f'SELECT * FROM audit_log {where} ORDER BY id DESC LIMIT ?', params + [limit]).fetchall()
+    conn.close()
+
+    return jsonify([
+        {**dict(entry), 'old_row': json.loads(entry['old_row'] or 'null'),
+         'new_row': json.loads(entry['new_row'] or 'null')}
+        for entry in entries
+    ])
+
+@app.route('/api/audit/undo', methods=['POST'])
+def api_audit_undo():
+    """Undo {"id": entry} or {"batch": batch_id} atomically; the response's batch undoes the undo"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or ('id' in data) == ('batch' in data):
+        return jsonify({'success': False, 'error': 'Give exactly one of "id" or "batch"'}), 400
+
+    conn = get_db()
+    try:
+        undone, batch = undo_audit(conn, entry_id=data.get('id'), batch_id=data.get('batch'))
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 409
+    conn.close()
+
+    return jsonify({'success': True, 'undone': undone, 'batch': batch})
+
+@app.cli.command('prune-audit')
+def prune_audit_command():
+    """Compact and trim the audit log now"""
+    conn = get_db()
+    result = prune_audit_log(conn, force=True)
+    conn.close()
+    click.echo(f"Merged {result['compacted']} updates, removed {result['removed']} old entries")
+
+# Image Similarity Routes
+
+# Perceptual hashes are 64-bit: pHash from the low frequencies of a 32x32
+# DCT, dHash from brightness gradients on a 9x8 thumbnail
+PHASH_SIZE = 32
+PHASH_LOW = 8
+# Largest pHash Hamming distance still reported as a match
+IMAGE_MATCH_RADIUS = 20
+# Images hashed per backfill batch
+IMAGE_HASH_BATCH = 50
+
+# cos((2x + 1) u pi / 2N) for the low-frequency DCT rows, computed once
+_dct_table = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+    for u in range(PHASH_LOW)
+]
+
+def to_signed64(value):
+    """Store an unsigned 64-bit hash in an SQLite INTEGER"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned64(value):
+    return value & ((1 << 64) - 1)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def perceptual_hashes(data):
+    """(pHash, dHash) of an image's bytes as unsigned 64-bit ints"""
+    from PIL import Image, ImageOps  # deferred, like qrcode
+
+    image = Image.open(BytesIO(data))
+    # JPEGs decode straight to a small greyscale draft, far faster than full size
+    image.draft('L', (PHASH_SIZE * 2, PHASH_SIZE * 2))
+    image = ImageOps.exif_transpose(image).convert('L')
+
+    pixels = list(image.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS).getdata())
+    rows = [pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE] for y in range(PHASH_SIZE)]
+    # Separable DCT, keeping only the PHASH_LOW x PHASH_LOW low frequencies
+    row_dct = [[sum(c * p for c, p in zip(cos_u, row)) for cos_u in _dct_table] for row in rows]
+    coefficients = [
+        sum(cos_v[y] * row_dct[y][u] for y in range(PHASH_SIZE))
+        for cos_v in _dct_table for u in range(PHASH_LOW)
+    ]
+    # The DC term is the mean brightness, which says nothing about structure
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    phash = 0
+    for coefficient in coefficients:
+        phash = (phash << 1) | (coefficient > median)
+
+    small = list(image.resize((9, 8), Image.LANCZOS).getdata())
+    dhash = 0
+    for y in range(8):
+        for x in range(8):
+            dhash = (dhash << 1) | (small[y * 9 + x] > small[y * 9 + x + 1])
+    return phash, dhash
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes for Hamming-radius search"""
+
+    def __init__(self):
+        self.root = None  # [hash, values, {distance: child}]
+
+    def add(self, key, value):
+        if self.root is None:
+            self.root = [key, [value], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [value], {}]
+                return
+            node = child
+
+    def search(self, key, radius):
+        """[(distance, value)] for every value within `radius` of `key`"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= radius:
+                found.extend((distance, value) for value in node[1])
+            # Triangle inequality: only children in [d - r, d + r] can match
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+class ImageIndex:
+    """
+    In-memory BK-tree over the pHash of every upload, with the dHash kept
+    alongside to break ties. Loaded on first search and extended as images
+    are uploaded; files the GC removes are filtered out when results are
+    matched to items.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._dhashes = {}
+        self._loaded = False
+
+    def load(self, conn):
+        rows = conn.execute('SELECT path, phash, dhash FROM images WHERE phash IS NOT NULL').fetchall()
+        with self._lock:
+            self._tree = BKTree()
+            self._dhashes = {}
+            for row in rows:
+                self._tree.add(to_unsigned64(row['phash']), row['path'])
+                self._dhashes[row['path']] = to_unsigned64(row['dhash'])
+            self._loaded = True
+
+    def add(self, path, phash, dhash):
+        if not self._loaded:
+            return
+        with self._lock:
+            if path not in self._dhashes:
+                self._tree.add(phash, path)
+                self._dhashes[path] = dhash
+
+    def search(self, conn, phash, dhash, radius=IMAGE_MATCH_RADIUS):
+        """[(pHash distance + dHash distance, path)] within `radius`, closest first"""
+        if not self._loaded:
+            self.load(conn)
+        with self._lock:
+            matches = self._tree.search(phash, radius)
+            scored = [(distance + hamming(dhash, self._dhashes[path]), path) for distance, path in matches]
+        return sorted(scored)
+
+image_index = WorkspaceLocal(ImageIndex)
+
+def set_image_hashes(conn, path, data):
+    """Hash a stored upload and add it to the similarity index; False if Pillow can't read it"""
+    try:
+        phash, dhash = perceptual_hashes(data)
+    except (OSError, ValueError, SyntaxError):
+        # phash NULL with a dhash marks an image the backfill shouldn't retry
+        conn.execute('UPDATE images SET dhash = 0 WHERE path = ?', (path,))
+        return False
+    conn.execute('UPDATE images SET phash = ?, dhash = ? WHERE path = ?',
+                 (to_signed64(phash), to_signed64(dhash), path))
+    image_index.add(path, phash, dhash)
+    return True
+
+def backfill_image_hashes(conn, batch_size=IMAGE_HASH_BATCH, max_batches=None):
+    """Hash uploads stored before hashing existed, committing one path-ordered batch at a time"""
+    last_path = ''
+    hashed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = conn.execute('''
+            SELECT path FROM images
+            WHERE phash IS NULL AND dhash IS NULL AND path > ?
+            ORDER BY path LIMIT ?
+        ''', (last_path, batch_size)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            try:
+                with open(upload_file_path(row['path']), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            hashed += set_image_hashes(conn, row['path'], data)
+        conn.commit()
+        last_path = rows[-1]['path']
+        batches += 1
+    return hashed
+
+def items_for_images(conn, paths):
+    """Inventory items using each image path: {path: [item dicts]}"""
+    if not paths:
+        return {}
+    placeholders = ', '.join('?' * len(paths))
+    rows = conn.execute(f'''
+        SELECT 'tool' AS type, id, name, location, image_path FROM tools WHERE image_path IN ({placeholders})
+        UNION ALL
+        SELECT 'consumable', id, name, location, image_path FROM consumables WHERE image_path IN ({placeholders})
+        UNION ALL
+        SELECT 'material', id, name, location, image_path FROM materials WHERE image_path IN ({placeholders})
+        UNION ALL
+        SELECT 'fastener', id, size || COALESCE(' x ' || length, '') || COALESCE(' ' || head_type, ''),
+               location, image_path FROM fasteners WHERE image_path IN ({placeholders})
+    ''', list(paths) * 4).fetchall()
+    items = {}
+    for row in rows:
+        items.setdefault(row['image_path'], []).append(dict(row))
+    return items
+
+def find_similar_items(conn, data, limit=10):
+    """Items whose photo looks most like the image in `data`, closest first"""
+    phash, dhash = perceptual_hashes(data)
+    matches = image_index.search(conn, phash, dhash)
+    items = items_for_images(conn, [path for _, path in matches])
+    results = []
+    for distance, path in matches:
+        for item in items.get(path, []):
+            results.append({**item, 'distance': distance,
+                            'similarity': round(1 - distance / 128, 3)})
+    return results[:limit]
+
+@app.route('/find-by-photo', methods=['GET', 'POST'])
+def find_by_photo():
+    """Find inventory items from a photo"""
+    if request.method == 'GET':
+        return render_template('find_by_photo.html', results=None)
+
+    file = request.files.get('image')
+    if not file or not file.filename:
+        return redirect(url_for('find_by_photo', toast='Take or choose a photo first', toast_type='error'))
+    conn = get_db()
+    try:
+        results = find_similar_items(conn, file.read())
+    except (OSError, ValueError, SyntaxError):
+        conn.close()
+        return redirect(url_for('find_by_photo', toast='That file is not a readable image', toast_type='error'))
+    conn.close()
+
+    return render_template('find_by_photo.html', results=results)
+
+@app.route('/api/images/similar', methods=['POST'])
+def api_similar_images():
+    """Items whose photo is closest to an uploaded image, as JSON"""
+    file = request.files.get('image')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'error': 'No image uploaded'}), 400
+    limit = min(request.args.get('limit', 10, type=int), 50)
+
+    conn = get_db()
+    try:
+        results = find_similar_items(conn, file.read(), limit)
+    except (OSError, ValueError, SyntaxError):
+        conn.close()
+        return jsonify({'success': False, 'error': 'Not a readable image'}), 400
+    conn.close()
+
+    return jsonify({'success': True, 'results': results})
+
+@app.cli.command('hash-images')
+def hash_images_command():
+    """Compute perceptual hashes for uploads that don't have them yet"""
+    new_audit_batch('flask hash-images')
+    conn = get_db()
+    hashed = backfill_image_hashes(conn)
+    conn.close()
+    click.echo(f'Hashed {hashed} images')
+
+# Duplicate Detection Routes
+
+# Fields compared when scoring a candidate pair, with their weights. The
+# first field is the item's name; location is left out on purpose, since
+# duplicates are usually the same thing entered in two places.
+DUPLICATE_FIELDS = {
+    'tool': {'name': 3, 'model': 2, 'brand': 1, 'category': 1},
+    'consumable': {'name': 3, 'category': 1, 'unit': 1, 'compatible_with': 1},
+    'material': {'name': 3, 'material_type': 1, 'grade': 1, 'finish': 1, 'color': 1},
+    'fastener': {'size': 3, 'length': 2, 'material': 1, 'head_type': 1, 'thread_type': 1},
+}
+# Weighted similarity at which a pair is suggested as a duplicate
+DUPLICATE_THRESHOLD = 0.6
+# Blocks bigger than this are too generic (e.g. every "Ryobi" tool) to compare pairwise
+DUPLICATE_MAX_BLOCK = 200
+
+# Rows pointing at an item, as (table, column), repointed when items merge.
+# Link tables use UPDATE OR IGNORE; rows the kept item already has are
+# dropped with the duplicate.
+ITEM_REFERENCES = {
+    'tool': [('tool_consumable', 'tool_id'), ('tool_battery_platform', 'tool_id'),
+             ('maintenance_schedules', 'tool_id'), ('maintenance_log', 'tool_id'), ('loans', 'tool_id')],
+    'consumable': [('tool_consumable', 'consumable_id')],
+    'material': [],
+    'fastener': [],
+}
+# Tables referring to items by (item_type, item_id)
+TYPED_ITEM_REFERENCES = ['favorites', 'shopping_list', 'project_requirements', 'product_catalogue']
+
+def normalize_text(value):
+    """Lowercase with punctuation collapsed to single spaces"""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', str(value or '').lower()).split())
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def text_similarity(a, b):
+    """Jaccard similarity of two normalised strings' character trigrams"""
+    if a == b:
+        return 1.0
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+def duplicate_block_keys(item_type, row):
+    """
+    Keys grouping rows that could be duplicates; only rows sharing a key
+    are compared. Fasteners must agree on category, diameter and length;
+    other items share a key per name word (or brand), within a category.
+    """
+    if item_type == 'fastener':
+        diameter = row['diameter_mm'] if row['diameter_mm'] is not None else normalize_text(row['size'])
+        length = row['length_mm'] if row['length_mm'] is not None else normalize_text(row['length'])
+        return {(normalize_text(row['category']), diameter, length)}
+    words = normalize_text(row['name']).split()
+    if item_type == 'tool':
+        # Tools are named freely ("Makita drill"), so block on brand and words alone
+        words += normalize_text(row['brand']).split() + normalize_text(row['model']).split()
+        return {word for word in words if len(word) > 1}
+    category = normalize_text(row['category'])
+    return {(category, word) for word in words if len(word) > 1}
+
+def duplicate_score(item_type, a, b):
+    """Weighted field similarity of two rows; fields blank on either side are skipped"""
+    total = weight_sum = 0
+    for field, weight in DUPLICATE_FIELDS[item_type].items():
+        value_a, value_b = a[field], b[field]
+        if not value_a or not value_b:
+            continue
+        total += weight * text_similarity(value_a, value_b)
+        weight_sum += weight
+    return total / weight_sum if weight_sum else 0.0
+
+def duplicate_label(item_type, row):
+    if item_type == 'fastener':
+        return ' '.join(filter(None, [row['size'], row['length'] and f"x {row['length']}",
+                                      row['material'], row['head_type']]))
+    return row['name']
+
+def find_duplicates(conn, item_type, threshold=DUPLICATE_THRESHOLD):
+    """
+    Groups of likely duplicate items of one type, most similar first. Rows
+    are blocked by duplicate_block_keys so only rows sharing a block are
+    scored, then pairs over `threshold` are joined into groups. Each group
+    suggests keeping its most complete row.
+    """
+    table = CATALOGUE_ITEM_TABLES[item_type]
+    fields = DUPLICATE_FIELDS[item_type]
+    rows = {row['id']: row for row in conn.execute(f'SELECT * FROM {table} ORDER BY id')}
+    normalized = {
+        row_id: {field: normalize_text(row[field]) for field in fields} for row_id, row in rows.items()
+    }
+
+    blocks = {}
+    for row_id, row in rows.items():
+        for key in duplicate_block_keys(item_type, row):
+            blocks.setdefault(key, []).append(row_id)
+
+    scores = {}
+    for ids in blocks.values():
+        if len(ids) > DUPLICATE_MAX_BLOCK:
+            continue
+        for a, b in itertools.combinations(ids, 2):
+            if (a, b) not in scores:
+                scores[(a, b)] = duplicate_score(item_type, normalized[a], normalized[b])
+
+    # Union-find over the pairs that clear the threshold
+    parent = {}
+
+    def root(row_id):
+        while parent.get(row_id, row_id) != row_id:
+            row_id = parent[row_id]
+        return row_id
+
+    for (a, b), score in scores.items():
+        if score >= threshold:
+            parent[max(root(a), root(b))] = min(root(a), root(b))
+
+    groups = {}
+    for (a, b), score in scores.items():
+        if score >= threshold:
+            group = groups.setdefault(root(a), {'ids': set(), 'score': 0.0})
+            group['ids'].update((a, b))
+            group['score'] = max(group['score'], score)
+
+    results = []
+    for group in groups.values():
+        members = [rows[row_id] for row_id in sorted(group['ids'])]
+        keep = max(members, key=lambda row: (sum(value not in (None, '') for value in row), -row['id']))
+        results.append({
+            'type': item_type,
+            'score': round(group['score'], 3),
+            'keep_id': keep['id'],
+            'items': [
+                {'id': row['id'], 'name': duplicate_label(item_type, row), 'location': row['location'],
+                 'quantity': row['quantity'] if item_type in STOCKED_TABLES else None}
+                for row in members
+            ],
+        })
+    return sorted(results, key=lambda group: -group['score'])
+
+def merge_items(conn, item_type, keep_id, merge_ids):
+    """
+    Merge duplicate items into `keep_id` in one transaction: blank fields
+    are filled from the duplicates, stock quantities are summed, favorites,
+    shopping list, project and catalogue references and the item's own
+    links are repointed, then the duplicates are deleted. Raises ValueError
+    (after rolling back) if an item is missing or the merge would conflict.
+    """
+    table = CATALOGUE_ITEM_TABLES[item_type]
+    merge_ids = sorted({int(item_id) for item_id in merge_ids} - {keep_id})
+    if not merge_ids:
+        raise ValueError('Choose at least one duplicate to merge')
+    placeholders = ', '.join('?' * len(merge_ids))
+    found = conn.execute(
+        f'SELECT COUNT(*) FROM {table} WHERE id IN (?, {placeholders})', [keep_id] + merge_ids
+    ).fetchone()[0]
+    if found != len(merge_ids) + 1:
+        raise ValueError(f'Some of those {table} no longer exist')
+    if item_type == 'tool':
+        # Only one loan per tool can be open, so a merge can't keep two
+        open_loans = conn.execute(
+            f'SELECT COUNT(*) FROM loans WHERE returned_at IS NULL AND tool_id IN (?, {placeholders})',
+            [keep_id] + merge_ids
+        ).fetchone()[0]
+        if open_loans > 1:
+            raise ValueError('More than one of those tools is out on loan')
+
+    fill = [column for column in api_columns(conn, table) if column not in ('id', 'quantity', 'created_at')]
+    try:
+        conn.execute(f'''
+            UPDATE {table} SET {', '.join(
+                f"{column} = COALESCE(NULLIF({column}, ''), (SELECT d.{column} FROM {table} d "
+                f"WHERE d.id IN ({placeholders}) AND NULLIF(d.{column}, '') IS NOT NULL ORDER BY d.id LIMIT 1))"
+                for column in fill
+            )}
+            WHERE id = ?
+        ''', merge_ids * len(fill) + [keep_id])
+        if item_type in STOCKED_TABLES:
+            conn.execute(f'''
+                UPDATE {table}
+                SET quantity = COALESCE(quantity, 0)
+                    + (SELECT COALESCE(SUM(quantity), 0) FROM {table} WHERE id IN ({placeholders}))
+                WHERE id = ?
+            ''', merge_ids + [keep_id])
+
+        for reference in TYPED_ITEM_REFERENCES:
+            conn.execute(f'''
+                UPDATE OR IGNORE {reference} SET item_id = ?
+                WHERE item_type = ? AND item_id IN ({placeholders})
+            ''', [keep_id, item_type] + merge_ids)
+        # Favorites the kept item already had
+        conn.execute(f'DELETE FROM favorites WHERE item_type = ? AND item_id IN ({placeholders})',
+                     [item_type] + merge_ids)
+        for reference, column in ITEM_REFERENCES[item_type]:
+            conn.execute(f'UPDATE OR IGNORE {reference} SET {column} = ? WHERE {column} IN ({placeholders})',
+                         [keep_id] + merge_ids)
+
+        conn.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', merge_ids)
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        raise ValueError(f'Could not merge: {e}') from e
+    # Rows changed outside the usual routes, so rebuild the indexes
+    autocomplete_index.load(conn)
+    battery_index.load(conn)
+    return len(merge_ids)
+
+def duplicate_types(value):
+    """Item types named by a ?type= argument (all of them when blank)"""
+    if not value:
+        return list(DUPLICATE_FIELDS)
+    if value not in DUPLICATE_FIELDS:
+        raise ValueError(f'Unknown item type: {value}')
+    return [value]
+
+@app.route('/duplicates')
+def duplicates():
+    """Suggested duplicate items, with merge"""
+    try:
+        item_types = duplicate_types(request.args.get('type'))
+    except ValueError as e:
+        return redirect(url_for('duplicates', toast=str(e), toast_type='error'))
+    threshold = request.args.get('threshold', DUPLICATE_THRESHOLD, type=float)
+
+    conn = get_db()
+    groups = [group for item_type in item_types for group in find_duplicates(conn, item_type, threshold)]
+    conn.close()
+
+    return render_template('duplicates.html', groups=groups, item_type=request.args.get('type', ''),
+                           threshold=threshold, item_types=list(DUPLICATE_FIELDS))
+
+@app.route('/duplicates/merge', methods=['POST'])
+def merge_duplicates():
+    """Merge the checked duplicates into the chosen item"""
+    item_type = request.form.get('item_type')
+    if item_type not in DUPLICATE_FIELDS:
+        return redirect(url_for('duplicates', toast='Unknown item type', toast_type='error'))
+    keep_id = request.form.get('keep_id', type=int)
+    merge_ids = request.form.getlist('merge_ids', type=int)
+
+    conn = get_db()
+    try:
+        merged = merge_items(conn, item_type, keep_id, merge_ids)
+    except ValueError as e:
+        conn.close()
+        return redirect(url_for('duplicates', type=item_type, toast=str(e), toast_type='error'))
+    conn.close()
+
+    return redirect(url_for('duplicates', type=item_type,
+                            toast=f'Merged {merged} duplicate{"s" if merged != 1 else ""}', toast_type='success'))
+
+@app.route('/api/duplicates')
+def api_duplicates():
+    """Duplicate groups as JSON (?type=, ?threshold=)"""
+    try:
+        item_types = duplicate_types(request.args.get('type'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    threshold = request.args.get('threshold', DUPLICATE_THRESHOLD, type=float)
+
+    conn = get_db()
+    groups = [group for item_type in item_types for group in find_duplicates(conn, item_type, threshold)]
+    conn.close()
+
+    return jsonify({'success': True, 'groups': groups})
+
+@app.route('/api/duplicates/merge', methods=['POST'])
+def api_merge_duplicates():
+    """Merge items: {"type": ..., "keep": id, "merge": [ids]}"""
+    data = request.get_json(silent=True) or {}
+    if data.get('type') not in DUPLICATE_FIELDS:
+        return jsonify({'success': False, 'error': 'Unknown item type'}), 400
+    try:
+        keep_id = int(data['keep'])
+        merge_ids = [int(item_id) for item_id in data.get('merge', [])]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'keep and merge must be item ids'}), 400
+
+    conn = get_db()
+    try:
+        merged = merge_items(conn, data['type'], keep_id, merge_ids)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'success': False, 'error': str(e)}), 409
+    conn.close()
+
+    return jsonify({'success': True, 'merged': merged, 'batch': audit_batch_id()})
+
+# Price History Routes
+
+# Product page columns re-checked by the price refresher, by item type
+PRICED_ITEM_URLS = {
+    'tool': ('tools', 'bunnings_url'),
+    'consumable': ('consumables', 'purchase_url'),
+    'material': ('materials', 'purchase_url'),
+}
+# Concurrent product page fetches, and the overall request rate, when refreshing prices
+PRICE_REFRESH_WORKERS = 4
+PRICE_REFRESH_RATE = 2.0
+
+def record_price_observations(conn, offers, source=None):
+    """
+    Store (url, price) offers, one row per run of unchanged prices: a price
+    matching the URL's latest observation only moves its last_seen
+    forward. Returns how many new prices were recorded.
+    """
+    changed = 0
+    for url, price in offers:
+        price = catalogue_number(price)
+        if not url or price is None:
+            continue
+        updated = conn.execute('''
+            UPDATE price_observations SET last_seen = CURRENT_TIMESTAMP
+            WHERE id = (SELECT id FROM price_observations WHERE url = ? ORDER BY last_seen DESC, id DESC LIMIT 1)
+              AND price = ?
+        ''', (url, price)).rowcount
+        if not updated:
+            conn.execute('INSERT INTO price_observations (url, price, source) VALUES (?, ?, ?)',
+                         (url, price, source))
+            changed += 1
+    return changed
+
+def shopping_price_sql(ref):
+    """
+    SQL for a shopping list row's cost at its item's latest observed price:
+    price times the packs needed, using the pack size of a catalogue
+    product linked to the item (1 otherwise), or NULL if never priced
+    """
+    url = 'CASE ' + f'{ref}.item_type ' + ' '.join(
+        f"WHEN '{item_type}' THEN (SELECT {column} FROM {table} WHERE id = {ref}.item_id)"
+        for item_type, (table, column) in PRICED_ITEM_URLS.items()
+    ) + ' END'
+    packs = f'''(COALESCE({ref}.quantity, 1) / COALESCE((
+        SELECT pack_quantity FROM product_catalogue
+        WHERE item_type = {ref}.item_type AND item_id = {ref}.item_id LIMIT 1
+    ), 1))'''
+    return f'''(
+        SELECT price * MAX(1, CAST({packs} AS INTEGER) + ({packs} > CAST({packs} AS INTEGER)))
+        FROM price_observations
+        WHERE url = {url}
+        ORDER BY last_seen DESC, id DESC LIMIT 1
+    )'''
+
+def install_shopping_price_trigger(conn):
+    """Price new shopping list rows for inventory items from their latest observation"""
+    conn.execute('DROP TRIGGER IF EXISTS trg_shopping_list_price')
+    conn.execute(f'''
+        CREATE TRIGGER trg_shopping_list_price
+        AFTER INSERT ON shopping_list
+        WHEN NEW.estimated_cost IS NULL AND NEW.item_id IS NOT NULL
+        BEGIN
+            UPDATE shopping_list SET estimated_cost = {shopping_price_sql('NEW')}, auto_cost = 1
+            WHERE id = NEW.id AND {shopping_price_sql('NEW')} IS NOT NULL;
+        END
+    ''')
+
+def fill_estimated_costs(conn):
+    """Reprice unpurchased shopping list rows whose cost wasn't typed in; returns rows changed"""
+    return conn.execute(f'''
+        UPDATE shopping_list
+        SET estimated_cost = {shopping_price_sql('shopping_list')}, auto_cost = 1
+        WHERE purchased = 0 AND item_id IS NOT NULL
+          AND (estimated_cost IS NULL OR auto_cost = 1)
+          AND {shopping_price_sql('shopping_list')} IS NOT NULL
+          AND estimated_cost IS NOT {shopping_price_sql('shopping_list')}
+    ''').rowcount
+
+def linked_price_urls(conn):
+    """Every distinct product page URL linked from an inventory item"""
+    selects = ' UNION '.join(
+        f"SELECT {column} AS url FROM {table} WHERE {column} LIKE 'http%'"
+        for table, column in PRICED_ITEM_URLS.values()
+    )
+    return [row['url'] for row in conn.execute(f'SELECT url FROM ({selects}) ORDER BY url')]
+
+def extract_offer_price(soup):
+    """A product page's price from its JSON-LD offer or price meta tags, or None"""
+    for script in soup.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string or '')
+        except ValueError:
+            continue
+        for entry in data if isinstance(data, list) else [data]:
+            if not isinstance(entry, dict) or entry.get('@type') != 'Product':
+                continue
+            offers = entry.get('offers') or {}
+            for offer in offers if isinstance(offers, list) else [offers]:
+                price = catalogue_number(offer.get('price') or offer.get('lowPrice'))
+                if price is not None:
+                    return price
+    for attrs in ({'itemprop': 'price'}, {'property': 'product:price:amount'}):
+        tag = soup.find('meta', attrs=attrs)
+        if tag and catalogue_number(tag.get('content')) is not None:
+            return catalogue_number(tag.get('content'))
+    return None
+
+class RateLimiter:
+    """Spaces calls from any number of threads at least 1/rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+def refresh_prices(conn, urls=None, workers=PRICE_REFRESH_WORKERS, rate=PRICE_REFRESH_RATE):
+    """
+    Re-check the price on every linked product page (or just `urls`),
+    fetching up to `workers` pages at once over one shared session, no
+    faster than `rate` requests a second overall. Observations are
+    written from this thread, then the shopping list is repriced.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+
+    urls = linked_price_urls(conn) if urls is None else urls
+    limiter = RateLimiter(rate)
+    session = requests.Session()
+    session.headers.update(SCRAPE_HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def fetch(url):
+        limiter.wait()
+        try:
+            response = session.get(url, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            return url, None, str(e)
+        return url, extract_offer_price(BeautifulSoup(response.content, 'html.parser')), None
+
+    with session, ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fetch, urls))
+
+    priced = [(url, price) for url, price, _ in results if price is not None]
+    changed = record_price_observations(conn, priced, source='Refresh')
+    repriced = fill_estimated_costs(conn)
+    conn.commit()
+    return {
+        'checked': len(results),
+        'priced': len(priced),
+        'changed': changed,
+        'repriced': repriced,
+        'failed': {url: error or 'No price found' for url, price, error in results if price is None},
+    }
+
+# Workspaces with a price refresh running in the background
+_price_refreshes = set()
+_price_refresh_lock = threading.Lock()
+
+def start_price_refresh(name):
+    """
+    Run refresh_prices for a workspace in a background thread, keeping its
+    progress and summary in job_state. Returns False if one is already
+    running for that workspace.
+    """
+    with _price_refresh_lock:
+        if name in _price_refreshes:
+            return False
+        _price_refreshes.add(name)
+
+    def run():
+        new_audit_batch('POST /prices/refresh')
+        try:
+            with use_workspace(name):
+                conn = get_db()
+                try:
+                    set_job_state(conn, 'price_refresh_started_at', datetime.now().isoformat(timespec='seconds'))
+                    conn.commit()
+                    summary = refresh_prices(conn)
+                    set_job_state(conn, 'price_refresh_summary', json.dumps(summary))
+                    set_job_state(conn, 'price_refresh_finished_at', datetime.now().isoformat(timespec='seconds'))
+                    conn.commit()
+                finally:
+                    conn.close()
+        except Exception:
+            app.logger.exception('Price refresh failed for %s', name)
+        finally:
+            with _price_refresh_lock:
+                _price_refreshes.discard(name)
+
+    threading.Thread(target=run, name=f'price-refresh-{name}', daemon=True).start()
+    return True
+
+def price_refresh_status(conn):
+    """Whether a price refresh is running, and when the last one ran with its summary"""
+    summary = get_job_state(conn, 'price_refresh_summary')
+    return {
+        'running': current_workspace() in _price_refreshes,
+        'started_at': get_job_state(conn, 'price_refresh_started_at'),
+        'finished_at': get_job_state(conn, 'price_refresh_finished_at'),
+        'summary': json.loads(summary) if summary else None,
+    }
+
+@app.route('/prices/refresh', methods=['POST'])
+def refresh_prices_route():
+    """Start re-checking prices for every linked product in the background"""
+    conn = get_db()
+    count = len(linked_price_urls(conn))
+    conn.close()
+
+    if not count:
+        return redirect(url_for('shopping_list', toast='No items link to a product page', toast_type='error'))
+    if not start_price_refresh(current_workspace()):
+        return redirect(url_for('shopping_list', toast='A price refresh is already running', toast_type='error'))
+    return redirect(url_for('shopping_list', toast_type='success', toast=(
+        f'Checking {count} products in the background; costs update when it finishes'
+    )))
+
+@app.route('/api/prices/refresh', methods=['GET', 'POST'])
+def api_prices_refresh():
+    """Start a background price refresh (POST), or report on the running or last one (GET)"""
+    if request.method == 'POST' and not start_price_refresh(current_workspace()):
+        return jsonify({'success': False, 'error': 'A price refresh is already running'}), 409
+    conn = get_db()
+    status = price_refresh_status(conn)
+    conn.close()
+
+    return jsonify({'success': True, **status}), 202 if request.method == 'POST' else 200
+
+@app.route('/api/prices')
+def api_prices():
+    """Price history for one product page (?url=), or the latest price of every page seen"""
+    conn = get_db()
+    if request.args.get('url'):
+        rows = conn.execute('''
+            SELECT url, price, source, first_seen, last_seen FROM price_observations
+            WHERE url = ? ORDER BY last_seen DESC, id DESC
+        ''', (request.args['url'],)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT url, price, source, first_seen, last_seen FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY url ORDER BY last_seen DESC, id DESC) AS n
+                FROM price_observations
+            ) WHERE n = 1 ORDER BY url
+        ''').fetchall()
+    conn.close()
+
+    return jsonify({'success': True, 'prices': [dict(row) for row in rows]})
+
+@app.cli.command('refresh-prices')
+@click.option('--workers', default=PRICE_REFRESH_WORKERS, show_default=True, help='Pages fetched at once')
+@click.option('--rate', default=PRICE_REFRESH_RATE, show_default=True, help='Requests per second, overall')
+def refresh_prices_command(workers, rate):
+    """Re-check prices for every product page linked from the inventory"""
+    new_audit_batch('flask refresh-prices')
+    conn = get_db()
+    summary = refresh_prices(conn, workers=workers, rate=rate)
+    conn.close()
+    click.echo(f"Checked {summary['checked']} products: {summary['priced']} priced, "
+               f"{summary['changed']} new prices, {summary['repriced']} shopping list items repriced")
+    for url, error in summary['failed'].items():
+        click.echo(f'  {url}: {error}')
+
+# Database Maintenance Routes
+
+# How often each maintenance task runs, in seconds. Tasks only run once
+# the app has been idle for MAINTENANCE_IDLE_SECONDS.
+MAINTENANCE_TASKS = {
+    'optimize': 60 * 60,
+    'analyze': 24 * 60 * 60,
+    'vacuum': 24 * 60 * 60,
+    'integrity': 7 * 24 * 60 * 60,
+    # Last, so it also flushes what the other tasks wrote
+    'checkpoint': 15 * 60,
+}
+MAINTENANCE_IDLE_SECONDS = 5 * 60
+# Free pages below which an incremental vacuum isn't worth running
+MAINTENANCE_VACUUM_MIN_PAGES = 256
+# Most recent maintenance_runs rows kept
+MAINTENANCE_RUNS_KEPT = 1000
+
+# Representative reads timed before and after each task
+MAINTENANCE_PROBE_QUERIES = [
+    'SELECT COUNT(*) FROM tools',
+    'SELECT * FROM consumables WHERE base_quantity <= base_min_quantity',
+    "SELECT * FROM tools WHERE name LIKE '%dr%' OR brand LIKE '%dr%' ORDER BY name LIMIT 20",
+    'SELECT * FROM shopping_list WHERE purchased = 0 ORDER BY store, created_at',
+    'SELECT batch_id, COUNT(*) FROM audit_log WHERE id > (SELECT MAX(id) - 2000 FROM audit_log) GROUP BY batch_id',
+]
+
+_last_request_at = time.monotonic()
+
+@app.before_request
+def note_request_activity():
+    """Remember when the app was last used, so maintenance waits for a quiet spell"""
+    global _last_request_at
+    _last_request_at = time.monotonic()
+
+def maintenance_idle():
+    return time.monotonic() - _last_request_at >= MAINTENANCE_IDLE_SECONDS
+
+def database_stats(conn):
+    """Page counts, free pages, journal and vacuum modes and file sizes of the current database"""
+    path = workspace_db_path(current_workspace())
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'free_pages': free_pages,
+        'free_bytes': free_pages * page_size,
+        'journal_mode': conn.execute('PRAGMA journal_mode').fetchone()[0],
+        'auto_vacuum': ('none', 'full', 'incremental')[conn.execute('PRAGMA auto_vacuum').fetchone()[0]],
+        'file_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'wal_bytes': os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0,
+    }
+
+def latency_probe(conn, repeat=3):
+    """Best-of-`repeat` time in ms to run MAINTENANCE_PROBE_QUERIES"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for sql in MAINTENANCE_PROBE_QUERIES:
+            conn.execute(sql).fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3)
+
+def maintenance_checkpoint(conn):
+    wal_bytes = database_stats(conn)['wal_bytes']
+    busy, frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    if frames == -1:
+        return 'not in WAL mode'
+    if busy:
+        # A reader still needs the WAL; whatever it could copy has been
+        return f'checkpointed {checkpointed} of {frames} frames, readers busy'
+    return f'truncated {wal_bytes / 1024:.0f} KiB WAL'
+
+def maintenance_optimize(conn):
+    conn.execute('PRAGMA optimize')
+    return 'ok'
+
+def maintenance_analyze(conn):
+    conn.execute('ANALYZE')
+    conn.commit()
+    return 'ok'
+
+def maintenance_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # Existing databases need one full VACUUM to switch to incremental mode
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return 'switched to incremental auto-vacuum'
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if free_pages < MAINTENANCE_VACUUM_MIN_PAGES:
+        return f'{free_pages} free pages, skipped'
+    conn.execute(f'PRAGMA incremental_vacuum({free_pages})').fetchall()
+    conn.commit()
+    return f'released {free_pages} pages'
+
+def maintenance_integrity(conn):
+    problems = [row[0] for row in conn.execute('PRAGMA integrity_check(20)')]
+    if problems != ['ok']:
+        app.logger.error('Integrity check failed for %s: %s', current_workspace(), problems)
+    return '; '.join(problems)
+
+MAINTENANCE_FUNCTIONS = {
+    'optimize': maintenance_optimize,
+    'analyze': maintenance_analyze,
+    'vacuum': maintenance_vacuum,
+    'integrity': maintenance_integrity,
+    'checkpoint': maintenance_checkpoint,
+}
+
+def run_maintenance(conn, tasks=None, force=False):
+    """
+    Run the maintenance tasks that are due (or just `tasks`; `force` ignores
+    the intervals), recording each one's duration, page counts and probe
+    query latency before and after in maintenance_runs. Returns those rows.
+    """
+    now = datetime.now()
+    runs = []
+    for task, interval in MAINTENANCE_TASKS.items():
+        if tasks and task not in tasks:
+            continue
+        last_run = get_job_state(conn, f'maintenance_{task}_at')
+        if not force and last_run and (now - parse_timestamp(last_run)).total_seconds() < interval:
+            continue
+
+        # VACUUM and checkpoints can't run inside a transaction
+        conn.commit()
+        before = database_stats(conn)
+        probe_before = latency_probe(conn)
+        started = time.perf_counter()
+        result = MAINTENANCE_FUNCTIONS[task](conn)
+        duration = round((time.perf_counter() - started) * 1000, 3)
+        after = database_stats(conn)
+        run = {
+            'task': task,
+            'result': result,
+            'duration_ms': duration,
+            'pages_before': before['page_count'],
+            'pages_after': after['page_count'],
+            'free_pages_before': before['free_pages'],
+            'free_pages_after': after['free_pages'],
+            'probe_before_ms': probe_before,
+            'probe_after_ms': latency_probe(conn),
+        }
+        conn.execute('''
+            INSERT INTO maintenance_runs (task, result, duration_ms, pages_before, pages_after,
+                                          free_pages_before, free_pages_after, probe_before_ms, probe_after_ms)
+            VALUES (:task, :result, :duration_ms, :pages_before, :pages_after,
+                    :free_pages_before, :free_pages_after, :probe_before_ms, :probe_after_ms)
+        ''', run)
+        set_job_state(conn, f'maintenance_{task}_at', now.isoformat(timespec='seconds'))
+        conn.commit()
+        runs.append(run)
+
+    if runs:
+        conn.execute('DELETE FROM maintenance_runs WHERE id <= (SELECT MAX(id) FROM maintenance_runs) - ?',
+                     (MAINTENANCE_RUNS_KEPT,))
+        conn.commit()
+    return runs
+
+def maintenance_report(conn, limit=50):
+    """Database stats, when each task last ran and the most recent runs"""
+    return {
+        'database': database_stats(conn),
+        'last_run': {task: get_job_state(conn, f'maintenance_{task}_at') for task in MAINTENANCE_TASKS},
+        'runs': [dict(row) for row in conn.execute(
+            'SELECT * FROM maintenance_runs ORDER BY id DESC LIMIT ?', (limit,)
+        )],
+    }
+
+@app.route('/api/db/stats')
+def api_db_stats():
+    """Database size, free space and maintenance history as JSON"""
+    conn = get_db()
+    report = maintenance_report(conn, min(request.args.get('limit', 50, type=int), MAINTENANCE_RUNS_KEPT))
+    conn.close()
+
+    return jsonify({'success': True, **report})
+
+@app.route('/api/db/maintain', methods=['POST'])
+def api_db_maintain():
+    """Run maintenance now: {"tasks": [...]} (default all), {"force": false} to only run what's due"""
+    data = request.get_json(silent=True) or {}
+    tasks = data.get('tasks')
+    unknown = set(tasks or []) - set(MAINTENANCE_TASKS)
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown tasks: {', '.join(sorted(unknown))}"}), 400
+
+    conn = get_db()
+    runs = run_maintenance(conn, tasks, force=data.get('force', True))
+    conn.close()
+
+    return jsonify({'success': True, 'runs': runs})
+
+@app.cli.command('db-maintain')
+@click.option('--task', 'tasks', multiple=True, type=click.Choice(list(MAINTENANCE_TASKS)),
+              help='Run only this task (repeatable)')
+@click.option('--due', is_flag=True, help="Only run tasks whose interval has passed")
+def db_maintain_command(tasks, due):
+    """Checkpoint, optimize, analyze, vacuum and integrity-check the database"""
+    conn = get_db()
+    runs = run_maintenance(conn, tasks, force=not due)
+    stats = database_stats(conn)
+    conn.close()
+    for run in runs:
+        click.echo(f"{run['task']:<10} {run['duration_ms']:>9.1f} ms  pages {run['pages_before']} -> {run['pages_after']}  "
+                   f"probe {run['probe_before_ms']} -> {run['probe_after_ms']} ms  {run['result']}")
+    click.echo(f"{stats['page_count']} pages, {stats['free_pages']} free, "
+               f"{stats['file_bytes'] / 1024:.0f} KiB (+{stats['wal_bytes'] / 1024:.0f} KiB WAL)")
+
+# Favorites Routes
+
+@app.route('/api/favorite/toggle', methods=['POST'])
+def toggle_favorite():
+    """Toggle favorite status for an item"""
+    data = request.get_json()
+    item_type = data.get('item_type')
     item_id = data.get('item_id')
 
     if not item_type or not item_id:
@@ -1252,10 +6972,19 @@ def shopping_list():
     """View shopping list"""
     conn = get_db()
 
-    # Get all shopping list items
-    items = conn.execute('''
-        SELECT * FROM shopping_list
+    # Get all shopping list items, one line per inventory item: entries in
+    # units of the same kind are added up in base units and shown in the
+    # first entry's unit (the other columns come from that entry too)
+    items = conn.execute(f'''
+        SELECT MIN(id) AS id, item_name, item_type, item_id, unit, store, auto_cost, created_at,
+               CASE WHEN COUNT(*) = 1 THEN quantity
+                    ELSE ROUND(SUM(base_quantity) / {unit_factor_sql('unit')}, 6) END AS quantity,
+               COALESCE(SUM(estimated_cost), 0) AS estimated_cost,
+               GROUP_CONCAT(NULLIF(notes, ''), '; ') AS notes
+        FROM shopping_list
         WHERE purchased = 0
+        GROUP BY CASE WHEN item_id IS NULL THEN 'row ' || id
+                      ELSE item_type || ' ' || item_id || ' ' || base_unit END
         ORDER BY store, created_at
     ''').fetchall()
 
@@ -1267,43 +6996,66 @@ def shopping_list():
         ORDER BY purchased_date DESC
     ''').fetchall()
 
+    total_cost = conn.execute('''
+        SELECT COALESCE(SUM(estimated_cost), 0) FROM shopping_list WHERE purchased = 0
+    ''').fetchone()[0]
+
     # Group by store
     stores = {}
-    total_cost = 0
 
     for item in items:
         store = item['store'] or 'Other'
         if store not in stores:
             stores[store] = []
         stores[store].append(item)
-        if item['estimated_cost']:
-            total_cost += item['estimated_cost']
 
+    price_refresh = price_refresh_status(conn)
     conn.close()
-    return render_template('shopping_list.html', stores=stores, total_cost=total_cost, purchased_items=purchased_items)
+    return render_template('shopping_list.html', stores=stores, total_cost=total_cost, purchased_items=purchased_items,
+                           price_refresh=price_refresh)
+
+def restock_quantity(item):
+    """
+    How much to buy for a low stock row (with reorder_point/stockout_date
+    joined from stock_forecasts, and min_stock, the minimum in the stock
+    unit), and the shopping-list note explaining why.
+    """
+    min_quantity = item['min_stock'] or 0
+    reorder_point = math.ceil(item['reorder_point']) if item['reorder_point'] else 0
+    target = max(min_quantity, reorder_point)
+    # Rounded, as minimums converted from other units carry float noise
+    needed = round((target - item['quantity']) if target > item['quantity'] else target, 6)
+
+    if item['min_stock'] is not None and item['quantity'] <= item['min_stock']:
+        note = f"Low stock: {item['quantity']}/{item['min_stock']:g}"
+    else:
+        note = f"Forecast: runs out around {item['stockout_date']} (reorder at {reorder_point})"
+    return needed, note
 
 @app.route('/shopping-list/add-low-stock', methods=['POST'])
 def add_low_stock_to_list():
-    """Auto-add all low stock items to shopping list"""
+    """Auto-add all low stock and forecast-to-run-out items to shopping list"""
     conn = get_db()
+    update_forecasts(conn)
+
+    # Below the manual minimum (compared in base units, so a minimum may be
+    # in another unit than the stock), or at/below the forecast reorder point
+    low_stock_sql = '''
+        SELECT i.*, f.reorder_point, f.stockout_date, i.base_min_quantity / {unit_factor} AS min_stock
+        FROM {table} i
+        LEFT JOIN stock_forecasts f ON f.item_type = '{item_type}' AND f.item_id = i.id
+        WHERE i.base_quantity <= i.base_min_quantity
+           OR (f.reorder_point IS NOT NULL AND i.quantity <= f.reorder_point)
+    '''
 
     # Get low stock consumables
-    low_consumables = conn.execute('''
-        SELECT * FROM consumables
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
-    ''').fetchall()
+    low_consumables = conn.execute(low_stock_sql.format(table='consumables', item_type='consumable', unit_factor=unit_factor_sql('i.unit'))).fetchall()
 
     # Get low stock fasteners
-    low_fasteners = conn.execute('''
-        SELECT * FROM fasteners
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
-    ''').fetchall()
+    low_fasteners = conn.execute(low_stock_sql.format(table='fasteners', item_type='fastener', unit_factor='1')).fetchall()
 
     # Get low stock materials
-    low_materials = conn.execute('''
-        SELECT * FROM materials
-        WHERE min_quantity IS NOT NULL AND quantity <= min_quantity
-    ''').fetchall()
+    low_materials = conn.execute(low_stock_sql.format(table='materials', item_type='material', unit_factor=unit_factor_sql('i.unit'))).fetchall()
 
     added_count = 0
 
@@ -1316,11 +7068,11 @@ def add_low_stock_to_list():
         ).fetchone()
 
         if not existing:
-            needed = (item['min_quantity'] - item['quantity']) if item['min_quantity'] > item['quantity'] else item['min_quantity']
+            needed, note = restock_quantity(item)
             conn.execute('''
                 INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit, store, notes)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (item['name'], 'consumable', item['id'], needed, item['unit'], 'Bunnings', f"Low stock: {item['quantity']}/{item['min_quantity']}"))
+            ''', (item['name'], 'consumable', item['id'], needed, item['unit'], 'Bunnings', note))
             added_count += 1
 
     # Add fasteners
@@ -1331,12 +7083,12 @@ def add_low_stock_to_list():
         ).fetchone()
 
         if not existing:
-            needed = (item['min_quantity'] - item['quantity']) if item['min_quantity'] > item['quantity'] else item['min_quantity']
-            name = f"{item['fastener_type']} {item['diameter']}mm x {item['length']}mm" if item['length'] else f"{item['fastener_type']} {item['diameter']}mm"
+            needed, note = restock_quantity(item)
+            name = stocked_item_name('fastener', item)
             conn.execute('''
                 INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit, store, notes)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (name, 'fastener', item['id'], needed, 'pcs', 'Bunnings', f"Low stock: {item['quantity']}/{item['min_quantity']}"))
+            ''', (name, 'fastener', item['id'], needed, 'pcs', 'Bunnings', note))
             added_count += 1
 
     # Add materials
@@ -1347,11 +7099,11 @@ def add_low_stock_to_list():
         ).fetchone()
 
         if not existing:
-            needed = (item['min_quantity'] - item['quantity']) if item['min_quantity'] > item['quantity'] else item['min_quantity']
+            needed, note = restock_quantity(item)
             conn.execute('''
                 INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit, store, notes)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (item['name'], 'material', item['id'], needed, item['unit'], item['supplier'] or 'Bunnings', f"Low stock: {item['quantity']}/{item['min_quantity']}"))
+            ''', (item['name'], 'material', item['id'], needed, item['unit'], item['supplier'] or 'Bunnings', note))
             added_count += 1
 
     conn.commit()
@@ -1382,14 +7134,23 @@ def add_to_shopping_list():
 
     return redirect(url_for('shopping_list', toast='Item added to shopping list', toast_type='success'))
 
+# Ids of the entries shown as one shopping list line with entry ?: its
+# unpurchased entries for the same item in units of the same kind
+SHOPPING_LINE_IDS_SQL = '''
+    SELECT s.id FROM shopping_list s JOIN shopping_list t ON t.id = ?
+    WHERE s.id = t.id
+       OR (s.purchased = 0 AND t.purchased = 0 AND s.item_type = t.item_type
+           AND s.item_id = t.item_id AND s.base_unit = t.base_unit)
+'''
+
 @app.route('/shopping-list/mark-purchased/<int:item_id>', methods=['POST'])
 def mark_purchased(item_id):
     """Mark item as purchased"""
     conn = get_db()
-    conn.execute('''
+    conn.execute(f'''
         UPDATE shopping_list
         SET purchased = 1, purchased_date = ?
-        WHERE id = ?
+        WHERE id IN ({SHOPPING_LINE_IDS_SQL})
     ''', (datetime.now().strftime('%Y-%m-%d'), item_id))
     conn.commit()
     conn.close()
@@ -1400,7 +7161,7 @@ def mark_purchased(item_id):
 def delete_shopping_item(item_id):
     """Delete item from shopping list"""
     conn = get_db()
-    conn.execute('DELETE FROM shopping_list WHERE id = ?', (item_id,))
+    conn.execute(f'DELETE FROM shopping_list WHERE id IN ({SHOPPING_LINE_IDS_SQL})', (item_id,))
     conn.commit()
     conn.close()
 
@@ -1416,6 +7177,79 @@ def clear_purchased():
 
     return redirect(url_for('shopping_list', toast='Cleared purchased items', toast_type='info'))
 
-if __name__ == '__main__':
+# App Factory
+
+_app_prepared = False
+_app_prepared_lock = threading.Lock()
+
+def prepare_app():
+    """Create the upload and QR folders and cache compiled templates on disk, once"""
+    global _app_prepared
+    with _app_prepared_lock:
+        if _app_prepared:
+            return
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        os.makedirs(app.config['QR_FOLDER'], exist_ok=True)
+        os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_FOLDER'])
+        _app_prepared = True
+
+@app.before_request
+def prepare_app_on_first_request():
+    """Servers given `app` rather than create_app() (flask run, gunicorn app:app) get set up here"""
+    if not _app_prepared:
+        prepare_app()
+
+def create_app():
+    """
+    Get the app ready to serve: create the upload folders, bring the schema
+    up to date (a no-op once user_version is current; other workspaces are
+    brought up to date when first opened), cache compiled templates on disk
+    and build the static assets. Heavy libraries are imported on first use
+    rather than here.
+    """
+    prepare_app()
     init_db()
+    build_static_assets()
+    return app
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the bytecode cache ahead of the first request"""
+    create_app()
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    click.echo(f'Compiled {len(names)} templates into {app.config["TEMPLATE_CACHE_FOLDER"]}')
+
+@app.cli.command('benchmark-startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters to time')
+def benchmark_startup_command(runs):
+    """Time importing app.py and create_app() in fresh interpreters"""
+    import statistics
+    import subprocess
+    import sys
+
+    script = (
+        'import time; start = time.perf_counter(); import app; imported = time.perf_counter(); '
+        'app.create_app(); ready = time.perf_counter(); '
+        'client = app.app.test_client(); client.get("/"); served = time.perf_counter(); '
+        'print(imported - start, ready - imported, served - ready)'
+    )
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [app_dir, os.environ.get('PYTHONPATH')]))})
+        timings.append([float(value) for value in result.stdout.split()[-3:]])
+
+    for label, values in zip(('import', 'create_app', 'first request'), zip(*timings)):
+        click.echo(f'{label:>14}: median {statistics.median(values) * 1000:7.1f} ms, '
+                   f'min {min(values) * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    create_app()
+    # The debug reloader runs this twice; only the serving child sweeps
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_upload_gc()
     app.run(debug=True, host='0.0.0.0', port=5000)
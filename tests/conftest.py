@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as toolshed
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app against a fresh database and upload folder in tmp_path"""
+    for pool in toolshed._pools.values():
+        pool.close()
+    toolshed._pools.clear()
+
+    config = toolshed.app.config
+    saved = dict(config)
+    config.update(
+        TESTING=True,
+        DATABASE=str(tmp_path / 'tools.db'),
+        UPLOAD_FOLDER=str(tmp_path / 'static' / 'uploads'),
+        QR_FOLDER=str(tmp_path / 'static' / 'qr_codes'),
+        WORKSPACES_FOLDER=str(tmp_path / 'workspaces'),
+    )
+    os.makedirs(config['UPLOAD_FOLDER'])
+    toolshed.init_db()
+    yield toolshed.app
+
+    for pool in toolshed._pools.values():
+        pool.close()
+    toolshed._pools.clear()
+    config.clear()
+    config.update(saved)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db(app):
+    conn = toolshed.get_db()
+    yield conn
+    conn.close()
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import app as toolshed
+
+
+def test_depreciation_is_recomputed_each_day(db, monkeypatch):
+    db.execute("INSERT INTO tools (name, category, purchase_date, purchase_price) VALUES ('Drill', 'Power Tool', '2024-01-01', 200)")
+    db.commit()
+
+    class Clock(datetime):
+        now_value = datetime(2025, 1, 1)
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.now_value
+
+    monkeypatch.setattr(toolshed, 'datetime', Clock)
+    first = toolshed.get_analytics(db)['depreciation'][0]['current_value']
+    assert toolshed.get_analytics(db)['depreciation'][0]['current_value'] == first
+
+    Clock.now_value = datetime(2026, 1, 1)
+    assert toolshed.get_analytics(db)['depreciation'][0]['current_value'] < first
@@ -0,0 +1,35 @@
+import sqlite3
+
+import app as toolshed
+
+
+def test_fields_can_select_generated_base_unit_columns(client, db):
+    db.execute("INSERT INTO consumables (name, quantity, unit) VALUES ('Cable', 250, 'cm')")
+    db.commit()
+
+    response = client.get('/api/v1/consumables?fields=name,base_quantity,base_unit&base_unit=m')
+
+    assert response.status_code == 200
+    assert response.json['items'] == [{'id': 1, 'name': 'Cable', 'base_quantity': 2.5, 'base_unit': 'm'}]
+
+
+def test_generated_columns_are_not_writable(client):
+    response = client.post('/api/v1/consumables', json={'name': 'Cable', 'base_quantity': 3})
+
+    assert response.status_code == 400
+    assert 'base_quantity' in response.json['error']
+
+
+def test_columns_follow_each_database_schema(db, tmp_path):
+    assert 'usage_hours' in toolshed.api_columns(db, 'tools')
+
+    # Another workspace's database at an older schema
+    other = sqlite3.connect(tmp_path / 'other.db')
+    other.row_factory = sqlite3.Row
+    other.execute('CREATE TABLE tools (id INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+    assert toolshed.api_columns(other, 'tools') == {'id': False, 'name': True}
+
+    # A migration adding a column is picked up straight away
+    other.execute('ALTER TABLE tools ADD COLUMN usage_hours REAL')
+    assert 'usage_hours' in toolshed.api_columns(other, 'tools')
+    other.close()
@@ -0,0 +1,48 @@
+import app as toolshed
+
+
+def audit_rows(db):
+    return [tuple(row) for row in db.execute('SELECT batch_id, context, table_name, action FROM audit_log ORDER BY id')]
+
+
+def test_each_task_gets_its_own_batch(db):
+    for task in ('overdue loan sweep', 'overdue loan sweep'):
+        toolshed.new_audit_batch(f'background {task}')
+        db.execute("INSERT INTO tools (name) VALUES ('Drill')")
+        db.commit()
+
+    rows = audit_rows(db)
+    assert [row[1:] for row in rows] == [('background overdue loan sweep', 'tools', 'INSERT')] * 2
+    assert rows[0][0] is not None and rows[1][0] is not None
+    assert rows[0][0] != rows[1][0]
+    assert db.execute('SELECT COUNT(*) FROM audit_state').fetchone()[0] == 0
+
+
+def test_project_shortfall_is_one_undoable_batch(db):
+    db.execute("INSERT INTO projects (name) VALUES ('Bench')")
+    db.execute("INSERT INTO project_requirements (project_id, item_name, quantity) VALUES (1, 'Bolts', 4)")
+    db.execute("INSERT INTO project_requirements (project_id, item_name, quantity) VALUES (1, 'Glue', 1)")
+    db.commit()
+
+    toolshed.new_audit_batch('POST /projects/shop')
+    toolshed.push_project_shortfall(db, [1])
+    db.commit()
+
+    rows = [row for row in audit_rows(db) if row[2] == 'shopping_list']
+    assert len(rows) == 2
+    assert rows[0][0] is not None and rows[0][0] == rows[1][0]
+    assert rows[0][1] == 'POST /projects/shop'
+
+    toolshed.undo_audit_entries(db, db.execute('SELECT * FROM audit_log WHERE batch_id = ?', (rows[0][0],)).fetchall())
+    db.commit()
+    assert db.execute('SELECT COUNT(*) FROM shopping_list').fetchone()[0] == 0
+
+
+def test_explicit_transaction_is_tagged_and_cleared(db):
+    toolshed.new_audit_batch('flask import-catalogue')
+    db.execute('BEGIN IMMEDIATE')
+    db.execute("INSERT INTO tools (name) VALUES ('Drill')")
+    db.commit()
+
+    assert audit_rows(db)[0][1] == 'flask import-catalogue'
+    assert db.execute('SELECT COUNT(*) FROM audit_state').fetchone()[0] == 0
@@ -0,0 +1,43 @@
+import random
+
+import app as toolshed
+
+
+def ranked_by_hand(index, field, prefix, limit=10):
+    counts = index._counts.get(field, {})
+    matches = [value for value in counts if value.lower().startswith(prefix.lower())]
+    return sorted(matches, key=lambda value: (-counts[value], value.lower(), value))[:limit]
+
+
+def test_complete_ranks_like_a_full_scan():
+    index = toolshed.AutocompleteIndex()
+    index._loaded = True
+    rnd = random.Random(7)
+    values = [''.join(rnd.choice('abcAB') for _ in range(rnd.randint(1, 5))) for _ in range(500)]
+
+    for step in range(5000):
+        value = rnd.choice(values)
+        if rnd.random() < 0.7:
+            index._add('brand', value)
+        else:
+            index._remove('brand', value)
+        if step % 250 == 0:
+            for prefix in ('', 'a', 'B', 'ab', 'abc', 'x'):
+                assert index.complete('brand', prefix) == ranked_by_hand(index, 'brand', prefix)
+
+
+def test_index_matches_stored_rows_after_writes(client, db):
+    toolshed.autocomplete_index.load(db)
+    client.post('/tool/add', data={'name': 'Drill', 'brand': 'Ryobi', 'category': 'Power', 'location': 'Shed'})
+    client.post('/tool/add', data={'name': 'Sander', 'brand': 'Ozito', 'location': 'Shed'})
+    client.post('/api/v1/fasteners', json=[{'category': 'Screw', 'size': 6, 'location': 'Drawer 2'}])
+    client.patch('/api/v1/tools/2', json={'brand': 'Ryobi', 'model': 'R18'})
+    client.post('/api/bulk/tool', json={'action': 'location', 'ids': [1, 2], 'value': ' Garage '})
+    client.delete('/api/v1/fasteners', json={'ids': [1]})
+
+    fresh = toolshed.AutocompleteIndex()
+    fresh.load(db)
+    live = {field: counts for field, counts in toolshed.autocomplete_index._counts.items() if counts}
+    assert live == fresh._counts
+    assert toolshed.autocomplete_index.complete('location') == ['Garage']
+    assert toolshed.autocomplete_index.complete('brand') == ['Ryobi']
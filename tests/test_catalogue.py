@@ -0,0 +1,34 @@
+import io
+import json
+
+import pytest
+
+import app as toolshed
+
+
+@pytest.mark.parametrize('content', ['[1, 2]', '5', '"x"', '{"products": {"gtin": "1"}}', '[{"gtin": "1"}, null]'])
+def test_import_rejects_json_that_is_not_products(client, db, content):
+    response = client.post('/catalogue/import', data={'file': (io.BytesIO(content.encode()), 'products.json')})
+
+    assert response.status_code == 302
+    assert 'toast_type=error' in response.location
+    assert 'list+of+product+objects' in response.location
+    assert db.execute('SELECT COUNT(*) FROM product_catalogue').fetchone()[0] == 0
+
+
+def test_import_reads_wrapped_product_list(client, db):
+    products = {'products': [{'gtin': '4006381333931', 'name': 'Wood Glue 250ml'}]}
+    response = client.post('/catalogue/import', data={'file': (io.BytesIO(json.dumps(products).encode()), 'products.json')})
+
+    assert 'Imported+1+products' in response.location
+    assert db.execute('SELECT name FROM product_catalogue').fetchone()[0] == 'Wood Glue 250ml'
+
+
+def test_cli_import_reports_bad_file(app, tmp_path):
+    path = tmp_path / 'products.json'
+    path.write_text('[1, 2]')
+
+    result = app.test_cli_runner().invoke(args=['import-catalogue', str(path)])
+
+    assert result.exit_code == 1
+    assert 'list of product objects' in result.output
@@ -0,0 +1,39 @@
+import pytest
+
+import app as toolshed
+
+
+@pytest.mark.parametrize('unit', ['m', 'Metres', 'M', 'metre'])
+def test_stock_kept_as_total_length_in_any_spelling(db, unit):
+    # 12 m of 2.4 m lengths is five pieces, not twelve
+    db.execute('''
+        INSERT INTO materials (name, quantity, unit, dimensions_length, dimension_unit)
+        VALUES ('Pine 42x19', 12, ?, 2400, 'mm')
+    ''', (unit,))
+    db.commit()
+
+    plan = toolshed.plan_cut_list(db, [{'material_id': 1, 'length': 1000, 'quantity': 12}], kerf=0)
+
+    assert plan['materials'][0]['stock_available'] == 5
+    assert plan['materials'][0]['pieces_used'] == 5
+    assert len(plan['unplaced']) == 2
+
+    toolshed.deduct_cut_list_stock(db, plan)
+    db.commit()
+    assert db.execute('SELECT quantity FROM materials').fetchone()[0] == 0
+
+
+def test_stock_counted_in_pieces(db):
+    db.execute('''
+        INSERT INTO materials (name, quantity, unit, dimensions_length, dimension_unit)
+        VALUES ('Pine 42x19', 3, 'boards', 2.4, 'Metres')
+    ''')
+    db.commit()
+
+    plan = toolshed.plan_cut_list(db, [{'material_id': 1, 'length': 1.2, 'quantity': 3}], kerf=0)
+    toolshed.deduct_cut_list_stock(db, plan)
+    db.commit()
+
+    assert plan['materials'][0]['stock_size_mm'] == [2400]
+    assert plan['materials'][0]['pieces_used'] == 2
+    assert db.execute('SELECT quantity FROM materials').fetchone()[0] == 1
@@ -0,0 +1,38 @@
+import pytest
+
+import app as toolshed
+
+
+def add_tool(db, name, borrower=None, returned_at=None):
+    db.execute('INSERT INTO tools (name, brand) VALUES (?, ?)', (name, 'Makita'))
+    tool_id = db.execute('SELECT MAX(id) FROM tools').fetchone()[0]
+    if borrower:
+        db.execute('INSERT INTO loans (tool_id, borrower, lent_at, returned_at) VALUES (?, ?, ?, ?)',
+                   (tool_id, borrower, '2026-01-10', returned_at))
+    db.commit()
+    return tool_id
+
+
+def open_loans(db):
+    return db.execute('SELECT COUNT(*) FROM loans WHERE returned_at IS NULL').fetchone()[0]
+
+
+def test_merge_refuses_two_tools_out_on_loan(db):
+    keep = add_tool(db, 'Makita drill', borrower='Sam')
+    duplicate = add_tool(db, 'Makita drill', borrower='Alex')
+
+    with pytest.raises(ValueError, match='out on loan'):
+        toolshed.merge_items(db, 'tool', keep, [duplicate])
+
+    assert db.execute('SELECT COUNT(*) FROM tools').fetchone()[0] == 2
+    assert open_loans(db) == 2
+
+
+def test_merge_moves_loans_to_kept_tool(db):
+    keep = add_tool(db, 'Makita drill', borrower='Sam', returned_at='2026-01-12')
+    duplicate = add_tool(db, 'Makita drill', borrower='Alex')
+
+    assert toolshed.merge_items(db, 'tool', keep, [duplicate]) == 1
+
+    loans = db.execute('SELECT tool_id, borrower, returned_at FROM loans ORDER BY id').fetchall()
+    assert [tuple(loan) for loan in loans] == [(keep, 'Sam', '2026-01-12'), (keep, 'Alex', None)]
@@ -0,0 +1,35 @@
+import pytest
+
+import app as toolshed
+
+
+@pytest.mark.parametrize('size, expected', [
+    ('M6', (6.0, None, 1.0)),
+    ('M6x1.0', (6.0, None, 1.0)),
+    ('M6x0.75', (6.0, None, 0.75)),
+    ('M6x20', (6.0, 20.0, 1.0)),
+    # Short screws: the second number is longer than any pitch for the diameter
+    ('M3x4', (3.0, 4.0, 0.5)),
+    ('M2x3', (2.0, 3.0, 0.4)),
+    ('M4x4', (4.0, 4.0, 0.7)),
+    ('M6x1.0x20', (6.0, 20.0, 1.0)),
+    ('M8 x 1.25 x 30', (8.0, 30.0, 1.25)),
+    ('6', (6.0, None, None)),
+    ('1/4-20', (6.35, None, 1.27)),
+])
+def test_parse_fastener_spec(size, expected):
+    assert toolshed.parse_fastener_spec(size) == expected
+
+
+def test_length_field_wins_over_size(db):
+    assert toolshed.parse_fastener_spec('M6x1.0x20', '25') == (6.0, 25.0, 1.0)
+    assert toolshed.parse_fastener_spec(6, 20) == (6.0, 20.0, None)
+
+
+def test_short_screws_are_found_by_length(db):
+    db.execute("INSERT INTO fasteners (category, size, quantity) VALUES ('Socket Cap', 'M3x4', 10)")
+    toolshed.set_fastener_specs(db, 1, 'M3x4')
+    db.commit()
+
+    found = toolshed.nearest_fasteners(db, 3, 4)
+    assert [row['size'] for row in found] == ['M3x4']
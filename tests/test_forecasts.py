@@ -0,0 +1,56 @@
+import threading
+
+import app as toolshed
+
+
+def record_usage(db):
+    db.execute("INSERT INTO consumables (name, quantity, unit) VALUES ('Sanding Disc', 0, 'pcs')")
+    db.executemany('INSERT INTO stock_history (item_type, item_id, quantity, delta, recorded_at) VALUES (?, ?, ?, ?, ?)', [
+        ('consumable', 1, 50, 50, '2026-01-01 09:00:00'),
+        ('consumable', 1, 40, -10, '2026-01-06 09:00:00'),
+        ('consumable', 1, 34, -6, '2026-01-08 09:00:00'),
+    ])
+    db.commit()
+
+
+def forecast(db):
+    return tuple(db.execute('SELECT quantity, usage_rate, usage_variance, stockout_date FROM stock_forecasts').fetchone())
+
+
+def test_concurrent_folds_count_each_change_once(app, db, monkeypatch):
+    record_usage(db)
+    toolshed.update_forecasts(db)
+    expected = forecast(db)
+    db.execute('DELETE FROM stock_forecasts')
+    db.execute("DELETE FROM job_state WHERE name = 'forecast_watermark'")
+    db.commit()
+
+    # Both folds read the old watermark before either writes
+    barrier = threading.Barrier(2)
+    read_state = toolshed.get_job_state
+    first_read = threading.local()
+
+    def get_job_state(conn, name, default=None):
+        value = read_state(conn, name, default)
+        if name == 'forecast_watermark' and not getattr(first_read, 'done', False):
+            first_read.done = True
+            barrier.wait(timeout=5)
+        return value
+
+    monkeypatch.setattr(toolshed, 'get_job_state', get_job_state)
+    folded = []
+
+    def fold():
+        with app.app_context():
+            conn = toolshed.get_db()
+            folded.append(toolshed.update_forecasts(conn))
+            conn.close()
+
+    threads = [threading.Thread(target=fold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert min(folded) == 0 and max(folded) > 0
+    assert forecast(db) == expected
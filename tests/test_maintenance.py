@@ -0,0 +1,21 @@
+from datetime import date
+
+import app as toolshed
+
+
+def test_due_maintenance_uses_local_date(db):
+    db.execute("INSERT INTO tools (name) VALUES ('Chainsaw')")
+    db.executemany('INSERT INTO maintenance_schedules (tool_id, task, interval_days, next_due) VALUES (1, ?, 30, ?)', [
+        ('Sharpen chain', '2026-03-10'),
+        ('Clean air filter', '2026-03-20'),
+        ('Replace bar', '2026-03-21'),
+    ])
+    db.commit()
+
+    due = toolshed.due_maintenance(db, days=10, today=date(2026, 3, 10))
+    assert [(row['task'], row['days_left']) for row in due] == [('Sharpen chain', 0), ('Clean air filter', 10)]
+
+    # Just after local midnight the first task is a day overdue, whatever the UTC date
+    due = toolshed.due_maintenance(db, days=10, today=date(2026, 3, 11))
+    assert [(row['task'], row['days_left']) for row in due] == [
+        ('Sharpen chain', -1), ('Clean air filter', 9), ('Replace bar', 10)]
@@ -0,0 +1,109 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+import app as toolshed
+
+PRODUCT_PAGE = '''<html><head>
+<script type="application/ld+json">
+{"@context": "https://schema.org", "@type": "Product", "name": "Sanding Disc 125mm 80G",
+ "offers": {"@type": "Offer", "price": "%s", "priceCurrency": "NZD"}}
+</script>
+</head><body>Sanding Disc</body></html>'''
+
+
+class StubShopHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /product/<price> as a product page at that price; anything else is a 404"""
+
+    def do_GET(self):
+        if not self.path.startswith('/product/'):
+            self.send_error(404)
+            return
+        body = (PRODUCT_PAGE % self.path.rsplit('/', 1)[1]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def shop():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubShopHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def add_sanding_discs(db, url):
+    db.execute('INSERT INTO consumables (name, quantity, unit, purchase_url) VALUES (?, 2, ?, ?)',
+               ('Sanding Disc 125mm 80G', 'pcs', url))
+    db.commit()
+    return db.execute('SELECT MAX(id) FROM consumables').fetchone()[0]
+
+
+def test_refresh_records_price_and_costs_shopping_list(db, shop):
+    url = f'{shop}/product/12.50'
+    consumable_id = add_sanding_discs(db, url)
+    add_sanding_discs(db, f'{shop}/missing')
+
+    summary = toolshed.refresh_prices(db, rate=0)
+
+    assert summary['checked'] == 2
+    assert summary['changed'] == 1
+    assert list(summary['failed']) == [f'{shop}/missing']
+    rows = db.execute('SELECT url, price, source FROM price_observations').fetchall()
+    assert [tuple(row) for row in rows] == [(url, 12.5, 'Refresh')]
+
+    # The insert trigger costs new entries for the item from the latest price
+    db.execute('''
+        INSERT INTO shopping_list (item_name, item_type, item_id, quantity, unit)
+        VALUES ('Sanding Disc 125mm 80G', 'consumable', ?, 3, 'pcs')
+    ''', (consumable_id,))
+    db.commit()
+    entry = db.execute('SELECT estimated_cost, auto_cost FROM shopping_list').fetchone()
+    assert tuple(entry) == (37.5, 1)
+
+
+def test_refresh_reprices_auto_costs_but_not_typed_ones(db, shop):
+    consumable_id = add_sanding_discs(db, f'{shop}/product/10')
+    toolshed.refresh_prices(db, rate=0)
+    for cost in (None, 4.0):
+        db.execute('''
+            INSERT INTO shopping_list (item_name, item_type, item_id, quantity, estimated_cost)
+            VALUES ('Sanding Disc 125mm 80G', 'consumable', ?, 1, ?)
+        ''', (consumable_id, cost))
+    db.commit()
+
+    db.execute('UPDATE consumables SET purchase_url = ?', (f'{shop}/product/11',))
+    db.commit()
+    summary = toolshed.refresh_prices(db, rate=0)
+
+    assert summary['repriced'] == 1
+    costs = db.execute('SELECT estimated_cost, auto_cost FROM shopping_list ORDER BY id').fetchall()
+    assert [tuple(row) for row in costs] == [(11.0, 1), (4.0, 0)]
+
+
+def test_refresh_route_runs_in_background(client, db, shop):
+    add_sanding_discs(db, f'{shop}/product/7.25')
+
+    response = client.post('/prices/refresh')
+    assert response.status_code == 302
+    assert 'background' in response.location
+
+    deadline = time.monotonic() + 10
+    status = client.get('/api/prices/refresh').json
+    while status['running'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+        status = client.get('/api/prices/refresh').json
+
+    assert not status['running']
+    assert status['summary']['changed'] == 1
+    assert db.execute('SELECT price FROM price_observations').fetchone()[0] == 7.25
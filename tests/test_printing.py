@@ -0,0 +1,118 @@
+import itertools
+import queue
+import socket
+import socketserver
+import threading
+
+import pytest
+
+import app as toolshed
+
+BASE_URL = 'http://toolshed.test/'
+ITEM = {'type': 'tool', 'id': 3, 'name': 'Drill', 'brand': 'Ryobi', 'category': 'Power', 'location': 'Shed > Bay 1'}
+
+
+class RecordingHandler(socketserver.BaseRequestHandler):
+    """Reads a whole print job, as a raw port-9100 printer would"""
+
+    def handle(self):
+        chunks = []
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+        self.server.jobs.put(b''.join(chunks))
+
+
+@pytest.fixture
+def fake_printer():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RecordingHandler)
+    server.daemon_threads = True
+    server.jobs = queue.Queue()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closed_port():
+    """A local port with nothing listening on it"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_zpl_job_reaches_printer(fake_printer):
+    host, port = fake_printer.server_address
+    sent = toolshed.send_to_printer(toolshed.render_labels([ITEM], 'zpl', BASE_URL), host, port)
+
+    job = fake_printer.jobs.get(timeout=5)
+    assert job == toolshed.render_zpl_label(ITEM, BASE_URL)
+    assert sent == len(job)
+    assert job.startswith(b'^XA^CI28') and job.endswith(b'^XZ\n')
+    assert b'^GFA,' in job
+    assert b'^FDDrill^FS' in job
+    assert b'^FDTool #3^FS' in job
+
+
+def test_escpos_job_reaches_printer(fake_printer):
+    host, port = fake_printer.server_address
+    sent = toolshed.send_to_printer(toolshed.render_labels([ITEM, ITEM], 'escpos', BASE_URL), host, port)
+
+    job = fake_printer.jobs.get(timeout=5)
+    label = toolshed.render_escpos_label(ITEM, BASE_URL)
+    assert job == b'\x1b@' + label + label
+    assert sent == len(job)
+
+    bytes_per_row, height, raster = toolshed.qr_raster(f'{BASE_URL}scan/tool/3',
+                                                       toolshed.LABEL_HEIGHT_DOTS - 2 * toolshed.LABEL_MARGIN_DOTS)
+    header = b'\x1dv0\x00' + bytes_per_row.to_bytes(2, 'little') + height.to_bytes(2, 'little')
+    assert label.startswith(b'\x1ba\x01' + header + raster)
+    assert b'\x1bE\x01Drill\x1bE\x00\n' in label
+    assert label.endswith(b'\x1bd\x03\x1dV\x01')
+
+
+def test_print_route_streams_to_configured_printer(app, client, db, fake_printer):
+    db.execute("INSERT INTO tools (name, brand) VALUES ('Drill', 'Ryobi')")
+    db.commit()
+    app.config['LABEL_PRINTER_HOST'], app.config['LABEL_PRINTER_PORT'] = fake_printer.server_address
+
+    response = client.post('/labels/print', data={'tools[]': '1', 'format': 'zpl', 'send': '1'})
+
+    job = fake_printer.jobs.get(timeout=5)
+    assert response.status_code == 200
+    assert response.json == {'success': True, 'labels': 1, 'bytes': len(job)}
+    assert b'^FDDrill^FS' in job
+
+
+def test_connection_refused(closed_port):
+    with pytest.raises(ConnectionRefusedError):
+        toolshed.send_to_printer(toolshed.render_labels([ITEM], 'zpl', BASE_URL), '127.0.0.1', closed_port)
+
+
+def test_print_route_reports_refused_printer(app, client, db, closed_port):
+    db.execute("INSERT INTO tools (name) VALUES ('Drill')")
+    db.commit()
+    app.config['LABEL_PRINTER_HOST'], app.config['LABEL_PRINTER_PORT'] = '127.0.0.1', closed_port
+
+    response = client.post('/labels/print', data={'tools[]': '1', 'send': '1'})
+
+    assert response.status_code == 502
+    assert response.json['success'] is False
+    assert response.json['error'].startswith('Printer unreachable')
+
+
+def test_stalled_printer_times_out():
+    # Accepts the connection but never reads, so the socket buffers fill up
+    with socket.socket() as listener:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        host, port = listener.getsockname()
+
+        chunks = itertools.repeat(b'\0' * 65536, 4096)
+        with pytest.raises(socket.timeout):
+            toolshed.send_to_printer(chunks, host, port, timeout=0.2)
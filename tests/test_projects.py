@@ -0,0 +1,52 @@
+import app as toolshed
+
+
+def add_project_with_timber(db, stock_quantity, stock_unit='m'):
+    db.execute("INSERT INTO projects (name) VALUES ('Bench')")
+    db.execute("INSERT INTO materials (name, quantity, unit) VALUES ('Pine 42x19', ?, ?)", (stock_quantity, stock_unit))
+    db.commit()
+
+
+def add_requirement(client, **form):
+    return client.post('/project/1/requirement/add', data=form)
+
+
+def test_requirements_are_compared_in_base_units(client, db):
+    add_project_with_timber(db, 2.4)
+    add_requirement(client, item='material:1', quantity='2400', unit='mm')
+    assert toolshed.project_feasibility(db)[0]['buildable'] == 1
+
+    add_requirement(client, item='material:1', quantity='300', unit='cm')
+    feasibility = toolshed.project_feasibility(db)[0]
+    assert (feasibility['buildable'], feasibility['missing_count']) == (0, 1)
+
+
+def test_shortfall_is_added_in_stock_units(client, db):
+    add_project_with_timber(db, 1)
+    add_requirement(client, item='material:1', quantity='1500', unit='mm')
+    add_requirement(client, item_name='Wood glue')
+
+    assert toolshed.push_project_shortfall(db, [1]) == 2
+    db.commit()
+    rows = db.execute('SELECT item_name, quantity, unit FROM shopping_list ORDER BY item_name').fetchall()
+    assert [tuple(row) for row in rows] == [('Pine 42x19', 0.5, 'm'), ('Wood glue', 1, None)]
+
+
+def test_requirement_form_is_validated(client, db):
+    add_project_with_timber(db, 2)
+
+    for form, message in [
+        ({'item': 'bogus:1'}, 'Unknown+item'),
+        ({'item': 'material:x'}, 'Unknown+item'),
+        ({'item': 'material:9'}, 'no+longer+exists'),
+        ({}, 'Choose+an+item'),
+        ({'item': 'material:1', 'quantity': 'lots'}, 'must+be+a+number'),
+        ({'item': 'material:1', 'quantity': '0'}, 'more+than+zero'),
+        ({'item': 'material:1', 'unit': 'kg'}, 'stock+counted+in+m'),
+    ]:
+        response = add_requirement(client, **form)
+        assert 'toast_type=error' in response.location and message in response.location, form
+
+    response = client.post('/project/7/requirement/add', data={'item_name': 'Glue'})
+    assert 'toast_type=error' in response.location
+    assert db.execute('SELECT COUNT(*) FROM project_requirements').fetchone()[0] == 0
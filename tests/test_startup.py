@@ -0,0 +1,17 @@
+import os
+
+import app as toolshed
+
+
+def test_first_request_prepares_app_served_without_factory(app, client, tmp_path, monkeypatch):
+    # As under `flask run` or `gunicorn app:app`, where create_app() never runs
+    monkeypatch.setattr(toolshed, '_app_prepared', False)
+    monkeypatch.setattr(app.jinja_env, 'bytecode_cache', None)
+    app.config['QR_FOLDER'] = str(tmp_path / 'static' / 'qr_codes')
+    app.config['TEMPLATE_CACHE_FOLDER'] = str(tmp_path / 'template_cache')
+
+    assert client.get('/').status_code == 200
+
+    assert os.path.isdir(app.config['QR_FOLDER'])
+    assert isinstance(app.jinja_env.bytecode_cache, toolshed.FileSystemBytecodeCache)
+    assert os.listdir(app.config['TEMPLATE_CACHE_FOLDER'])
@@ -0,0 +1,87 @@
+import io
+import os
+import time
+
+from werkzeug.datastructures import FileStorage
+
+import app as toolshed
+
+PHOTO = b'not really a jpeg, but the GC only cares about bytes'
+
+
+def upload(db, data=PHOTO):
+    return toolshed.save_upload(db, FileStorage(stream=io.BytesIO(data), filename='drill.jpg'))
+
+
+def age_file(path, minutes):
+    stamp = time.time() - minutes * 60
+    os.utime(toolshed.upload_file_path(path), (stamp, stamp))
+
+
+def expire_orphans(db):
+    db.execute("UPDATE images SET orphaned_at = datetime('now', '-2 hours') WHERE refcount <= 0")
+    db.commit()
+
+
+def test_reuploading_an_expired_orphan_keeps_it(db):
+    path = upload(db)
+    expire_orphans(db)
+
+    assert upload(db) == path
+    toolshed.collect_orphaned_uploads(db)
+
+    assert os.path.exists(toolshed.upload_file_path(path))
+    assert db.execute('SELECT COUNT(*) FROM images WHERE path = ?', (path,)).fetchone()[0] == 1
+
+
+def test_upload_from_rolled_back_request_is_reclaimed(db):
+    path = upload(db)
+    db.execute("INSERT INTO tools (name, image_path) VALUES ('Drill', ?)", (path,))
+    db.rollback()
+    expire_orphans(db)
+
+    swept = toolshed.collect_orphaned_uploads(db)
+
+    assert swept == {'files': 1, 'bytes': len(PHOTO)}
+    assert not os.path.exists(toolshed.upload_file_path(path))
+
+
+class FetchedRows(list):
+    def fetchone(self):
+        return self[0] if self else None
+
+
+def test_gc_between_lookup_and_insert_loses_nothing(db, monkeypatch):
+    path = upload(db)
+    expire_orphans(db)
+    execute = toolshed.PooledConnection.execute
+
+    def execute_then_collect(conn, sql, parameters=()):
+        if not sql.startswith('SELECT path FROM images WHERE hash'):
+            return execute(conn, sql, parameters)
+        # The GC runs on another connection once the upload has found the old row
+        rows = FetchedRows(execute(conn, sql, parameters).fetchall())
+        gc_conn = toolshed.get_db()
+        assert toolshed.collect_orphaned_uploads(gc_conn)['files'] == 1
+        gc_conn.close()
+        return rows
+
+    monkeypatch.setattr(toolshed.PooledConnection, 'execute', execute_then_collect)
+    assert upload(db) == path
+
+    assert os.path.exists(toolshed.upload_file_path(path))
+    assert db.execute('SELECT COUNT(*) FROM images WHERE path = ?', (path,)).fetchone()[0] == 1
+
+
+def test_gc_sweeps_old_unregistered_files(db):
+    kept = upload(db)
+    age_file(kept, 120)
+    for name, minutes in (('stray-old.jpg', 120), ('stray-new.jpg', 5)):
+        with open(toolshed.upload_file_path(f'uploads/{name}'), 'wb') as f:
+            f.write(b'x' * 10)
+        age_file(f'uploads/{name}', minutes)
+
+    swept = toolshed.collect_orphaned_uploads(db)
+
+    assert swept == {'files': 1, 'bytes': 10}
+    assert sorted(os.listdir(toolshed.upload_folder())) == sorted([kept.split('/')[1], 'stray-new.jpg'])